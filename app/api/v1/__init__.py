@@ -1,6 +1,6 @@
 
 from flask import Blueprint
-from app.api.v1 import test, predict_buildings, buia, train, predict, wmts, geojson, tools
+from app.api.v1 import test, predict_buildings, buia, train, predict, wmts, geojson, tools, tiles
 
 
 def create_blueprint_v1():
@@ -14,5 +14,6 @@ def create_blueprint_v1():
     wmts.api.register(bp_v1)
     geojson.api.register(bp_v1)
     tools.api.register(bp_v1)
+    tiles.api.register(bp_v1)
 
     return bp_v1
@@ -0,0 +1,25 @@
+import os
+import mercantile
+from flask import Response, abort
+from app.libs.redprint import Redprint
+from app.config import setting as SETTING
+from robosat_pink.stores.core import store_type, store_open
+api = Redprint('tiles')
+
+MIMETYPES = {"png": "image/png", "webp": "image/webp", "jpg": "image/jpeg", "tiff": "image/tiff"}
+
+
+@api.route('/<store>/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def tiles(store, z, x, y):
+    """Serve a tile, straight from a .pack, .mbtiles or .gpkg store file, in the dataset dir"""
+    path = os.path.join(SETTING.ROBOSAT_DATASET_PATH, os.path.basename(store))
+    if not store_type(path) or not os.path.isfile(path):
+        abort(404)
+
+    tile = mercantile.Tile(x, y, z)
+    store = store_open(path)
+    data = store.get(tile)
+    if data is None:
+        abort(404)
+
+    return Response(data, mimetype=MIMETYPES.get(store.ext(tile), "application/octet-stream"))
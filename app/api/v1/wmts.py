@@ -1,22 +1,28 @@
-import requests
-from flask import request, Response
+from flask import request, Response, jsonify, abort
 from app.libs.redprint import Redprint
 from app.config import setting as SETTING
+from robosat_pink.geoc.proxy import TileProxy
 api = Redprint('wmts')
 
+proxy = TileProxy({"tdt": SETTING.URL_TDT, "google": SETTING.URL_GOOGLE},
+                  SETTING.WMTS_CACHE_PATH, SETTING.WMTS_CACHE_MB << 20)
 
-@api.route('/<z>/<x>/<y>', methods=['GET'])
+
+@api.route('/<int:z>/<int:x>/<int:y>', methods=['GET'])
 def wmts(x, y, z):
-    map = request.args.get("map")
-    if not x or not y or not z:
-        return None
-    if map and (map != "tdt" or map != "google"):
+    map = request.args.get("map") or "tdt"
+    if map not in ("tdt", "google"):
         return "地图类型设置错误"
-    url = SETTING.URL_TDT
-    url_google = SETTING.URL_GOOGLE
-    if map == 'google':
-        url = url_google
-    print(url.format(x=x, y=y, z=z))
-    image = requests.get(url.format(x=x, y=y, z=z))
 
-    return Response(image, mimetype='image/jpeg')
+    tile = proxy.get(map, z, x, y)
+    if tile is None:
+        abort(502)
+
+    data, mimetype = tile
+    return Response(data, mimetype=mimetype)
+
+
+@api.route('/stats', methods=['GET'])
+def stats():
+    """Proxy cache counters and hit rate"""
+    return jsonify(proxy.stats())
@@ -107,13 +107,14 @@ class BufferedSlippyMapDirectory(torch.utils.data.Dataset):
         self.size = size
         self.overlap = overlap
         self.tiles = list(tiles_from_slippy_map(root))
+        self.paths = dict(self.tiles)
 
     def __len__(self):
         return len(self.tiles)
 
     def __getitem__(self, i):
         tile, path = self.tiles[i]
-        image = buffer_tile_image(tile, self.tiles, overlap=self.overlap, tile_size=self.size)
+        image = buffer_tile_image(tile, self.paths, overlap=self.overlap, tile_size=self.size)
 
         if self.transform is not None:
             image = self.transform(image)
@@ -12,9 +12,12 @@ import csv
 import io
 import os
 
+import numpy as np
 from PIL import Image
 import mercantile
 
+from robosat_pink.cache import tile_cached
+
 
 def pixel_to_location(tile, dx, dy):
     """Converts a pixel in a tile to a coordinate.
@@ -154,11 +157,17 @@ def adjacent_tile(tile, dx, dy, tiles):
 
     try:
         path = tiles[other]
-        return Image.open(path).convert("RGB")
+        return Image.fromarray(tile_cached(path, tile_image))
     except KeyError:
         return None
 
 
+def tile_image(path):
+    """Decodes a tile image, as a RGB numpy array, to be shared through the decoded tiles cache."""
+
+    return np.array(Image.open(path).convert("RGB"))
+
+
 def buffer_tile_image(tile, tiles, overlap, tile_size, nodata=0):
     """Buffers a tile image adding borders on all sides based on adjacent tiles.
 
@@ -174,7 +183,7 @@ def buffer_tile_image(tile, tiles, overlap, tile_size, nodata=0):
       It's size is `tile_size` + 2 * `overlap` pixel for each side.
     """
 
-    tiles = dict(tiles)
+    tiles = tiles if isinstance(tiles, dict) else dict(tiles)
     x, y, z = map(int, [tile.x, tile.y, tile.z])
 
     # Todo: instead of nodata we should probably mirror the center image
@@ -182,7 +191,7 @@ def buffer_tile_image(tile, tiles, overlap, tile_size, nodata=0):
     composite = Image.new(mode="RGB", size=(composite_size, composite_size), color=nodata)
 
     path = tiles[tile]
-    center = Image.open(path).convert("RGB")
+    center = Image.fromarray(tile_cached(path, tile_image))
     composite.paste(center, box=(overlap, overlap))
 
     top_left = adjacent_tile(tile, -1, -1, tiles)
@@ -0,0 +1,188 @@
+"""Process wide, bytes budgeted, LRU cache of decoded tiles.
+
+   Budget in MB set by RSP_CACHE_MB env var [default: 256, 0 to disable].
+   Optional shared memory tier, for multi workers DataLoaders, set by RSP_CACHE_SHM env var as a tmpfs dir path
+   (e.g /dev/shm/rsp), with its own budget in MB set by RSP_CACHE_SHM_MB env var [default: 1024].
+   Least recently used shm entries are evicted over budget, and the shm dir removed on exit by the process creating it.
+"""
+
+import os
+import atexit
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from robosat_pink.stores.core import store_split
+
+
+class TilesCache:
+    def __init__(self, max_bytes, shm_dir=None, shm_max_bytes=0):
+        """Create a LRU cache, holding at most max_bytes of decoded arrays, and optionaly a shared memory tier."""
+
+        self.max_bytes = max_bytes
+        self.shm_dir = os.path.expanduser(shm_dir) if shm_dir else None
+        self.shm_max_bytes = shm_max_bytes
+        self.shm_bytes = None
+        self.shm_writes = 0
+        self.shm_owner = None
+
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.shm_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if self.shm_dir:
+            if not os.path.isdir(self.shm_dir):
+                os.makedirs(self.shm_dir, exist_ok=True)
+                self.shm_owner = os.getpid()  # forked workers inherit the cache, but not its ownership
+
+    def get(self, path, loader, *args):
+        """Return loader(path, *args), decoded once, as long as path remains unchanged (same mtime). Read only array."""
+
+        try:
+            split = store_split(path)
+            key = (os.path.abspath(path), os.stat(split[0] if split else path).st_mtime_ns, loader.__name__, repr(args))
+        except (OSError, ValueError):
+            return loader(path, *args)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        array = self._shm_get(key)
+        if array is not None:
+            with self.lock:
+                self.shm_hits += 1
+            return array
+
+        array = loader(path, *args)
+        with self.lock:
+            self.misses += 1
+
+        if array is None:
+            return None
+
+        array.flags.writeable = False
+        self._put(key, array)
+        self._shm_put(key, array)
+
+        return array
+
+    def _put(self, key, array):
+
+        if array.nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = array
+                self.bytes += array.nbytes
+
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+    def _shm_path(self, key):
+        return os.path.join(self.shm_dir, hashlib.sha1(repr(key).encode()).hexdigest() + ".npy")
+
+    def _shm_get(self, key):
+
+        if not self.shm_dir:
+            return None
+
+        try:
+            path = self._shm_path(key)
+            array = np.load(path, mmap_mode="r")  # pages shared by every worker
+            os.utime(path)  # recently used, as mtime
+            return array
+        except (OSError, ValueError):
+            return None
+
+    def _shm_put(self, key, array):
+
+        if not self.shm_dir:
+            return
+
+        if array.nbytes > self.shm_max_bytes:
+            return
+
+        with self.lock:
+            if self.shm_bytes is None or self.shm_writes % 64 == 0:  # regularly, account other workers writes too
+                self.shm_bytes = sum(entry.stat().st_size for entry in os.scandir(self.shm_dir) if entry.is_file())
+            if self.shm_bytes + array.nbytes > self.shm_max_bytes:
+                self.shm_bytes = self._shm_evict(self.shm_max_bytes - array.nbytes)
+            self.shm_bytes += array.nbytes
+            self.shm_writes += 1
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.shm_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fp:
+                np.save(fp, array)
+            os.replace(tmp, self._shm_path(key))  # atomic, as concurrent workers could read it
+        except OSError:
+            pass
+
+    def _shm_evict(self, max_bytes):
+        """Remove least recently used shm files, until they fit in max_bytes. Return their remaining size."""
+
+        entries = []
+        for entry in os.scandir(self.shm_dir):
+            try:
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            except OSError:
+                pass  # already evicted by another worker
+
+        size = sum(entry[1] for entry in entries)
+        for _, nbytes, path in sorted(entries):
+            if size <= max_bytes:
+                break
+            try:
+                os.remove(path)  # still mapped arrays remain readable
+            except OSError:
+                pass
+            size -= nbytes
+
+        return size
+
+    def stats(self):
+        """Return cache counters, for the current process."""
+
+        with self.lock:
+            counters = {"hits": self.hits, "shm_hits": self.shm_hits, "misses": self.misses}
+            return {**counters, "entries": len(self.entries), "bytes": self.bytes}
+
+    def clear(self):
+
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def close(self):
+        """Remove the shm tier dir, if created by this very process."""
+
+        if self.shm_owner == os.getpid():
+            shutil.rmtree(self.shm_dir, ignore_errors=True)
+            self.shm_owner = None
+
+
+tiles_cache = TilesCache(
+    int(os.environ.get("RSP_CACHE_MB", 256)) << 20,
+    os.environ.get("RSP_CACHE_SHM"),
+    int(os.environ.get("RSP_CACHE_SHM_MB", 1024)) << 20,
+)
+atexit.register(tiles_cache.close)
+
+
+def tile_cached(path, loader, *args):
+    """Return loader(path, *args) result, from the process wide decoded tiles cache."""
+
+    return tiles_cache.get(path, loader, *args)
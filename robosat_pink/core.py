@@ -11,6 +11,7 @@ import webcolors
 from pathlib import Path
 
 from robosat_pink.tiles import tile_pixel_to_location, tiles_to_geojson
+from robosat_pink.stores.core import store_type, store_sidecar
 
 
 #
@@ -89,6 +90,7 @@ class Logs:
         self.fp = None
         self.out = out
         if path:
+            path = store_sidecar(path)
             if not os.path.isdir(os.path.dirname(path)):
                 os.makedirs(os.path.dirname(path), exist_ok=True)
             self.fp = open(path, mode="a")
@@ -157,6 +159,9 @@ def web_ui(out, base_url, coverage_tiles, selected_tiles, ext, template, union_t
     out = os.path.expanduser(out)
     template = os.path.expanduser(template)
 
+    if store_type(out):  # no Web UI on a store output, as tiles are not reachable by a plain HTTP server
+        return
+
     templates = glob.glob(os.path.join(Path(__file__).parent, "web_ui", "*"))
     if os.path.isfile(template):
         templates.append(template)
@@ -0,0 +1,140 @@
+"""Asynchronous tiles download engine: pooled keep-alive connections, a global token bucket rate limiter,
+   retries with exponential backoff and jitter, and live throughput stats."""
+
+import time
+import random
+import asyncio
+from collections import deque
+
+import aiohttp
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        """Global rate limiter: rate tokens per second, at most burst [default: 1] tokens available at once."""
+
+        assert rate > 0, "Rate limit must be strictly positive"
+
+        self.rate = rate
+        self.burst = burst if burst else 1
+        self.tokens = self.burst
+        self.tick = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for, and take, a token."""
+
+        async with self.lock:  # tokens are granted in calls order
+            while True:
+                tock = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (tock - self.tick) * self.rate)
+                self.tick = tock
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DownloadStats:
+    def __init__(self):
+        """Download counters, with a throughput on a sliding window."""
+
+        self.tiles = 0
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+        self.start = time.monotonic()
+        self.window = deque()
+
+    def add(self, size):
+        self.tiles += 1
+        self.bytes += size
+        tock = time.monotonic()
+        self.window.append(tock)
+        while self.window and self.window[0] < tock - 5:
+            self.window.popleft()
+
+    def rate(self):
+        """Tiles per second, on the last 5 seconds."""
+
+        elapsed = min(5, time.monotonic() - self.start)
+        return len(self.window) / elapsed if elapsed > 0 else 0.0
+
+    def postfix(self):
+        return {"tiles/s": "{:.1f}".format(self.rate()), "MB": "{:.1f}".format(self.bytes / 1e6), "retries": self.retries}
+
+    def __str__(self):
+        elapsed = time.monotonic() - self.start
+        return "{} tiles, {:.1f} MB in {:.1f}s ({:.1f} tiles/s), {} retries, {} errors".format(
+            self.tiles, self.bytes / 1e6, elapsed, self.tiles / elapsed if elapsed else 0.0, self.retries, self.errors
+        )
+
+
+async def tile_data_from_url(session, url, bucket, stats, timeout=10, retries=2, backoff=0.5):
+    """Fetch a tile data using HTTP, retrying with exponential backoff and full jitter, and return it or None."""
+
+    for attempt in range(retries + 1):
+        if attempt:
+            stats.retries += 1
+            await asyncio.sleep(random.uniform(0, backoff * 2 ** (attempt - 1)))
+
+        await bucket.acquire()
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                if resp.status in RETRY_STATUS:
+                    continue
+                if resp.status != 200:
+                    return None
+                return await resp.read()
+
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            continue
+
+    return None
+
+
+async def download(tasks, write, done, workers=32, pool=None, rate=10, timeout=10, retries=2, progress=None):
+    """Download each (key, url) task, calling write(key, data) in a thread, then done(key, url, written).
+    Return download stats."""
+
+    stats = DownloadStats()
+    bucket = TokenBucket(rate)
+    queue = asyncio.Queue(maxsize=workers * 2)
+    loop = asyncio.get_event_loop()
+
+    connector = aiohttp.TCPConnector(limit=pool if pool else workers, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def worker():
+            while True:
+                task = await queue.get()
+                if task is None:
+                    return
+
+                key, url = task
+                data = await tile_data_from_url(session, url, bucket, stats, timeout, retries)
+                written = await loop.run_in_executor(None, write, key, data) if data is not None else None  # off the loop
+
+                if written:
+                    stats.add(len(data))
+                else:
+                    stats.errors += 1
+                done(key, url, written)
+
+                if progress is not None:
+                    progress.set_postfix(stats.postfix(), refresh=False)
+                    progress.update()
+
+        async def producer():
+            for task in tasks:
+                await queue.put(task)
+            for _ in range(workers):
+                await queue.put(None)
+
+        await asyncio.gather(producer(), *[worker() for _ in range(workers)])
+
+    return stats
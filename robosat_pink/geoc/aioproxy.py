@@ -0,0 +1,159 @@
+"""Asynchronous WMTS tiles proxy: a drop-in for xyz_proxy.py, serving hundreds of concurrent tiles requests in a
+   single process, and streaming upstream bodies to clients, with the same tiles cache tiers than TileProxy."""
+
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+
+from robosat_pink.geoc import config as CONFIG
+from robosat_pink.geoc.proxy import TileProxy, MIMETYPES
+from robosat_pink.tiles import tile_data_format
+
+
+class AsyncTileProxy(TileProxy):
+    def __init__(self, urls, cache_dir=None, max_bytes=64 << 20, pool=64, timeout=10):
+        """Proxy upstream tiles, as TileProxy does, but fetching them with an aiohttp keep-alive connections pool."""
+
+        super().__init__(urls, cache_dir, max_bytes, pool, timeout)
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(max_workers=4)  # disk tier I/O, off the event loop
+        self.client = None
+
+    async def start(self, app=None):
+        connector = aiohttp.TCPConnector(limit=self.pool, keepalive_timeout=60)
+        self.client = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def close(self, app=None):
+        await self.client.close()
+        self.executor.shutdown(wait=False)
+
+    async def handle(self, request):
+        """Serve a tile request, from cache tiers, or else streamed from upstream as it comes."""
+
+        map = request.query.get("map") or "tdt"
+        if map not in self.urls:
+            return web.Response(status=400, text="faild to set map type, neither tianditu nor google")
+
+        z, x, y = (int(request.match_info[key]) for key in ("z", "x", "y"))
+        key = (map, z, x, y)
+        loop = asyncio.get_event_loop()
+
+        tile = self._memory_get(key)
+        if tile is None:
+            tile = await loop.run_in_executor(self.executor, self._disk_get, key)
+        if tile is None:
+            tile = self._memory_get(key)  # as a same tile request could have been completed meanwhile
+
+        if tile is None and key in self.inflight:  # a same tile request is already on its way, so wait for it
+            with self.lock:
+                self.counters["coalesced"] += 1
+            tile = await asyncio.shield(self.inflight[key])
+            if tile is None:
+                return web.Response(status=502)
+
+        if tile is not None:
+            return web.Response(body=tile[0], content_type=tile[1])
+
+        future = self.inflight[key] = loop.create_future()
+        response, tile = web.Response(status=502), None
+        try:
+            response, tile = await self._stream(request, key)
+        finally:
+            future.set_result(tile)
+            del self.inflight[key]
+
+        return response
+
+    def _memory_get(self, key):
+
+        with self.lock:
+            tile = self.entries.get(key)
+            if tile is not None:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+
+        return tile
+
+    async def _stream(self, request, key):
+
+        map, z, x, y = key
+        response = None
+        try:
+            async with self.client.get(self.urls[map].format(x=x, y=y, z=z)) as upstream:
+                head = b""
+                while upstream.status == 200 and len(head) < 12 and not upstream.content.at_eof():
+                    head += await upstream.content.readany()  # just enough to tell the image format
+
+                ext = tile_data_format(head) if upstream.status == 200 else None
+                if ext is None:
+                    with self.lock:
+                        self.counters["errors"] += 1
+                    return web.Response(status=502), None
+
+                response = web.StreamResponse()
+                response.content_type = MIMETYPES[ext]
+                if upstream.content_length is not None and "Content-Encoding" not in upstream.headers:  # else decompressed
+                    response.content_length = upstream.content_length
+                await response.prepare(request)
+
+                chunks = [head]
+                await response.write(head)
+                async for chunk in upstream.content.iter_any():  # relayed as soon as received
+                    chunks.append(chunk)
+                    await response.write(chunk)
+                await response.write_eof()
+
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            with self.lock:
+                self.counters["errors"] += 1
+            if response is not None and response.prepared:
+                raise  # headers already sent, so only left to drop the client connection
+            return web.Response(status=502), None
+
+        data = b"".join(chunks)
+        with self.lock:
+            self.counters["misses"] += 1
+        self._put(key, (data, MIMETYPES[ext]))
+        asyncio.get_event_loop().run_in_executor(self.executor, self._disk_put, key, ext, data)
+
+        return response, (data, MIMETYPES[ext])
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats())
+
+
+PROXY = web.AppKey("proxy", TileProxy)
+
+
+def make_app(urls, cache_dir=None, max_bytes=64 << 20, pool=64, timeout=10):
+    """Return an aiohttp application, serving the same routes than xyz_proxy.py."""
+
+    proxy = AsyncTileProxy(urls, cache_dir, max_bytes, pool, timeout)
+
+    app = web.Application()
+    app[PROXY] = proxy
+    app.on_startup.append(proxy.start)
+    app.on_cleanup.append(proxy.close)
+    app.router.add_get("/v1/wmts/stats", proxy.handle_stats)
+    app.router.add_get(r"/v1/wmts/{z:\d+}/{x:\d+}/{y:\d+}", proxy.handle)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asynchronous WMTS tiles proxy")
+    parser.add_argument("--port", type=int, default=CONFIG.FLASK_PORT, help="listening port [default: FLASK_PORT]")
+    parser.add_argument("--pool", type=int, default=64, help="upstream keep-alive connections pool size [default: 64]")
+    parser.add_argument("--timeout", type=int, default=10, help="upstream request timeout (in seconds) [default: 10]")
+    args = parser.parse_args()
+
+    urls = {"tdt": CONFIG.URL_TDT, "google": CONFIG.URL_GOOGLE}
+    app = make_app(urls, CONFIG.WMTS_CACHE_PATH, CONFIG.WMTS_CACHE_MB << 20, args.pool, args.timeout)
+    web.run_app(app, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,5 +12,9 @@ WMTS_HOST = "http://127.0.0.1:5000/v1/wmts"
 URL_TDT = '''https://t1.tianditu.gov.cn/DataServer?T=img_w&x={x}&y={y}&l={z}&tk=8971e4c7b3640d506c2dc111221af6a0'''
 URL_GOOGLE = '''http://ditu.google.cn/maps/vt/lyrs=s&x={x}&y={y}&z={z}'''
 
+# wmts proxy tiles cache: disk tier dir path, and in memory tier size (in MB)
+WMTS_CACHE_PATH = "wmts_cache"
+WMTS_CACHE_MB = 256
+
 # wmts_xyz_proxy port
 FLASK_PORT = 5000
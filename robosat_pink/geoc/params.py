@@ -17,7 +17,7 @@ class Cover:
         self.dir = dir
         # a lat/lon bbox: xmin,ymin,xmax,ymax or a bbox: xmin,xmin,xmax,xmax,EPSG:xxxx
         self.bbox = bbox
-        # a geojson file path
+        # a geojson, or newline delimited geojson, file path
         self.geojson = geojson
         # a cover file path
         self.cover = cover
@@ -44,10 +44,15 @@ class Download:
                  type="XYZ",
                  rate=10,
                  timeout=10,
-                 workers=None,
+                 retries=2,
+                 workers=16,
+                 pool=None,
+                 metatile=1,
                  cover=None,
                  format=None,
                  out=None,
+                 blank_threshold=0,
+                 placeholders=None,
                  web_ui_base_url=None,
                  web_ui_template=None,
                  no_web_ui=True):
@@ -60,19 +65,31 @@ class Download:
         self.rate = rate
         # int, default=10, download request timeout (in seconds) [default: 10]
         self.timeout = timeout
-        # int, number of workers [default: CPU / 2]
+        # int, default=2, retries on a failed request, with backoff [default: 2]
+        self.retries = retries
+        # int, default=16, number of concurrent requests [default: 16]
         self.workers = workers
+        # int, HTTP keep-alive connections pool size [default: workers]
+        self.pool = pool
+        # int, default=1, WMS only, request NxN tiles at once, as a single image, then sliced in tiles [default: 1]
+        self.metatile = metatile
 
         # Coverage to download
         # str, path to .csv tiles list [required]
         self.cover = cover
 
         # Output
-        # str, default="webp", file format to save images in [default: webp]
+        # str, image format to transcode tiles to, if not already in [default: keep server tiles as is]
         self.format = format
         # str, output directory path [required]
         self.out = out
 
+        # Blank tiles
+        # float, default=0, skip tiles with every band standard deviation under this value (decoding each tile) [default: 0]
+        self.blank_threshold = blank_threshold
+        # str, path to a file with placeholders tiles sha1, one per line (e.g sha1sum output), to skip them too
+        self.placeholders = placeholders
+
         # Web UI
         # str, alternate Web UI base URL
         self.web_ui_base_url = web_ui_base_url
@@ -93,6 +110,8 @@ class Rasterize:
                  out=None,
                  append=None,
                  ts=512,
+                 workers=None,
+                 chunk_size=256,
                  web_ui_base_url=None,
                  web_ui_template=None,
                  no_web_ui=True):
@@ -100,12 +119,15 @@ class Rasterize:
         # type=str, path to csv tiles cover file [required]
         self.cover = cover
         self.config = config  # type=str, path to config file [required]
-        # type=str, required=True, type of feature to rasterize (e.g Building, Road) [required]
+        # type=str, required=True, type of feature to rasterize (e.g Building),
+        # or comma separated types, burnt at once (e.g Building,Road) [required]
         self.type = type
         # type=str, PostgreSQL dsn using psycopg2 syntax (e.g 'dbname=db user=postgres')
         self.pg = pg
-        self.sql = sql  # type=str, help=help)
-        self.geojson = geojson  # type=str, path to GeoJSON features files
+        self.sql = sql  # type=str, action="append", SQL to retrieve geometry features, once by type
+        # type=str, nargs="+", path to GeoJSON, or newline delimited GeoJSON, features files,
+        # or with several --type, one file by type
+        self.geojson = geojson
 
         # Outputs
         self.out = out  # =str, output directory path [required]
@@ -114,6 +136,12 @@ class Rasterize:
         # type=int, default=512,  output tile size[default:512]
         self.ts = ts
 
+        # Performances
+        # type=int, number of processes workers [default: CPU]
+        self.workers = workers
+        # type=int, default=256, number of tiles by worker task [default: 256]
+        self.chunk_size = chunk_size
+
         # Web UI
         # type=str, alternate Web UI base URL
         self.web_ui_base_url = web_ui_base_url
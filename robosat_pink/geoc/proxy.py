@@ -0,0 +1,154 @@
+"""Caching WMTS tiles proxy: an in memory LRU, in front of a disk tier, keyed by (map, z, x, y), fetching
+   upstream tiles through a pooled keep-alive session, and coalescing concurrent requests for a same tile."""
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from robosat_pink.tiles import tile_data_format
+
+MIMETYPES = {"png": "image/png", "webp": "image/webp", "jpg": "image/jpeg", "tiff": "image/tiff"}
+
+
+class TileProxy:
+    def __init__(self, urls, cache_dir=None, max_bytes=64 << 20, pool=16, timeout=10):
+        """Proxy upstream tiles, from urls templates by map name, with an in memory cache of max_bytes,
+        and a disk tier in cache_dir, if any."""
+
+        self.urls = urls
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(urls), pool_maxsize=pool, max_retries=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    def get(self, map, z, x, y):
+        """Return a tile, as (data, mimetype), or None if upstream failed to provide it."""
+
+        key = (map, int(z), int(x), int(y))
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return self.entries[key]
+
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self.inflight[key] = Future()
+            else:
+                self.counters["coalesced"] += 1
+
+        if not leader:  # a same tile request is already on its way, so wait for it, rather than fetching it again
+            return future.result()
+
+        try:
+            tile = self._disk_get(key)
+            if tile is None:
+                tile = self._fetch(key)
+            future.set_result(tile)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+        return tile
+
+    def _fetch(self, key):
+
+        map, z, x, y = key
+        try:
+            response = self.session.get(self.urls[map].format(x=x, y=y, z=z), timeout=self.timeout)
+        except requests.RequestException:
+            response = None
+
+        ext = tile_data_format(response.content) if response is not None and response.status_code == 200 else None
+        with self.lock:
+            self.counters["misses" if ext else "errors"] += 1
+        if not ext:
+            return None
+
+        tile = (response.content, MIMETYPES[ext])
+        self._put(key, tile)
+        self._disk_put(key, ext, response.content)
+
+        return tile
+
+    def _put(self, key, tile):
+
+        if len(tile[0]) > self.max_bytes:
+            return
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = tile
+                self.bytes += len(tile[0])
+
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted[0])
+
+    def _disk_dir(self, key):
+        map, z, x, _ = key
+        return os.path.join(self.cache_dir, map, str(z), str(x))
+
+    def _disk_get(self, key):
+
+        if not self.cache_dir:
+            return None
+
+        for ext, mimetype in MIMETYPES.items():
+            try:
+                with open(os.path.join(self._disk_dir(key), "{}.{}".format(key[3], ext)), "rb") as fp:
+                    tile = (fp.read(), mimetype)
+            except OSError:
+                continue
+
+            with self.lock:
+                self.counters["disk_hits"] += 1
+            self._put(key, tile)
+            return tile
+
+        return None
+
+    def _disk_put(self, key, ext, data):
+
+        if not self.cache_dir:
+            return
+
+        try:
+            os.makedirs(self._disk_dir(key), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self._disk_dir(key), suffix=".tmp")
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp, os.path.join(self._disk_dir(key), "{}.{}".format(key[3], ext)))  # atomic
+        except OSError:
+            pass
+
+    def stats(self):
+        """Return cache counters, and hit rate, both memory and disk tiers included."""
+
+        with self.lock:
+            stats = dict(self.counters, entries=len(self.entries), bytes=self.bytes)
+
+        total = stats["hits"] + stats["disk_hits"] + stats["misses"] + stats["coalesced"] + stats["errors"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"] + stats["coalesced"]) / total if total else 0.0
+
+        return stats
@@ -1,3 +1,12 @@
+import os
+import json
+import array
+import tempfile
+import functools
+import threading
+import collections
+
+import numpy as np
 from rasterio.crs import CRS
 from rasterio.warp import transform
 from rasterio.features import rasterize
@@ -6,19 +15,87 @@ from rasterio.transform import from_bounds
 import mercantile
 from supermercado import burntiles
 
-from robosat_pink.tiles import tile_bbox
+from robosat_pink.tiles import tile_bbox, cover_keys
+
+EARTH_RADIUS = 6378137.0
+MAX_LATITUDE = 85.0511287798066  # Web Mercator
+REPROJECTED_MAX = 4096  # features with memoized reprojected geometries
+
+
+@functools.lru_cache(maxsize=None)
+def geojson_transformer(srid_in, srid_out):
+    """Return a transformer, reprojecting flat xs, ys numpy coordinates arrays, from srid_in to srid_out. Cached."""
+
+    if srid_in == srid_out:
+        return lambda xs, ys: (xs, ys)
+
+    if (srid_in, srid_out) == (4326, 3857):  # closed form, so no PROJ call at all, on the most common path
+
+        def transformer(xs, ys):
+            ys = np.radians(np.clip(ys, -MAX_LATITUDE, MAX_LATITUDE))
+            return EARTH_RADIUS * np.radians(xs), EARTH_RADIUS * np.log(np.tan(np.pi / 4 + ys / 2))
+
+        return transformer
+
+    if (srid_in, srid_out) == (3857, 4326):
+
+        def transformer(xs, ys):
+            return np.degrees(xs / EARTH_RADIUS), np.degrees(2 * np.arctan(np.exp(ys / EARTH_RADIUS)) - np.pi / 2)
+
+        return transformer
+
+    crs_in, crs_out = CRS.from_epsg(srid_in), CRS.from_epsg(srid_out)
+
+    def transformer(xs, ys):
+        xs, ys = transform(crs_in, crs_out, xs, ys)
+        return np.asarray(xs), np.asarray(ys)
+
+    return transformer
 
 
 def geojson_reproject(feature, srid_in, srid_out):
-    """Reproject GeoJSON Polygon feature coords
-       Inspired by: https://gist.github.com/dnomadb/5cbc116aacc352c7126e779c29ab7abe
-    """
+    """Reproject GeoJSON Polygon feature coords, all rings at once, as flat arrays, with a cached transformer."""
 
     if feature["geometry"]["type"] == "Polygon":
-        xys = (zip(*ring) for ring in feature["geometry"]["coordinates"])
-        xys = (list(zip(*transform(CRS.from_epsg(srid_in), CRS.from_epsg(srid_out), *xy))) for xy in xys)
+        rings = [
+            np.asarray([point[:2] for point in ring], dtype=np.float64).reshape(-1, 2)
+            for ring in feature["geometry"]["coordinates"]
+        ]
+        if not rings:
+            yield {"coordinates": [], "type": "Polygon"}
+            return
 
-        yield {"coordinates": list(xys), "type": "Polygon"}
+        xys = np.concatenate(rings)
+        xs, ys = geojson_transformer(srid_in, srid_out)(xys[:, 0], xys[:, 1])
+        xys = np.stack([xs, ys], axis=1)
+
+        splits = np.cumsum([len(ring) for ring in rings])[:-1]
+        yield {"coordinates": [ring.tolist() for ring in np.split(xys, splits)], "type": "Polygon"}
+
+
+geojson_reprojected_memo = collections.OrderedDict()
+geojson_reprojected_lock = threading.Lock()
+
+
+def geojson_reprojected(feature, srid_in, srid_out):
+    """Return a feature reprojected geometries, computed only once by feature, then memoized in a LRU side map."""
+
+    key = (id(feature), srid_in, srid_out)
+    with geojson_reprojected_lock:
+        memo = geojson_reprojected_memo.get(key)
+        if memo is not None and memo[0] is feature:  # as an id could be reused, once its feature freed
+            geojson_reprojected_memo.move_to_end(key)
+            return memo[1]
+
+    geometries = list(geojson_reproject(feature, srid_in, srid_out))
+
+    with geojson_reprojected_lock:
+        geojson_reprojected_memo[key] = (feature, geometries)
+        geojson_reprojected_memo.move_to_end(key)
+        while len(geojson_reprojected_memo) > REPROJECTED_MAX:
+            geojson_reprojected_memo.popitem(last=False)
+
+    return geometries
 
 
 def geojson_parse_feature(zoom, srid, feature_map, feature):
@@ -28,11 +105,12 @@ def geojson_parse_feature(zoom, srid, feature_map, feature):
             polygon = [xy for xy in geojson_reproject({"type": "feature", "geometry": polygon}, srid, 4326)][0]
 
         for i, ring in enumerate(polygon["coordinates"]):  # GeoJSON coordinates could be N dimensionals
-            polygon["coordinates"][i] = [[x, y] for point in ring for x, y in zip([point[0]], [point[1]])]
+            polygon["coordinates"][i] = [[point[0], point[1]] for point in ring]
 
         if polygon["coordinates"]:
-            for tile in burntiles.burn([{"type": "feature", "geometry": polygon}], zoom=zoom):
-                feature_map[mercantile.Tile(*tile)].append({"type": "feature", "geometry": polygon})
+            feature = {"type": "feature", "geometry": polygon}  # shared by every tile, so reprojected only once
+            for tile in burntiles.burn([feature], zoom=zoom):
+                feature_map[mercantile.Tile(*tile)].append(feature)
 
         return feature_map
 
@@ -68,10 +146,162 @@ def geojson_srid(feature_collection):
     return srid
 
 
+def geojson_features(path, chunk=1 << 20):
+    """Yield each (srid, feature), from a GeoJSON FeatureCollection, or a newline delimited GeoJSON file,
+    parsed incrementally, one feature at once, so memory stays flat, whatever the file size."""
+
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    with open(os.path.expanduser(path), encoding="utf-8") as fp:
+
+        def fill():
+            nonlocal buf, pos, eof
+            data = fp.read(max(chunk, len(buf) - pos))  # at least doubled, so large features stay linear to parse
+            buf, pos, eof = buf[pos:] + data, 0, not data
+
+        def peek():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n\x1e":  # RFC 8142 record separator included
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos] if pos < len(buf) else None
+                fill()
+
+        def expect(char):
+            nonlocal pos
+            assert peek() == char, "Invalid GeoJSON {}, {} expected at {}".format(path, char, fp.tell())
+            pos += 1
+
+        def value():
+            nonlocal pos
+            peek()
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:  # otherwise, a number could still go on
+                        pos = end
+                        return obj
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        while peek() is not None:  # a FeatureCollection, or a Feature by line
+            obj, srid, yielded = {}, 4326, False
+            expect("{")
+            while peek() != "}":
+                if obj or yielded:
+                    expect(",")
+                key = value()
+                expect(":")
+
+                if key == "features" and peek() == "[":
+                    expect("[")
+                    while peek() != "]":
+                        if yielded:
+                            expect(",")
+                        yield srid, value()
+                        yielded = True
+                    expect("]")
+                    obj[key] = None
+                    continue
+
+                obj[key] = value()
+                if key == "crs":
+                    assert not yielded or geojson_srid(obj) == srid, "Unsupported GeoJSON crs member, after features"
+                    srid = geojson_srid(obj)
+            expect("}")
+
+            if obj.get("type") == "Feature":
+                yield srid, obj
+
+
+class GeoJSONTileIndex:
+    def __init__(self, zoom, dir=None):
+        """Map zoom tiles to the polygons they intersect. Polygons are spilled on disk, in a temporary file,
+        and only (tile key, polygon id) compact pairs are kept in memory."""
+
+        self.zoom = zoom
+        self.spill = tempfile.TemporaryFile(dir=dir)
+        self.offsets = array.array("Q", [0])
+        self.keys = array.array("Q")
+        self.ids = array.array("I")
+        self.sorted = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, srid, feature):
+        """Index a GeoJSON feature polygons, in srid coordinates."""
+
+        feature_map = geojson_parse_feature(self.zoom, srid, collections.defaultdict(list), feature)
+
+        ids = {}
+        for tile, polygons in feature_map.items():
+            for polygon in polygons:
+                if id(polygon) not in ids:
+                    ids[id(polygon)] = self._spill(polygon["geometry"]["coordinates"])
+                self.keys.append((tile.z << 58) | (tile.x << 29) | tile.y)  # as cover_keys
+                self.ids.append(ids[id(polygon)])
+        self.sorted = None
+
+    def _spill(self, rings):
+
+        header = np.array([len(rings)] + [len(ring) for ring in rings], dtype=np.uint64)
+        xys = np.array([point for ring in rings for point in ring], dtype=np.float64)
+        self.spill.seek(0, os.SEEK_END)
+        self.spill.write(header.tobytes())
+        self.spill.write(xys.tobytes())
+        self.offsets.append(self.offsets[-1] + header.nbytes + xys.nbytes)
+
+        return len(self.offsets) - 2
+
+    def _polygon(self, i):
+
+        self.spill.seek(self.offsets[i])
+        data = self.spill.read(self.offsets[i + 1] - self.offsets[i])
+        n = int(np.frombuffer(data, dtype=np.uint64, count=1)[0])
+        bounds = np.cumsum(np.frombuffer(data, dtype=np.uint64, count=n, offset=8).astype(np.int64))
+        xys = np.frombuffer(data, dtype=np.float64, offset=8 * (n + 1)).reshape(-1, 2)
+
+        rings = [ring.tolist() for ring in np.split(xys, bounds[:-1])] if n else []
+        return {"type": "feature", "geometry": {"type": "Polygon", "coordinates": rings}}
+
+    def features(self, cover):
+        """Return a tile: [features] dict, for a XYZ cover, each polygon loaded only once, and shared by its tiles."""
+
+        if self.sorted is None:
+            keys, ids = np.array(self.keys, dtype=np.uint64), np.array(self.ids, dtype=np.uint32)
+            order = np.argsort(keys, kind="stable")
+            self.sorted = keys[order], ids[order]
+            self.spill.flush()
+
+        keys, ids = self.sorted
+        cover = np.asarray(cover, dtype=np.uint32).reshape(-1, 3)
+        lows = np.searchsorted(keys, cover_keys(cover), side="left")
+        highs = np.searchsorted(keys, cover_keys(cover), side="right")
+
+        feature_map, polygons = {}, {}
+        for (x, y, z), low, high in zip(cover.tolist(), lows.tolist(), highs.tolist()):
+            if low == high:
+                continue
+            for i in ids[low:high].tolist():
+                if i not in polygons:
+                    polygons[i] = self._polygon(i)
+            feature_map[mercantile.Tile(x, y, z)] = [polygons[i] for i in ids[low:high].tolist()]
+
+        return feature_map
+
+    def close(self):
+        self.spill.close()
+
+
 def geojson_tile_burn(tile, features, srid, ts, burn_value=1):
     """Burn tile with GeoJSON features."""
 
-    shapes = ((geometry, burn_value) for feature in features for geometry in geojson_reproject(feature, srid, 3857))
+    shapes = ((geometry, burn_value) for feature in features for geometry in geojson_reprojected(feature, srid, 3857))
 
     bounds = tile_bbox(tile, mercator=True)
     transform = from_bounds(*bounds, *ts)
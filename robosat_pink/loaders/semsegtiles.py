@@ -5,6 +5,8 @@ import numpy as np
 import torch.utils.data
 
 from robosat_pink.tiles import tiles_from_dir, tile_image_from_file, tile_label_from_file
+from robosat_pink.stores.core import store_find
+from robosat_pink.cache import tile_cached
 from robosat_pink.da.core import to_normalized_tensor
 
 
@@ -21,7 +23,7 @@ class SemSegTiles(torch.utils.data.Dataset):
         num_channels = 0
         self.tiles = {}
         for channel in config["channels"]:
-            path = os.path.join(self.root, channel["name"])
+            path = store_find(os.path.join(self.root, channel["name"]))
             self.tiles[channel["name"]] = [(tile, path) for tile, path in tiles_from_dir(path, xyz_path=True)]
             self.tiles[channel["name"]].sort(key=lambda tile: tile[0])
             num_channels += len(channel["bands"])
@@ -30,7 +32,7 @@ class SemSegTiles(torch.utils.data.Dataset):
         self.shape_out = (len(config["classes"]),) + ts  # C,W,H
 
         if self.mode == "train":
-            path = os.path.join(self.root, "labels")
+            path = store_find(os.path.join(self.root, "labels"))
             self.tiles["labels"] = [(tile, path) for tile, path in tiles_from_dir(path, xyz_path=True)]
             self.tiles["labels"].sort(key=lambda tile: tile[0])
 
@@ -54,14 +56,14 @@ class SemSegTiles(torch.utils.data.Dataset):
                 assert tile == self.tiles[channel["name"]][i][0], "Dataset channel inconsistency"
                 tile, path = self.tiles[channel["name"]][i]
 
-            image_channel = tile_image_from_file(path, bands)
+            image_channel = tile_cached(path, tile_image_from_file, bands)
 
             assert image_channel is not None, "Dataset channel {} not retrieved: {}".format(channel["name"], path)
             image = np.concatenate((image, image_channel), axis=2) if image is not None else image_channel
 
         if self.mode == "train":
             assert tile == self.tiles["labels"][i][0], "Dataset mask inconsistency"
-            mask = tile_label_from_file(self.tiles["labels"][i][1])
+            mask = tile_cached(self.tiles["labels"][i][1], tile_label_from_file)
             assert mask is not None, "Dataset mask not retrieved"
 
             image, mask = to_normalized_tensor(self.config, self.shape_in[1:3], self.mode, image, mask)
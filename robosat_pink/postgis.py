@@ -0,0 +1,40 @@
+"""PostGIS features streaming: geometries read through a server side cursor, in batches, as binary WKB."""
+
+import uuid
+
+import shapely.wkb
+import shapely.geometry
+
+
+def postgis_geojson_from_wkb(wkb):
+    """Return a GeoJSON geometry, with coordinates as nested lists, from a WKB geometry."""
+
+    def geojson_lists(coordinates):
+        if not coordinates or not isinstance(coordinates[0], (tuple, list)):
+            return list(coordinates)
+        return [geojson_lists(coordinate) for coordinate in coordinates]
+
+    def geojson_geometry(geometry):
+        if geometry["type"] == "GeometryCollection":
+            return {"type": "GeometryCollection", "geometries": [geojson_geometry(g) for g in geometry["geometries"]]}
+        return {"type": geometry["type"], "coordinates": geojson_lists(geometry["coordinates"])}
+
+    return geojson_geometry(shapely.geometry.mapping(shapely.wkb.loads(bytes(wkb))))
+
+
+def postgis_geometries(conn, sql, srid=4326, batch=10000):
+    """Yield GeoJSON geometries, from a SQL query first column, reprojected in srid, and streamed in batches."""
+
+    query = """SELECT ST_AsBinary(ST_Transform(ST_Force2D("1"), {})) FROM ({}) AS t("1")""".format(srid, sql)
+
+    with conn.cursor(name="rsp_{}".format(uuid.uuid4().hex)) as db:  # server side, so memory stays flat
+        db.itersize = batch
+        db.execute(query)
+
+        for row in db:
+            if row[0] is None:
+                continue
+            try:
+                yield postgis_geojson_from_wkb(row[0])
+            except Exception:
+                continue  # invalid geometry
@@ -0,0 +1,99 @@
+"""Single file tiles stores, usable in place of a slippy map dir, through virtual paths: store_path/z/x/y.ext"""
+
+import os
+import atexit
+import threading
+from importlib import import_module
+
+import mercantile
+
+STORES = {".pack": "pack.Pack", ".mbtiles": "mbtiles.MBTiles", ".gpkg": "mbtiles.GeoPackage"}  # robosat_pink.stores class
+
+_stores = {}
+_lock = threading.Lock()
+
+
+def store_type(path):
+    """Return the store file extension of a path, or None if the path is not a store one."""
+
+    ext = os.path.splitext(str(path))[1].lower()
+    return ext if ext in STORES else None
+
+
+def store_split(path):
+    """Split a virtual path, into a store path and the path relative to it, or return None if not within a store."""
+
+    parts = os.path.expanduser(str(path)).split(os.sep)
+    for i, part in enumerate(parts):
+        if store_type(part) and i + 1 < len(parts):
+            return os.sep.join(parts[: i + 1]), os.sep.join(parts[i + 1 :])
+
+    return None
+
+
+def store_sidecar(path):
+    """Return a file path, with files that would be located within a store file, moved alongside it."""
+
+    split = store_split(path)
+    return "{}.{}".format(*split) if split else path
+
+
+def store_find(path):
+    """Return a slippy map dir path, or if not found, the existing store file path having the same name, if any."""
+
+    path = os.path.expanduser(path)
+    if os.path.isdir(path) or store_type(path):
+        return path
+
+    for ext in STORES.keys():
+        if os.path.isfile(path + ext):
+            return path + ext
+
+    return path
+
+
+def store_tile(path):
+    """Return the tile and file extension, from a path relative to a store (i.e z/x/y.ext)."""
+
+    z, x, y = path.split(os.sep)[-3:]
+    y, _, ext = y.partition(".")
+    return mercantile.Tile(int(x), int(y), int(z)), ext
+
+
+def store_open(path, mode="r"):
+    """Open a store, in read (r) or append (a) mode, and keep it opened for further calls."""
+
+    path = os.path.abspath(os.path.expanduser(path))
+    ext = store_type(path)
+    assert ext, "Unsupported store type: {}".format(path)
+
+    with _lock:
+        store = _stores.get(path)
+        if store is not None and (store.mode == mode or store.mode == "a"):
+            return store
+
+        if store is not None:
+            store.close()
+
+        module, name = STORES[ext].split(".")
+        store = getattr(import_module("robosat_pink.stores.{}".format(module)), name)(path, mode)
+        _stores[path] = store
+
+    return store
+
+
+def store_close(path):
+    """Close a store, if opened, writing its index in append mode. Do nothing on a plain dir path."""
+
+    path = os.path.abspath(os.path.expanduser(path))
+
+    with _lock:
+        store = _stores.pop(path, None)
+        if store is not None:
+            store.close()
+
+
+@atexit.register
+def store_close_all():
+    for path in list(_stores.keys()):
+        store_close(path)
@@ -0,0 +1,241 @@
+"""MBTiles and GeoPackage tiles stores: SQLite single file tiles containers.
+
+   See: https://github.com/mapbox/mbtiles-spec and https://www.geopackage.org/spec/#tiles
+"""
+
+import io
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import mercantile
+from PIL import Image
+
+from robosat_pink.tiles import tile_data_format
+
+BATCH = 512  # tiles buffered in memory, before a bulk insert
+
+WEB_MERCATOR = 20037508.342789244
+
+
+class MBTiles:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB,
+                                          PRIMARY KEY (zoom_level, tile_column, tile_row));
+    """
+    TABLE = "tiles"
+
+    def __init__(self, path, mode="r"):
+        """Open a SQLite tiles store, either in read only (r) mode, or in append (a) mode, creating it if needed."""
+
+        assert mode in ("r", "a"), "Unsupported store mode: {}".format(mode)
+
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.batch = {}  # (zoom_level, tile_column, tile_row): tile_data, not yet inserted
+
+        if mode == "r":
+            assert os.path.isfile(path), "Unable to open store: {}".format(path)
+            self.db = sqlite3.connect("file:{}?mode=ro".format(path), uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(self.SCHEMA)
+            self.db.commit()
+
+        self.format = self._format()
+
+    def _format(self):
+        row = self.db.execute("SELECT value FROM metadata WHERE name = 'format'").fetchone()
+        if row:
+            return row[0]
+
+        row = self.db.execute("SELECT tile_data FROM {} LIMIT 1".format(self.TABLE)).fetchone()
+        return tile_data_format(bytes(row[0])) if row else None
+
+    def _set_format(self, ext):
+        self.db.execute("INSERT OR REPLACE INTO metadata VALUES ('format', ?)", (ext,))
+        self.db.execute("INSERT OR IGNORE INTO metadata VALUES ('name', ?)", (os.path.basename(self.path),))
+
+    def _row(self, tile):
+        return tile.z, tile.x, (1 << tile.z) - 1 - tile.y  # TMS rows
+
+    def _tile(self, z, x, row):
+        return x, (1 << z) - 1 - row
+
+    def _flush(self):
+        if not self.batch:
+            return
+
+        rows = [(*row, data) for row, data in self.batch.items()]
+        self.db.executemany("INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)".format(self.TABLE), rows)
+        self.db.commit()
+        self.batch = {}
+
+    def _select(self, tile, column="tile_data"):
+        """Return a tile column value, from buffered tiles first, so reads never break a bulk insert batch."""
+
+        with self.lock:
+            data = self.batch.get(self._row(tile))
+            if data is not None:
+                return data if column == "tile_data" else 1
+
+            query = "SELECT {} FROM {} WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?"
+            row = self.db.execute(query.format(column, self.TABLE), self._row(tile)).fetchone()
+
+        return row[0] if row else None
+
+    def __contains__(self, tile):
+        return self._select(tile, "1") is not None
+
+    def ext(self, tile):
+        """Return a tile file extension, or None if not in the store."""
+
+        return self.format if tile in self else None
+
+    def get(self, tile):
+        """Return a tile data, as bytes, or None if not in the store."""
+
+        data = self._select(tile)
+        return bytes(data) if data is not None else None
+
+    def put(self, tile, ext, data):
+        """Buffer a tile data, to be written in the store. A tile already stored is superseded."""
+
+        assert self.mode == "a", "Store opened in read only mode: {}".format(self.path)
+
+        with self.lock:
+            if self.format is None:
+                self.format = ext
+                self._set_format(ext)
+            assert ext == self.format, "Store {} holds {} tiles, unable to add a {} one".format(self.path, self.format, ext)
+
+            self.batch[self._row(tile)] = sqlite3.Binary(data)
+            if len(self.batch) >= BATCH:
+                self._flush()
+
+    def tiles(self):
+        """Return stored tiles, as a N,3 uint32 numpy array (x, y, z), their files extensions indexes and extensions list."""
+
+        with self.lock:
+            self._flush()
+            rows = self.db.execute("SELECT zoom_level, tile_column, tile_row FROM {}".format(self.TABLE)).fetchall()
+
+        tiles = np.array([(*self._tile(z, x, row), z) for z, x, row in rows], dtype=np.uint32).reshape(-1, 3)
+        return tiles, np.zeros(len(tiles), dtype=np.uint8), [self.format]
+
+    def _extent(self):
+        """Return stored tiles zoom range, and their lon/lat bounds at the deepest zoom, or None if empty."""
+
+        zmin, zmax = self.db.execute("SELECT MIN(zoom_level), MAX(zoom_level) FROM {}".format(self.TABLE)).fetchone()
+        if zmax is None:
+            return None
+
+        query = "SELECT MIN(tile_column), MIN(tile_row), MAX(tile_column), MAX(tile_row) FROM {} WHERE zoom_level = ?"
+        xmin, rmin, xmax, rmax = self.db.execute(query.format(self.TABLE), (zmax,)).fetchone()
+        ymin, ymax = sorted((self._tile(zmax, xmin, rmin)[1], self._tile(zmax, xmax, rmax)[1]))
+        w, n = mercantile.ul(xmin, ymin, zmax)
+        e, s = mercantile.ul(xmax + 1, ymax + 1, zmax)
+
+        return zmin, zmax, (w, s, e, n)
+
+    def _close_metadata(self, extent):
+        zmin, zmax, bounds = extent
+        metadata = [("minzoom", str(zmin)), ("maxzoom", str(zmax)), ("bounds", ",".join(map(str, bounds)))]
+        self.db.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", metadata)
+
+    def close(self):
+        """Close the store, writing buffered tiles and extent metadata first, in append mode."""
+
+        with self.lock:
+            if self.mode == "a":
+                self._flush()
+                extent = self._extent()
+                if extent:
+                    self._close_metadata(extent)
+                    self.db.commit()
+                self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.db.close()
+
+
+class GeoPackage(MBTiles):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY,
+            organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL,
+            description TEXT);
+        CREATE TABLE IF NOT EXISTS gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+            identifier TEXT UNIQUE, description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT
+            (strftime('%Y-%m-%dT%H:%M:%fZ','now')), min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+            srs_id INTEGER);
+        CREATE TABLE IF NOT EXISTS gpkg_tile_matrix_set (table_name TEXT NOT NULL PRIMARY KEY, srs_id INTEGER NOT NULL,
+            min_x DOUBLE NOT NULL, min_y DOUBLE NOT NULL, max_x DOUBLE NOT NULL, max_y DOUBLE NOT NULL);
+        CREATE TABLE IF NOT EXISTS gpkg_tile_matrix (table_name TEXT NOT NULL, zoom_level INTEGER NOT NULL,
+            matrix_width INTEGER NOT NULL, matrix_height INTEGER NOT NULL, tile_width INTEGER NOT NULL,
+            tile_height INTEGER NOT NULL, pixel_x_size DOUBLE NOT NULL, pixel_y_size DOUBLE NOT NULL,
+            PRIMARY KEY (table_name, zoom_level));
+        CREATE TABLE IF NOT EXISTS tiles (id INTEGER PRIMARY KEY AUTOINCREMENT, zoom_level INTEGER NOT NULL,
+            tile_column INTEGER NOT NULL, tile_row INTEGER NOT NULL, tile_data BLOB NOT NULL,
+            UNIQUE (zoom_level, tile_column, tile_row));
+        CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+
+        INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ('WGS 84 / Pseudo-Mercator', 3857, 'EPSG', 3857,
+            'PROJCS["WGS 84 / Pseudo-Mercator",GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],
+            PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]],PROJECTION["Mercator_1SP"],
+            PARAMETER["central_meridian",0],PARAMETER["scale_factor",1],PARAMETER["false_easting",0],
+            PARAMETER["false_northing",0],UNIT["metre",1],AUTHORITY["EPSG","3857"]]', NULL);
+        INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', NULL);
+        INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', NULL);
+        INSERT OR IGNORE INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id)
+            VALUES ('tiles', 'tiles', 'tiles', -20037508.342789244, -20037508.342789244,
+                    20037508.342789244, 20037508.342789244, 3857);
+        INSERT OR IGNORE INTO gpkg_tile_matrix_set VALUES ('tiles', 3857, -20037508.342789244, -20037508.342789244,
+                                                           20037508.342789244, 20037508.342789244);
+    """
+
+    def __init__(self, path, mode="r"):
+        super().__init__(path, mode)
+
+        if mode == "a":
+            self.db.execute("PRAGMA application_id = 1196444487")  # GPKG
+            self.db.execute("PRAGMA user_version = 10200")
+            self.db.commit()
+
+        self.zooms = {z for z, in self.db.execute("SELECT zoom_level FROM gpkg_tile_matrix WHERE table_name = 'tiles'")}
+
+    def _row(self, tile):
+        return tile.z, tile.x, tile.y  # GeoPackage rows are top left origin based
+
+    def _tile(self, z, x, row):
+        return x, row
+
+    def _flush(self):
+        if not self.batch:
+            return
+
+        query = "INSERT OR REPLACE INTO {} (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)"
+        self.db.executemany(query.format(self.TABLE), [(*row, data) for row, data in self.batch.items()])
+        self.db.commit()
+        self.batch = {}
+
+    def _close_metadata(self, extent):
+        w, s, e, n = mercantile.xy(*extent[2][:2]) + mercantile.xy(*extent[2][2:])
+        self.db.execute(
+            "UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ? WHERE table_name = 'tiles'", (w, s, e, n)
+        )
+
+    def put(self, tile, ext, data):
+        if tile.z not in self.zooms and self.mode == "a":
+            with self.lock:
+                width, height = Image.open(io.BytesIO(data)).size
+                side = 1 << tile.z
+                size_x, size_y = 2 * WEB_MERCATOR / (side * width), 2 * WEB_MERCATOR / (side * height)
+                matrix = ("tiles", tile.z, side, side, width, height, size_x, size_y)
+                self.db.execute("INSERT OR IGNORE INTO gpkg_tile_matrix VALUES (?, ?, ?, ?, ?, ?, ?, ?)", matrix)
+                self.zooms.add(tile.z)
+
+        super().put(tile, ext, data)
@@ -0,0 +1,167 @@
+"""Packed tiles store: a single file, holding every tile data, and a sorted index table, read through mmap.
+
+   Layout: HEADER | records (RECORD header + tile data) ... | index table | FOOTER
+"""
+
+import os
+import mmap
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b"RSPPACK1"
+RECORD = struct.Struct("<BII8sI")  # z, x, y, extension, data length
+FOOTER = struct.Struct("<8sQQ")  # magic, index offset, index count
+INDEX = np.dtype([("key", "<u8"), ("offset", "<u8"), ("length", "<u4"), ("ext", "S8")])
+
+
+def pack_key(x, y, z):
+    """Sortable (z, x, y) key, as uint64 [as z <= 29]."""
+    return (np.uint64(z) << np.uint64(58)) | (np.uint64(x) << np.uint64(29)) | np.uint64(y)
+
+
+class Pack:
+    def __init__(self, path, mode="r"):
+        """Open a pack store, either in read only (r) mode, or in append (a) mode, creating it if needed."""
+
+        assert mode in ("r", "a"), "Unsupported pack store mode: {}".format(mode)
+
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+
+        if mode == "r":
+            self.fp = open(path, "rb")
+            self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+            assert self.mm[: len(MAGIC)] == MAGIC, "Not a pack store: {}".format(path)
+            self.index, _ = self._read_index(self.mm)
+            if self.index is None:  # not properly closed, as an interrupted run, so recover its index from records
+                self.index = np.sort(self._scan_records(self.mm)[0], order="key")
+            return
+
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as fp:
+                fp.write(MAGIC)
+
+        self.fp = open(path, "r+b")
+        with mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            assert mm[: len(MAGIC)] == MAGIC, "Not a pack store: {}".format(path)
+            index, end = self._read_index(mm)
+            if index is None:
+                index, end = self._scan_records(mm)  # not properly closed, so recover its index from records
+
+            self.entries = {int(key): (int(offset), int(length), bytes(ext)) for key, offset, length, ext in index}
+            del index  # release the mmap exported buffer
+
+        self.fp.truncate(end)  # index table is rewritten on close
+        self.fp.seek(end)
+
+    @staticmethod
+    def _read_index(mm):
+
+        if len(mm) < len(MAGIC) + FOOTER.size:
+            return None, len(MAGIC)
+
+        magic, offset, count = FOOTER.unpack_from(mm, len(mm) - FOOTER.size)
+        if magic != MAGIC or offset + count * INDEX.itemsize != len(mm) - FOOTER.size:
+            return None, len(MAGIC)
+
+        return np.frombuffer(mm, dtype=INDEX, count=count, offset=offset), offset
+
+    @staticmethod
+    def _scan_records(mm):
+
+        entries = {}
+        offset = len(MAGIC)
+        while offset + RECORD.size <= len(mm):
+            z, x, y, ext, length = RECORD.unpack_from(mm, offset)
+            if offset + RECORD.size + length > len(mm):
+                break  # truncated record
+
+            entries[int(pack_key(x, y, z))] = (offset + RECORD.size, length, ext)
+            offset += RECORD.size + length
+
+        index = np.array([(key, *entry) for key, entry in entries.items()], dtype=INDEX)
+        return index, offset
+
+    def _lookup(self, tile):
+
+        key = pack_key(tile.x, tile.y, tile.z)
+
+        if self.mode == "a":
+            return self.entries.get(int(key))
+
+        i = np.searchsorted(self.index["key"], key)
+        if i == len(self.index) or self.index["key"][i] != key:
+            return None
+
+        entry = self.index[i]
+        return int(entry["offset"]), int(entry["length"]), entry["ext"]
+
+    def __contains__(self, tile):
+        return self._lookup(tile) is not None
+
+    def ext(self, tile):
+        """Return a tile file extension, or None if not in the store."""
+
+        entry = self._lookup(tile)
+        return bytes(entry[2]).decode("ascii") if entry is not None else None
+
+    def get(self, tile):
+        """Return a tile data, as bytes, or None if not in the store."""
+
+        entry = self._lookup(tile)
+        if entry is None:
+            return None
+
+        offset, length, _ = entry
+        if self.mode == "r":
+            return self.mm[offset : offset + length]
+
+        with self.lock:
+            self.fp.flush()
+            return os.pread(self.fp.fileno(), length, offset)
+
+    def put(self, tile, ext, data):
+        """Append a tile data in the store. A tile already stored is superseded."""
+
+        assert self.mode == "a", "Pack store opened in read only mode: {}".format(self.path)
+
+        with self.lock:
+            offset = self.fp.tell()
+            self.fp.write(RECORD.pack(tile.z, tile.x, tile.y, ext.encode("ascii"), len(data)))
+            self.fp.write(data)
+            self.entries[int(pack_key(tile.x, tile.y, tile.z))] = (offset + RECORD.size, len(data), ext.encode("ascii"))
+
+    def tiles(self):
+        """Return stored tiles, as a N,3 uint32 numpy array (x, y, z), their files extensions indexes and extensions list."""
+
+        if self.mode == "a":
+            index = np.array([(key, *entry) for key, entry in sorted(self.entries.items())], dtype=INDEX)
+        else:
+            index = self.index
+
+        keys = index["key"]
+        mask = np.uint64((1 << 29) - 1)
+        tiles = np.stack([(keys >> np.uint64(29)) & mask, keys & mask, keys >> np.uint64(58)], axis=1).astype(np.uint32)
+
+        extensions, exts = np.unique(index["ext"], return_inverse=True)
+        return tiles, exts.astype(np.uint8), [ext.decode("ascii") for ext in extensions]
+
+    def close(self):
+        """Close the store, writing its sorted index table first, in append mode."""
+
+        if self.mode == "r":
+            self.index = None  # release the mmap exported buffer
+            self.mm.close()
+            self.fp.close()
+            return
+
+        with self.lock:
+            index = np.array([(key, *entry) for key, entry in sorted(self.entries.items())], dtype=INDEX)
+            offset = self.fp.tell()
+            self.fp.write(index.tobytes())
+            self.fp.write(FOOTER.pack(MAGIC, offset, len(index)))
+            self.fp.close()
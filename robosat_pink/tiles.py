@@ -4,8 +4,9 @@
 
 import io
 import os
-import re
 import glob
+import hashlib
+import tempfile
 import warnings
 
 import numpy as np
@@ -18,6 +19,8 @@ import json
 import mercantile
 import supermercado
 
+from robosat_pink.stores.core import store_type, store_split, store_sidecar, store_tile, store_open
+
 warnings.simplefilter("ignore", UserWarning)  # To prevent rasterio NotGeoreferencedWarning
 
 
@@ -35,7 +38,11 @@ def tile_pixel_to_location(tile, dx, dy):
 
 
 def tiles_from_csv(path):
-    """Retrieve tiles from a line-delimited csv file."""
+    """Retrieve tiles from a line-delimited csv file, or from a binary .npy cover file."""
+
+    if os.path.splitext(path)[1] == ".npy":
+        yield from cover_tiles(cover_from_file(path))
+        return
 
     with open(os.path.expanduser(path)) as fp:
         reader = csv.reader(fp)
@@ -51,22 +58,269 @@ def tiles_from_csv(path):
                 yield row
 
 
+def cover_from_file(path):
+    """Load a XYZ cover, from a binary .npy cover file, or from a csv one, as a N,3 uint32 numpy array (x, y, z).
+       Return None, if the csv cover is not a XYZ one (e.g relative paths)."""
+
+    path = os.path.expanduser(path)
+    if os.path.splitext(path)[1] == ".npy":
+        cover = np.load(path)
+        assert cover.ndim == 2 and cover.shape[1] == 3, "Invalid binary cover file: {}".format(path)
+        return cover.astype(np.uint32, copy=False)
+
+    with open(path) as fp:
+        text = fp.read()
+
+    tokens = text.replace(",", " ").split()
+    if len(tokens) % 3 or len(tokens) != text.count(",") * 3 // 2:  # exactly 3 values and 2 commas, on each row
+        return None
+
+    try:
+        values = np.array(tokens, dtype=np.int64)
+    except (ValueError, OverflowError):  # not numeric values (e.g relative paths)
+        return None
+
+    return values.reshape(-1, 3).astype(np.uint32)
+
+
+def cover_tiles(cover):
+    """Iterate a XYZ cover array, as mercantile tiles."""
+
+    for chunk in range(0, len(cover), 65536):
+        for x, y, z in cover[chunk : chunk + 65536].tolist():
+            yield mercantile.Tile(x, y, z)
+
+
+def cover_to_file(path, cover):
+    """Write a XYZ cover, as a binary .npy cover file, or as a csv one."""
+
+    path = os.path.expanduser(path)
+    cover = np.asarray(cover, dtype=np.uint32).reshape(-1, 3)
+
+    if os.path.splitext(path)[1] == ".npy":
+        np.save(path, cover)
+        return
+
+    with open(path, "w", newline="") as fp:
+        for chunk in range(0, len(cover), 1000000):
+            rows = cover[chunk : chunk + 1000000]
+            fp.write(("%d,%d,%d\r\n" * len(rows)) % tuple(rows.ravel().tolist()))
+
+
+def cover_keys(cover):
+    """Return a XYZ cover, as sortable (z, x, y) uint64 keys."""
+
+    cover = np.asarray(cover, dtype=np.uint64).reshape(-1, 3)
+    return (cover[:, 2] << np.uint64(58)) | (cover[:, 0] << np.uint64(29)) | cover[:, 1]
+
+
+def cover_from_keys(keys):
+    """Return a XYZ cover, as a N,3 uint32 numpy array, from (z, x, y) uint64 keys."""
+
+    keys = np.asarray(keys, dtype=np.uint64)
+    mask = np.uint64((1 << 29) - 1)
+    return np.stack([(keys >> np.uint64(29)) & mask, keys & mask, keys >> np.uint64(58)], axis=1).astype(np.uint32)
+
+
+def cover_unique(cover):
+    """Return a XYZ cover, deduplicated, and sorted by (z, x, y)."""
+
+    return cover_from_keys(np.unique(cover_keys(cover)))
+
+
+def cover_union(covers, buffer=1 << 20):
+    """Return the union of an iterable of XYZ covers, deduplicated, and sorted by (z, x, y).
+       Deduplicated regularly as it goes, so memory only grows with the resulting cover."""
+
+    keys, buffered = [np.zeros(0, dtype=np.uint64)], 0
+    for cover in covers:
+        keys.append(cover_keys(list(cover) if not isinstance(cover, np.ndarray) else cover))
+        buffered += len(keys[-1])
+
+        if buffered > buffer:
+            keys, buffered = [np.unique(np.concatenate(keys))], 0
+
+    return cover_from_keys(np.unique(np.concatenate(keys)))
+
+
+def cover_intersect(cover, other):
+    """Return tiles both in cover and in other cover, sorted by (z, x, y)."""
+
+    return cover_from_keys(np.intersect1d(cover_keys(cover), cover_keys(other)))
+
+
+def cover_difference(cover, other):
+    """Return tiles in cover but not in other cover, sorted by (z, x, y)."""
+
+    return cover_from_keys(np.setdiff1d(cover_keys(cover), cover_keys(other)))
+
+
+def cover_contains(cover, tiles):
+    """Return a boolean mask, telling for each given tiles, if it belongs to the cover."""
+
+    return np.isin(cover_keys(tiles), cover_keys(cover))
+
+
+def cover_to_zoom(cover, zoom):
+    """Convert a XYZ cover to another zoom, with children or parents tiles, deduplicated, and sorted by (z, x, y)."""
+
+    cover = cover_unique(cover).astype(np.int64)
+    covers = []
+
+    for z in np.unique(cover[:, 2]).tolist():
+        tiles = cover[cover[:, 2] == z]
+        shift = abs(zoom - z)
+
+        if z >= zoom:  # parents
+            tiles = np.stack([tiles[:, 0] >> shift, tiles[:, 1] >> shift, np.full(len(tiles), zoom)], axis=1)
+        else:  # children
+            dx, dy = np.meshgrid(np.arange(1 << shift), np.arange(1 << shift), indexing="ij")
+            x = ((tiles[:, 0] << shift)[:, None] + dx.ravel()).ravel()
+            y = ((tiles[:, 1] << shift)[:, None] + dy.ravel()).ravel()
+            tiles = np.stack([x, y, np.full(len(x), zoom)], axis=1)
+
+        covers.append(tiles)
+
+    return cover_unique(np.concatenate(covers)) if covers else np.empty((0, 3), dtype=np.uint32)
+
+
+def cover_bounds(cover):
+    """Return a XYZ cover extent, as lon/lat bounds: w, s, e, n."""
+
+    cover = np.asarray(cover, dtype=np.float64).reshape(-1, 3)
+    side = np.exp2(cover[:, 2])
+
+    def lat(y):
+        return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / side))))
+
+    w, e = (cover[:, 0] / side * 360.0 - 180.0).min(), ((cover[:, 0] + 1) / side * 360.0 - 180.0).max()
+    s, n = lat(cover[:, 1] + 1).min(), lat(cover[:, 1]).max()
+
+    return float(w), float(s), float(e), float(n)
+
+
+def cover_split(cover, splits, shuffle=True):
+    """Split a XYZ cover, in several subpieces, as percents of it. Shuffle it first, by default."""
+
+    cover = np.random.permutation(cover) if shuffle else np.asarray(cover)
+    sizes = [int(len(cover) * split / 100) for split in splits]
+    if len(splits) > 1 and sum(splits) == 100 and len(cover) > sum(splits):
+        sizes[0] = len(cover) - sum(sizes[1:])  # no tile waste
+
+    return np.split(cover, np.cumsum(sizes))[: len(sizes)]
+
+
+def cover_chunks(cover, delta):
+    """Split a XYZ cover in spatial chunks, each one within a single parent tile, at most delta zooms above.
+       Yield each (parent tile, chunk cover), chunks in a deterministic order, tiles kept in cover order."""
+
+    cover = np.asarray(cover, dtype=np.uint32).reshape(-1, 3)
+    shift = np.minimum(cover[:, 2], delta).astype(np.uint32)
+    keys = np.stack([cover[:, 2] - shift, cover[:, 0] >> shift, cover[:, 1] >> shift, cover[:, 2]], axis=1)
+    keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+
+    for i, (z, x, y, _) in enumerate(keys.tolist()):
+        yield mercantile.Tile(x, y, z), cover[order[bounds[i] : bounds[i + 1]]]
+
+
+def tiles_index_path(root):
+    """Return the cached index path of a slippy map dir, in RSP_CACHE_DIR [default: ~/.cache/rsp], keyed by dir path."""
+
+    cache_dir = os.environ.get("RSP_CACHE_DIR") or os.path.join(os.environ.get("XDG_CACHE_HOME") or "~/.cache", "rsp")
+    key = hashlib.sha1(os.path.realpath(root).encode()).hexdigest()
+
+    return os.path.join(os.path.expanduser(cache_dir), "tiles_index", key + ".npz")
+
+
+def tiles_index(root):
+    """Index a slippy map dir, caching the index on disk, as long as its directories are unchanged.
+       Return tiles as a N,3 uint32 numpy array (x, y, z), their files extensions indexes and extensions list."""
+
+    root = os.path.expanduser(root)
+    index_path = tiles_index_path(root)
+
+    if store_type(root) and os.path.isfile(root):
+        return store_open(root).tiles()
+
+    if not os.path.isdir(root):
+        return np.zeros((0, 3), dtype=np.uint32), np.zeros(0, dtype=np.uint8), []
+
+    zs = sorted(entry.name for entry in os.scandir(root) if entry.name.isdigit() and entry.is_dir())
+
+    try:
+        with np.load(index_path) as index:
+            mtimes = [os.stat(os.path.join(root, d)).st_mtime_ns for d in index["dirs"]]
+            if list(index["zs"]) == zs and np.array_equal(index["mtimes"], mtimes):
+                return index["tiles"], index["exts"], list(index["extensions"])
+    except (OSError, ValueError, KeyError):
+        pass  # no index yet, or an outdated one
+
+    tiles, exts, extensions = [], [], []
+    index_dirs, index_mtimes = [], []
+
+    for z in zs:
+        z_path = os.path.join(root, z)
+        index_dirs.append(z)
+        index_mtimes.append(os.stat(z_path).st_mtime_ns)
+
+        for x_entry in os.scandir(z_path):
+            if not x_entry.name.isdigit() or not x_entry.is_dir():
+                continue
+
+            index_dirs.append(os.path.join(z, x_entry.name))
+            index_mtimes.append(x_entry.stat().st_mtime_ns)
+
+            for entry in os.scandir(x_entry.path):
+                y, _, ext = entry.name.partition(".")
+                if not y.isdigit() or not ext:
+                    continue
+
+                if ext not in extensions:
+                    extensions.append(ext)
+
+                tiles.append((int(x_entry.name), int(y), int(z)))
+                exts.append(extensions.index(ext))
+
+    tiles = np.array(tiles, dtype=np.uint32).reshape(-1, 3)
+    exts = np.array(exts, dtype=np.uint8)
+    order = np.lexsort((tiles[:, 1], tiles[:, 0], tiles[:, 2]))  # z, x, y sorted
+    tiles, exts = tiles[order], exts[order]
+
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(index_path), suffix=".tmp", delete=False) as fp:
+            np.savez(
+                fp,
+                tiles=tiles,
+                exts=exts,
+                extensions=np.array(extensions, dtype=str),
+                zs=np.array(zs, dtype=str),
+                dirs=np.array(index_dirs, dtype=str),
+                mtimes=np.array(index_mtimes, dtype=np.int64),
+            )
+        os.replace(fp.name, index_path)
+    except OSError:
+        pass  # read only cache dir, index is not cached
+
+    return tiles, exts, extensions
+
+
 def tiles_from_dir(root, xyz=True, xyz_path=False):
     """Loads files from an on-disk dir."""
     root = os.path.expanduser(root)
 
     if xyz is True:
-        paths = glob.glob(os.path.join(root, "[0-9]*/[0-9]*/[0-9]*.*"))
-
-        for path in paths:
-            tile = re.match(os.path.join(root, "(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+).+"), path)
-            if not tile:
-                continue
+        tiles, exts, extensions = tiles_index(root)
 
+        for (x, y, z), ext in zip(tiles.tolist(), exts.tolist()):
             if xyz_path is True:
-                yield mercantile.Tile(int(tile["x"]), int(tile["y"]), int(tile["z"])), path
+                yield mercantile.Tile(x, y, z), os.path.join(root, str(z), str(x), "{}.{}".format(y, extensions[ext]))
             else:
-                yield mercantile.Tile(int(tile["x"]), int(tile["y"]), int(tile["z"]))
+                yield mercantile.Tile(x, y, z)
 
     else:
         paths = glob.glob(root, "**/*.*", recursive=True)
@@ -75,9 +329,72 @@ def tiles_from_dir(root, xyz=True, xyz_path=False):
             return path
 
 
+class TilesManifest:
+    """Append only on-disk record of tiles already processed, each one with its source fingerprint."""
+
+    def __init__(self, path):
+
+        self.path = store_sidecar(os.path.expanduser(path))
+        self.tiles = {}
+
+        split = store_split(os.path.expanduser(path))
+        if split and not os.path.isfile(split[0]) and os.path.isfile(self.path):
+            os.remove(self.path)  # a store sidecar manifest, outliving its store, is a stale one
+
+        if os.path.isfile(self.path):
+            with open(self.path) as fp:
+                for line in fp:
+                    try:
+                        xyz, fingerprint = line.rstrip("\n").split("\t")
+                        self.tiles[mercantile.Tile(*map(int, xyz.split(",")))] = fingerprint
+                    except ValueError:
+                        continue  # truncated line, from an interrupted run
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.fp = open(self.path, mode="a")
+
+    def __contains__(self, tile):
+        """Return True if the tile was already processed, whatever its source fingerprint."""
+        return tile in self.tiles
+
+    def done(self, tile, fingerprint):
+        """Return True if the tile was already processed, from the same source fingerprint."""
+        return self.tiles.get(tile) == fingerprint
+
+    def add(self, tile, fingerprint):
+        """Record a tile as processed, from the given source fingerprint."""
+
+        self.fp.write("{},{},{}\t{}\n".format(tile.x, tile.y, tile.z, fingerprint))
+        self.tiles[tile] = fingerprint
+
+    def flush(self):
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+def tile_fingerprint(*sources):
+    """Return a short fingerprint from sources, either files paths (using their size and mtime) or plain values."""
+
+    digest = hashlib.sha1()
+    for source in sources:
+        if isinstance(source, str) and os.path.isfile(os.path.expanduser(source)):
+            stat = os.stat(os.path.expanduser(source))
+            source = "{}:{}:{}".format(os.path.abspath(os.path.expanduser(source)), stat.st_size, stat.st_mtime_ns)
+        digest.update(str(source).encode("utf-8") + b"\0")
+
+    return digest.hexdigest()[:16]
+
+
 def tile_from_xyz(root, x, y, z):
     """Retrieve a single tile from a slippy map dir."""
 
+    if store_type(root):
+        tile = mercantile.Tile(x, y, z)
+        ext = store_open(root).ext(tile) if os.path.isfile(os.path.expanduser(root)) else None
+        return (tile, os.path.join(os.path.expanduser(root), str(z), str(x), "{}.{}".format(y, ext))) if ext else None
+
     path = glob.glob(os.path.join(os.path.expanduser(root), str(z), str(x), str(y) + ".*"))
     if not path:
         return None
@@ -131,51 +448,192 @@ def tiles_to_geojson(tiles, union=True):
     return geojson
 
 
+def tile_file(path):
+    """Return a tile file path, or from a store virtual path, a file like object on its content."""
+
+    split = store_split(path)
+    if split:
+        store, path = split
+        return io.BytesIO(store_open(store).get(store_tile(path)[0]))
+
+    return os.path.expanduser(path)
+
+
 def tile_image_from_file(path, bands=None):
     """Return a multiband image numpy array, from an image file path, or None."""
 
     try:
-        if path[-3:] == "png":
-            return np.array(Image.open(os.path.expanduser(path)).convert("RGB"))
+        fp = tile_file(path)
+
+        if os.path.splitext(path)[1].lower() in (".png", ".webp", ".jpg", ".jpeg"):  # fast path: 8 bits RGB
+            if isinstance(fp, str):
+                image = cv2.imread(fp, cv2.IMREAD_UNCHANGED)
+            else:
+                image = cv2.imdecode(np.frombuffer(fp.getbuffer(), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+            if image.ndim == 2:
+                image = image.reshape(image.shape[0], image.shape[1], 1)  # H,W -> H,W,C
+
+            if bands is None:  # RGB, alpha dropped and grayscale expanded
+                code = {1: cv2.COLOR_GRAY2RGB, 3: cv2.COLOR_BGR2RGB, 4: cv2.COLOR_BGRA2RGB}[image.shape[2]]
+                return cv2.cvtColor(image, code)
+
+            if image.shape[2] in (3, 4):  # explicitly requested bands, alpha included
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB if image.shape[2] == 3 else cv2.COLOR_BGRA2RGBA)
+
+            return np.ascontiguousarray(image[:, :, [band - 1 for band in bands]])
 
-        raster = rasterio_open(os.path.expanduser(path))
+        with rasterio_open(fp) as raster:
+            indexes = list(raster.indexes if bands is None else bands)
+            image = np.empty((raster.height, raster.width, len(indexes)), dtype=raster.dtypes[indexes[0] - 1])
+            raster.read(indexes, out=np.moveaxis(image, 2, 0))  # all bands in one call, straight in a H,W,C buffer
+
+        return image
     except:
         return None
 
-    image = None
-    for i in raster.indexes if bands is None else bands:
-        data_band = raster.read(i)
-        data_band = data_band.reshape(data_band.shape[0], data_band.shape[1], 1)  # H,W -> H,W,C
-        image = np.concatenate((image, data_band), axis=2) if image is not None else data_band
 
-    return image
+def tile_image_to_bytes(image):
+    """Encode an image tile, and return its (extension, file content), or None."""
+
+    ext = "tiff" if image.shape[2] > 3 else "webp"
+    ret, data = cv2.imencode("." + ext, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+    return (ext, data.tobytes()) if ret else None
 
 
 def tile_image_to_file(root, tile, image):
     """ Write an image tile on disk. """
 
     root = os.path.expanduser(root)
-    out_path = os.path.join(root, str(tile.z), str(tile.x)) if isinstance(tile, mercantile.Tile) else root
-    os.makedirs(out_path, exist_ok=True)
 
     if image.shape[2] > 3:
         ext = "tiff"
     else:
         ext = "webp"
 
+    if store_type(root):
+        encoded = tile_image_to_bytes(image)
+        if encoded:
+            store_open(root, "a").put(tile, *encoded)
+        return encoded is not None
+
+    out_path = os.path.join(root, str(tile.z), str(tile.x)) if isinstance(tile, mercantile.Tile) else root
+    os.makedirs(out_path, exist_ok=True)
+
     filename = "{}.{}".format(str(tile.y), ext) if isinstance(tile, mercantile.Tile) else "{}.{}".format(tile, ext)
     return cv2.imwrite(os.path.join(out_path, filename), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
 
 
+def tile_data_format(data):
+    """Return a tile file extension, from its data magic bytes, or None if not a supported image format."""
+
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+
+    return None
+
+
+def tile_data_to_file(root, tile, ext, data):
+    """Write a tile file content, as is, on disk or in a store."""
+
+    root = os.path.expanduser(root)
+
+    if store_type(root):
+        store_open(root, "a").put(tile, ext, data)
+        return True
+
+    out_path = os.path.join(root, str(tile.z), str(tile.x))
+    os.makedirs(out_path, exist_ok=True)
+
+    tmp = os.path.join(out_path, ".{}.{}.tmp".format(tile.y, ext))  # hidden, so never taken as a tile
+    with open(tmp, "wb") as fp:
+        fp.write(data)
+    os.replace(tmp, os.path.join(out_path, "{}.{}".format(tile.y, ext)))  # never let a partial tile behind
+
+    for path in glob.glob(os.path.join(out_path, "{}.*".format(tile.y))):  # superseded tile, in another format
+        if path != os.path.join(out_path, "{}.{}".format(tile.y, ext)):
+            os.remove(path)
+
+    return True
+
+
+def tile_data_transcode(data, ext):
+    """Transcode a tile file content, to another image format, and return it or None."""
+
+    try:
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+        ret, data = cv2.imencode("." + ext, image)
+        return data.tobytes() if ret else None
+
+    except Exception:
+        return None
+
+
+def tile_image_blank(image, threshold=1.0):
+    """Return True if an image tile is a solid colour one, i.e each band standard deviation is under threshold."""
+
+    if threshold <= 0 or image is None:
+        return False
+
+    bands = image.reshape(-1, image.shape[2]) if len(image.shape) == 3 else image.reshape(-1, 1)
+    return bool(bands.std(axis=0).max() < threshold)
+
+
+def tile_data_blank(data, placeholders=None, threshold=1.0):
+    """Return True if a tile file content is a known placeholder (from its sha1), or a solid colour image."""
+
+    if placeholders and hashlib.sha1(data).hexdigest() in placeholders:
+        return True
+
+    if threshold <= 0:
+        return False
+
+    try:  # 1/4 reduced decode is enough to tell a solid colour tile, and far cheaper on JPEG
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_COLOR_4)
+    except Exception:
+        return False
+
+    return tile_image_blank(image, threshold)
+
+
+def tile_placeholders_from_file(path):
+    """Return a set of placeholders tiles sha1 digests, from a file with one per line (e.g sha1sum output)."""
+
+    with open(os.path.expanduser(path)) as fp:
+        return {line.split()[0].lower() for line in fp if line.strip() and not line.startswith("#")}
+
+
 def tile_label_from_file(path):
     """Return a numpy array, from a label file path, or None."""
 
     try:
-        return np.array(Image.open(os.path.expanduser(path))).astype(int)
+        return np.array(Image.open(tile_file(path))).astype(int)
     except:
         return None
 
 
+def tile_label_to_bytes(palette, label):
+    """Encode a label tile, as a palette png, and return its file content."""
+
+    if len(label.shape) == 3:  # H,W,C -> H,W
+        assert label.shape[2] == 1
+        label = label.reshape((label.shape[0], label.shape[1]))
+
+    out = Image.fromarray(label, mode="P")
+    out.putpalette(palette)
+
+    data = io.BytesIO()
+    out.save(data, format="png", optimize=True, transparency=0)
+    return data.getvalue()
+
+
 def tile_label_to_file(root, tile, palette, label, append=False):
     """ Write a label tile on disk. """
 
@@ -187,17 +645,23 @@ def tile_label_to_file(root, tile, palette, label, append=False):
         assert label.shape[2] == 1
         label = label.reshape((label.shape[0], label.shape[1]))
 
-    if append and os.path.isfile(path):
+    exists = store_open(root, "a").ext(tile) if store_type(root) else os.path.isfile(path)
+
+    if append and exists:
         previous = tile_label_from_file(path)
         assert previous is not None, "Unable to open existing label: {}".format(path)
         label = np.uint8(previous + label)
-    else:
+    elif not store_type(root):
         os.makedirs(dir_path, exist_ok=True)
 
     try:
-        out = Image.fromarray(label, mode="P")
-        out.putpalette(palette)
-        out.save(path, optimize=True, transparency=0)
+        if store_type(root):
+            store_open(root, "a").put(tile, "png", tile_label_to_bytes(palette, label))
+        else:
+            out = Image.fromarray(label, mode="P")
+            out.putpalette(palette)
+            out.save(path, optimize=True, transparency=0)
+
         return True
     except:
         return False
@@ -209,7 +673,17 @@ def tile_image_from_url(requests_session, url, timeout=10):
     try:
         resp = requests_session.get(url, timeout=timeout)
         resp.raise_for_status()
-        image = np.fromstring(io.BytesIO(resp.content).read(), np.uint8)
+        return tile_image_from_bytes(resp.content)
+
+    except Exception:
+        return None
+
+
+def tile_image_from_bytes(data):
+    """Decode a tile image, from its file content, and return it or None"""
+
+    try:
+        image = np.frombuffer(data, np.uint8)
         return cv2.cvtColor(cv2.imdecode(image, cv2.IMREAD_ANYCOLOR), cv2.COLOR_BGR2RGB)
 
     except Exception:
@@ -12,6 +12,7 @@ from mercantile import feature
 
 from robosat_pink.core import web_ui, Logs
 from robosat_pink.tiles import tiles_from_dir, tile_from_xyz, tile_image_from_file, tile_image_to_file
+from robosat_pink.cache import tile_cached
 from robosat_pink.metrics.qod import get as compare
 
 
@@ -109,7 +110,7 @@ def main(args):
 
             if args.mode == "side":
                 for i, root in enumerate(args.images):
-                    img = tile_image_from_file(tile_from_xyz(root, x, y, z)[1])
+                    img = tile_cached(tile_from_xyz(root, x, y, z)[1], tile_image_from_file)
 
                     if i == 0:
                         side = np.zeros((img.shape[0], img.shape[1] * len(args.images), 3))
@@ -127,7 +128,7 @@ def main(args):
 
             elif args.mode == "stack":
                 for i, root in enumerate(args.images):
-                    tile_image = tile_image_from_file(tile_from_xyz(root, x, y, z)[1])
+                    tile_image = tile_cached(tile_from_xyz(root, x, y, z)[1], tile_image_from_file)
 
                     if i == 0:
                         image_shape = tile_image.shape[0:2]
@@ -1,19 +1,19 @@
 import os
 import sys
 import csv
-import json
-import math
 import psycopg2
 import collections
 
+import numpy as np
 from tqdm import tqdm
-from random import shuffle
-from mercantile import tiles, xy_bounds
+from mercantile import tiles
 from rasterio import open as rasterio_open
 from rasterio.warp import transform_bounds
 
-from robosat_pink.tiles import tiles_from_dir, tiles_from_csv
-from robosat_pink.geojson import geojson_srid, geojson_parse_feature
+from robosat_pink.tiles import tiles_from_dir, tiles_from_csv, cover_to_file, cover_split, cover_to_zoom, cover_bounds
+from robosat_pink.tiles import cover_union
+from robosat_pink.geojson import geojson_features, geojson_parse_feature
+from robosat_pink.postgis import postgis_geometries
 
 
 def add_parser(subparser, formatter_class):
@@ -24,8 +24,8 @@ def add_parser(subparser, formatter_class):
     inp = parser.add_argument_group("Input [one among the following is required]")
     inp.add_argument("--dir", type=str, help="plain tiles dir path")
     inp.add_argument("--bbox", type=str, help="a lat/lon bbox: xmin,ymin,xmax,ymax or a bbox: xmin,xmin,xmax,xmax,EPSG:xxxx")
-    inp.add_argument("--geojson", type=str, help="a geojson file path")
-    inp.add_argument("--cover", type=str, help="a cover file path")
+    inp.add_argument("--geojson", type=str, help="a geojson, or newline delimited geojson, file path")
+    inp.add_argument("--cover", type=str, help="a csv, or .npy, cover file path")
     inp.add_argument("--raster", type=str, help="a raster file path")
     inp.add_argument("--sql", type=str, help="SQL to retrieve geometry features [e.g SELECT geom FROM a_table]")
 
@@ -39,7 +39,7 @@ def add_parser(subparser, formatter_class):
     out.add_argument("--zoom", type=int, help="zoom level of tiles [required with --geojson or --bbox]")
     out.add_argument("--extent", action="store_true", help="if set, rather than a cover, output a bbox extent")
     out.add_argument("--splits", type=str, help="if set, shuffle and split in several cover subpieces. [e.g 50/15/35]")
-    out.add_argument("out", type=str, nargs="*", help="cover csv output paths [required except for extent]")
+    out.add_argument("out", type=str, nargs="*", help="cover csv, or binary .npy, output paths [required except for extent]")
 
     parser.set_defaults(func=main)
 
@@ -72,7 +72,7 @@ def main(args):
         splits = [int(split) for split in args.splits.split("/")]
         assert len(splits) == len(args.out) and 0 < sum(splits) <= 100, "Invalid split value or incoherent with out paths."
 
-    assert not (not args.zoom and (args.geojson or args.bbox or args.raster)), "Zoom parameter is required."
+    assert not (not args.zoom and (args.geojson or args.bbox or args.raster or args.sql)), "Zoom parameter is required."
 
     args.out = [os.path.expanduser(out) for out in args.out]
 
@@ -88,43 +88,23 @@ def main(args):
 
     if args.geojson:
         print("RoboSat.pink - cover from {} at zoom {}".format(args.geojson, args.zoom), file=sys.stderr, flush=True)
-        with open(os.path.expanduser(args.geojson)) as f:
-            feature_collection = json.load(f)
-            srid = geojson_srid(feature_collection)
-            feature_map = collections.defaultdict(list)
-
-            for feature in tqdm(feature_collection["features"], ascii=True, unit="feature"):
-                feature_map = geojson_parse_feature(args.zoom, srid, feature_map, feature)
-
-        cover = feature_map.keys()
+        features = tqdm(geojson_features(args.geojson), ascii=True, unit="feature")  # streamed, feature by feature
+        cover = cover_union(
+            geojson_parse_feature(args.zoom, srid, collections.defaultdict(list), feature).keys()
+            for srid, feature in features
+        )
 
     if args.sql:
         print("RoboSat.pink - cover from {} {} at zoom {}".format(args.sql, args.pg, args.zoom), file=sys.stderr, flush=True)
         conn = psycopg2.connect(args.pg)
         assert conn, "Unable to connect to PostgreSQL database."
-        db = conn.cursor()
-
-        query = """
-            WITH
-              sql  AS ({}),
-              geom AS (SELECT "1" AS geom FROM sql AS t("1"))
-              SELECT '{{"type": "Feature", "geometry": '
-                     || ST_AsGeoJSON((ST_Dump(ST_Transform(ST_Force2D(geom.geom), 4326))).geom, 6)
-                     || '}}' AS features
-              FROM geom
-            """.format(
-            args.sql
-        )
-
-        db.execute(query)
-        assert db.rowcount is not None and db.rowcount != -1, "SQL Query return no result."
-
-        feature_map = collections.defaultdict(list)
 
-        for feature in tqdm(db.fetchall(), ascii=True, unit="feature"):  # FIXME: fetchall will not always fit in memory...
-            feature_map = geojson_parse_feature(args.zoom, 4326, feature_map, json.loads(feature[0]))
-
-        cover = feature_map.keys()
+        geometries = tqdm(postgis_geometries(conn, args.sql), ascii=True, unit="feature")  # streamed, by batches
+        cover = cover_union(
+            geojson_parse_feature(args.zoom, 4326, collections.defaultdict(list), {"geometry": geometry}).keys()
+            for geometry in geometries
+        )
+        conn.close()
 
     if args.bbox:
         print("RoboSat.pink - cover from {} at zoom {}".format(args.bbox, args.zoom), file=sys.stderr, flush=True)
@@ -142,38 +122,15 @@ def main(args):
         print("RoboSat.pink - cover from {}".format(args.dir), file=sys.stderr, flush=True)
         cover = [tile for tile in tiles_from_dir(args.dir, xyz=not (args.no_xyz))]
 
-    _cover = []
-    extent_w, extent_s, extent_n, extent_e = (180.0, 90.0, -180.0, -90.0)
-    for tile in tqdm(cover, ascii=True, unit="tile"):
-        if args.zoom and tile.z != args.zoom:
-            w, s, n, e = transform_bounds("EPSG:3857", "EPSG:4326", *xy_bounds(tile))
-            for t in tiles(w, s, n, e, args.zoom):
-                unique = True
-                for _t in _cover:
-                    if _t == t:
-                        unique = False
-                if unique:
-                    _cover.append(t)
-        else:
-            if args.extent:
-                w, s, n, e = transform_bounds("EPSG:3857", "EPSG:4326", *xy_bounds(tile))
-            _cover.append(tile)
-
+    cover = cover if isinstance(cover, np.ndarray) else list(cover)
+    if not args.no_xyz:
         if args.extent:
-            extent_w, extent_s, extent_n, extent_e = (min(extent_w, w), min(extent_s, s), max(extent_n, n), max(extent_e, e))
-
-    cover = _cover
+            extent_w, extent_s, extent_e, extent_n = cover_bounds(cover) if len(cover) else (180.0, 90.0, -180.0, -90.0)
+        if args.zoom:
+            cover = cover_to_zoom(cover, args.zoom)  # children or parents, by integer tiles arithmetic
 
     if args.splits:
-        shuffle(cover)  # in-place
-        cover_splits = [math.floor(len(cover) * split / 100) for i, split in enumerate(splits, 1)]
-        if len(splits) > 1 and sum(map(int, splits)) == 100 and len(cover) > sum(map(int, splits)):
-            cover_splits[0] = len(cover) - sum(map(int, cover_splits[1:]))  # no tile waste
-        s = 0
-        covers = []
-        for e in cover_splits:
-            covers.append(cover[s : s + e])
-            s += e
+        covers = cover_split(cover, splits)
     else:
         covers = [cover]
 
@@ -181,7 +138,7 @@ def main(args):
         if args.out and os.path.dirname(args.out[0]) and not os.path.isdir(os.path.dirname(args.out[0])):
             os.makedirs(os.path.dirname(args.out[0]), exist_ok=True)
 
-        extent = "{:.8f},{:.8f},{:.8f},{:.8f}".format(extent_w, extent_s, extent_n, extent_e)
+        extent = "{:.8f},{:.8f},{:.8f},{:.8f}".format(extent_w, extent_s, extent_e, extent_n)
 
         if args.out:
             with open(args.out[0], "w") as fp:
@@ -194,5 +151,8 @@ def main(args):
             if os.path.dirname(args.out[i]) and not os.path.isdir(os.path.dirname(args.out[i])):
                 os.makedirs(os.path.dirname(args.out[i]), exist_ok=True)
 
-            with open(args.out[i], "w") as fp:
-                csv.writer(fp).writerows(cover)
+            if args.no_xyz:
+                with open(args.out[i], "w") as fp:
+                    csv.writer(fp).writerows(cover)
+            else:
+                cover_to_file(args.out[i], cover)
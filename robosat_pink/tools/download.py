@@ -1,15 +1,20 @@
 import os
+import re
 import sys
-import time
-import math
-import concurrent.futures as futures
+import asyncio
+import collections
 
-import requests
+import cv2
+import numpy as np
 from tqdm import tqdm
-from mercantile import xy_bounds
+from mercantile import Tile, xy_bounds
 
 from robosat_pink.core import web_ui, Logs
-from robosat_pink.tiles import tiles_from_csv, tile_image_from_url, tile_image_to_file
+from robosat_pink.downloader import download
+from robosat_pink.tiles import tiles_from_csv, tile_from_xyz, tile_data_format, tile_data_to_file, tile_data_transcode
+from robosat_pink.tiles import tile_data_blank, tile_image_blank, tile_placeholders_from_file
+from robosat_pink.tiles import tile_fingerprint, TilesManifest
+from robosat_pink.stores.core import store_type, store_open, store_close, store_sidecar
 
 
 def add_parser(subparser, formatter_class):
@@ -22,14 +27,25 @@ def add_parser(subparser, formatter_class):
     ws.add_argument("--type", type=str, default="XYZ", choices=["XYZ", "WMS"], help="service type [default: XYZ]")
     ws.add_argument("--rate", type=int, default=10, help="download rate limit in max requests/seconds [default: 10]")
     ws.add_argument("--timeout", type=int, default=10, help="download request timeout (in seconds) [default: 10]")
-    ws.add_argument("--workers", type=int, help="number of workers [default: CPU / 2]")
+    ws.add_argument("--retries", type=int, default=2, help="retries on a failed request, with backoff [default: 2]")
+    ws.add_argument("--workers", type=int, default=16, help="number of concurrent requests [default: 16]")
+    ws.add_argument("--pool", type=int, help="HTTP keep-alive connections pool size [default: workers]")
+    help = "WMS only, request NxN tiles at once, as a single image, then sliced in tiles [default: 1]"
+    ws.add_argument("--metatile", type=int, default=1, help=help)
 
     cover = parser.add_argument_group("Coverage to download")
     cover.add_argument("cover", type=str, help="path to .csv tiles list [required]")
 
     out = parser.add_argument_group("Output")
-    out.add_argument("--format", type=str, default="webp", help="file format to save images in [default: webp]")
-    out.add_argument("out", type=str, help="output directory path [required]")
+    help = "image format to transcode tiles to, if not already in [default: keep server tiles as is]"
+    out.add_argument("--format", type=str, choices=["webp", "png", "jpg", "tiff"], help=help)
+    out.add_argument("out", type=str, help="output directory path, or .pack, .mbtiles, .gpkg store file path [required]")
+
+    blank = parser.add_argument_group("Blank tiles")
+    help = "skip tiles with every band standard deviation under this value (decoding each tile) [default: 0]"
+    blank.add_argument("--blank_threshold", type=float, default=0, help=help)
+    help = "path to a file with placeholders tiles sha1, one per line (e.g sha1sum output), to skip them too"
+    blank.add_argument("--placeholders", type=str, help=help)
 
     ui = parser.add_argument_group("Web UI")
     ui.add_argument("--web_ui_base_url", type=str, help="alternate Web UI base URL")
@@ -39,80 +55,195 @@ def add_parser(subparser, formatter_class):
     parser.set_defaults(func=main)
 
 
-def main(args):
-
-    tiles = list(tiles_from_csv(args.cover))
-    os.makedirs(os.path.expanduser(args.out), exist_ok=True)
-
-    if not args.workers:
-        args.workers = max(1, math.floor(os.cpu_count() * 0.5))
+def metatile_url(url, origin, cols, rows):
+    """WMS URL of a metatile: bbox from its origin tile, and WIDTH and HEIGHT scaled by its size in tiles."""
 
-    log = Logs(os.path.join(args.out, "log"), out=sys.stderr)
-    log.log("RoboSat.pink - download with {} workers, at max {} req/s, from: {}".format(args.workers, args.rate, args.url))
+    w, _, _, n = xy_bounds(origin)
+    _, s, e, _ = xy_bounds(Tile(origin.x + cols - 1, origin.y + rows - 1, origin.z))
+    url = re.sub(r"(?i)([?&]width=)(\d+)", lambda m: m.group(1) + str(int(m.group(2)) * cols), url)
+    url = re.sub(r"(?i)([?&]height=)(\d+)", lambda m: m.group(1) + str(int(m.group(2)) * rows), url)
 
-    already_dl = 0
-    dl = 0
+    return url.format(xmin=w, ymin=s, xmax=e, ymax=n)
 
-    with requests.Session() as session:
 
-        progress = tqdm(total=len(tiles), ascii=True, unit="image")
-        with futures.ThreadPoolExecutor(args.workers) as executor:
+def metatile_split(data, origin, cols, rows, tiles, ext, blank_threshold=0):
+    """Slice a metatile image data in tiles, and yield each (tile, data) encoded in ext format, or (tile, None) if blank."""
 
-            def worker(tile):
-                tick = time.monotonic()
-                progress.update()
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    assert image is not None, "Unable to decode metatile"
+    height, width = image.shape[0] // rows, image.shape[1] // cols
 
-                try:
-                    x, y, z = map(str, [tile.x, tile.y, tile.z])
-                    os.makedirs(os.path.join(args.out, z, x), exist_ok=True)
-                except:
-                    return tile, None, False
+    for tile in tiles:
+        i, j = tile.y - origin.y, tile.x - origin.x
+        tile_image = image[i * height : (i + 1) * height, j * width : (j + 1) * width]
+        if tile_image_blank(tile_image, blank_threshold):
+            yield tile, None
+            continue
 
-                path = os.path.join(args.out, z, x, "{}.{}".format(y, args.format))
-                if os.path.isfile(path):  # already downloaded
-                    return tile, None, True
+        ret, tile_data = cv2.imencode("." + ext, tile_image)
+        assert ret, "Unable to encode tile"
+        yield tile, tile_data.tobytes()
 
-                if args.type == "XYZ":
-                    url = args.url.format(x=tile.x, y=tile.y, z=tile.z)
-                elif args.type == "WMS":
-                    xmin, ymin, xmax, ymax = xy_bounds(tile)
-                    url = args.url.format(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
 
-                res = tile_image_from_url(session, url, args.timeout)
-                if res is None:  # let's retry once
-                    res = tile_image_from_url(session, url, args.timeout)
-                    if res is None:
-                        return tile, url, False
-
-                try:
-                    tile_image_to_file(args.out, tile, res)
-                except OSError:
-                    return tile, url, False
-
-                tock = time.monotonic()
+def main(args):
 
-                time_for_req = tock - tick
-                time_per_worker = args.workers / args.rate
+    assert args.metatile >= 1, "--metatile expect a strictly positive value"
+    if args.metatile > 1:
+        assert args.type == "WMS", "--metatile is only available with WMS"
+        assert re.search(r"(?i)[?&]width=\d+", args.url), "--metatile expect WIDTH and HEIGHT values in WMS URL"
+        assert re.search(r"(?i)[?&]height=\d+", args.url), "--metatile expect WIDTH and HEIGHT values in WMS URL"
 
-                if time_for_req < time_per_worker:
-                    time.sleep(time_per_worker - time_for_req)
+    cover = list(tiles_from_csv(args.cover))
+    if not store_type(args.out):
+        os.makedirs(os.path.expanduser(args.out), exist_ok=True)
 
-                return tile, url, True
+    log = Logs(os.path.join(args.out, "log"), out=sys.stderr)
+    log.log("RoboSat.pink - download with {} workers, at max {} req/s, from: {}".format(args.workers, args.rate, args.url))
 
-            for tile, url, ok in executor.map(worker, tiles):
-                if url and ok:
-                    dl += 1
-                elif not url and ok:
-                    already_dl += 1
-                else:
-                    log.log("Warning:\n {} failed, skipping.\n {}\n".format(tile, url))
+    manifest = TilesManifest(os.path.join(args.out, "manifest"))
+    if store_type(args.out):
+        store_open(args.out, "a")  # so resume probes read the very store being appended
+    fingerprint = tile_fingerprint(args.url, args.type, args.format, args.blank_threshold, args.placeholders)
+
+    placeholders = tile_placeholders_from_file(args.placeholders) if args.placeholders else set()
+    skip_path = store_sidecar(os.path.join(os.path.expanduser(args.out), "skip"))
+    skipped = set(tiles_from_csv(skip_path)) if os.path.isfile(skip_path) else set()
+    skip = open(skip_path, "a")  # blank tiles, never written, so never decoded nor predicted by later stages
+
+    tiles = [tile for tile in cover if not manifest.done(tile, fingerprint)]  # resume: skip tiles already downloaded
+    already_dl = len(cover) - len(tiles)
+    dl = blank = 0
+    exts = collections.Counter()
+
+    metatiles = collections.defaultdict(list)  # metatile origin -> its tiles to download
+    if args.metatile > 1:
+        for tile in tiles:
+            origin = Tile(tile.x - tile.x % args.metatile, tile.y - tile.y % args.metatile, tile.z)
+            metatiles[origin].append(tile)
+
+    def tasks():
+        nonlocal already_dl
+
+        if args.metatile > 1:
+            for origin, metatile in metatiles.items():
+                todo = [tile for tile in metatile if tile in manifest or not tile_from_xyz(args.out, *tile)]
+                already_dl += len(metatile) - len(todo)
+                for tile in metatile:
+                    if tile not in todo:
+                        manifest.add(tile, fingerprint)
+                if not todo:
+                    progress.update()
+                    continue
+
+                side = 1 << origin.z  # metatile clipped to the tiles grid
+                cols, rows = min(args.metatile, side - origin.x), min(args.metatile, side - origin.y)
+                yield (origin, cols, rows, todo), metatile_url(args.url, origin, cols, rows)
+            return
+
+        for tile in tiles:
+            if tile not in manifest and tile_from_xyz(args.out, tile.x, tile.y, tile.z):  # downloaded, before manifests
+                already_dl += 1
+                manifest.add(tile, fingerprint)
+                progress.update()
+                continue
+
+            if args.type == "XYZ":
+                url = args.url.format(x=tile.x, y=tile.y, z=tile.z)
+            elif args.type == "WMS":
+                xmin, ymin, xmax, ymax = xy_bounds(tile)
+                url = args.url.format(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
+
+            yield tile, url
+
+    def write(tile, data):
+        """Write tile(s) data, and return their extension, and blank tiles list, or None on failure."""
+
+        ext = tile_data_format(data)  # cheap header sniff, rather than a full decode
+        if ext is None:
+            return None
+
+        target = args.format
+        if not target and store_type(args.out):  # single format stores (i.e MBTiles, GeoPackage) set their own
+            target = getattr(store_open(args.out, "a"), "format", None)
+
+        if args.metatile > 1:
+            origin, cols, rows, todo = tile
+            if tile_data_blank(data, placeholders, 0):  # a whole placeholder metatile
+                return ext, todo
+
+            ext, blanks = target if target else ext, []
+            try:
+                for metatile_tile, tile_data in metatile_split(data, origin, cols, rows, todo, ext, args.blank_threshold):
+                    if tile_data is None:
+                        blanks.append(metatile_tile)
+                    else:
+                        tile_data_to_file(args.out, metatile_tile, ext, tile_data)
+                return ext, blanks
+            except (AssertionError, OSError, cv2.error):
+                return None
+
+        if tile_data_blank(data, placeholders, args.blank_threshold):
+            return ext, [tile]
+
+        if target and target != ext:  # transcode only if really required
+            data, ext = tile_data_transcode(data, target), target
+            if data is None:
+                return None
+
+        try:
+            return (ext, []) if tile_data_to_file(args.out, tile, ext, data) else None
+        except (AssertionError, OSError):  # e.g a first tiles format race, in a single format store
+            return None
+
+    def done(tile, url, written):
+        nonlocal dl, blank
+
+        todo = tile[3] if args.metatile > 1 else [tile]
+        if not written:
+            log.log("Warning:\n {} failed, skipping.\n {}\n".format(", ".join(map(str, todo)), url))
+            return
+
+        ext, blanks = written
+        for tile in todo:
+            manifest.add(tile, fingerprint)
+            if tile in blanks:
+                skip.write("{},{},{}\n".format(tile.x, tile.y, tile.z))
+                skipped.add(tile)
+                blank += 1
+            else:
+                dl += 1
+                exts[ext] += 1
+                skipped.discard(tile)
+        manifest.flush()
+        skip.flush()
+
+    if args.metatile > 1:
+        progress = tqdm(total=len(metatiles), ascii=True, unit="metatile")
+    else:
+        progress = tqdm(total=len(tiles), ascii=True, unit="image")
+    engine = download(tasks(), write, done, args.workers, args.pool, args.rate, args.timeout, args.retries, progress)
+    stats = asyncio.run(engine)
+    progress.close()
+    log.log("Notice: {}".format(stats))
+
+    manifest.close()
+    store_close(args.out)
+
+    skip.close()
+    if skipped:  # rewritten, so holding each blank tile once, and no more the ones downloaded since
+        with open(skip_path, "w") as fp:
+            fp.writelines("{},{},{}\n".format(*tile) for tile in sorted(skipped))
+        log.log("Notice: {} blank or placeholder tiles skipped, listed in: {}".format(len(skipped), skip_path))
+    else:
+        os.remove(skip_path)
 
     if already_dl:
         log.log("Notice: {} tiles were already downloaded previously, and so skipped now.".format(already_dl))
-    if already_dl + dl == len(tiles):
+    if already_dl + dl + blank == len(cover):
         log.log("Notice: Coverage is fully downloaded.")
 
     if not args.no_web_ui:
         template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
         base_url = args.web_ui_base_url if args.web_ui_base_url else "."
-        web_ui(args.out, base_url, tiles, tiles, args.format, template)
+        ext = args.format if args.format else (exts.most_common(1)[0][0] if exts else "webp")
+        web_ui(args.out, base_url, cover, cover, ext, template)
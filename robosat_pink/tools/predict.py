@@ -10,6 +10,7 @@ from torch.utils.data import DataLoader
 
 from robosat_pink.core import load_config, load_module, check_classes, check_channels, make_palette, web_ui, Logs
 from robosat_pink.tiles import tiles_from_dir, tile_label_to_file
+from robosat_pink.stores.core import store_close
 
 
 def add_parser(subparser, formatter_class):
@@ -23,7 +24,7 @@ def add_parser(subparser, formatter_class):
     inp.add_argument("--config", type=str, help="path to config file [required]")
 
     out = parser.add_argument_group("Outputs")
-    out.add_argument("out", type=str, help="output directory path [required]")
+    out.add_argument("out", type=str, help="output directory path, or .pack, .mbtiles, .gpkg store file path [required]")
 
     perf = parser.add_argument_group("Data Loaders")
     perf.add_argument("--workers", type=int, help="number of workers to load images [default: GPU x 2]")
@@ -85,6 +86,8 @@ def main(args):
                 mask = np.around(prob[1:, :, :]).astype(np.uint8).squeeze()
                 tile_label_to_file(args.out, mercantile.Tile(x, y, z), palette, mask)
 
+    store_close(args.out)
+
     if not args.no_web_ui:
         template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
         base_url = args.web_ui_base_url if args.web_ui_base_url else "."
@@ -2,8 +2,10 @@ import os
 import re
 import sys
 import math
-import json
 import collections
+import contextlib
+import concurrent.futures as futures
+from functools import partial
 
 import numpy as np
 from tqdm import tqdm
@@ -11,8 +13,12 @@ from tqdm import tqdm
 import psycopg2
 
 from robosat_pink.core import load_config, check_classes, make_palette, web_ui, Logs
-from robosat_pink.tiles import tiles_from_csv, tile_label_to_file, tile_bbox
-from robosat_pink.geojson import geojson_srid, geojson_tile_burn, geojson_parse_feature
+from robosat_pink.tiles import cover_from_file, cover_tiles, cover_chunks, tile_label_to_file, tile_bbox
+from robosat_pink.stores.core import store_type, store_sidecar, store_close
+from robosat_pink.geojson import geojson_features, geojson_tile_burn, geojson_parse_feature, GeoJSONTileIndex
+from robosat_pink.postgis import postgis_geometries
+
+PG_CHUNK = 6  # PostGIS features are queried at once for each 2^6 x 2^6 tiles area
 
 
 def add_parser(subparser, formatter_class):
@@ -21,19 +27,29 @@ def add_parser(subparser, formatter_class):
     )
 
     inp = parser.add_argument_group("Inputs [either --postgis or --geojson is required]")
-    inp.add_argument("--cover", type=str, help="path to csv tiles cover file [required]")
+    inp.add_argument("--cover", type=str, help="path to csv, or .npy, tiles cover file [required]")
     inp.add_argument("--config", type=str, help="path to config file [required]")
-    inp.add_argument("--type", type=str, required=True, help="type of feature to rasterize (e.g Building, Road) [required]")
+    help = (
+        "type of feature to rasterize (e.g Building), or comma separated types, burnt at once (e.g Building,Road) [required]"
+    )
+    inp.add_argument("--type", type=str, required=True, help=help)
     inp.add_argument("--pg", type=str, help="PostgreSQL dsn using psycopg2 syntax (e.g 'dbname=db user=postgres')")
-    help = "SQL to retrieve geometry features [e.g SELECT geom FROM a_table WHERE ST_Intersects(TILE_GEOM, geom)]"
-    inp.add_argument("--sql", type=str, help=help)
-    inp.add_argument("--geojson", type=str, nargs="+", help="path to GeoJSON features files")
+    help = (
+        "SQL to retrieve geometry features, once by type [e.g SELECT geom FROM a_table WHERE ST_Intersects(TILE_GEOM, geom)]"
+    )
+    inp.add_argument("--sql", type=str, action="append", help=help)
+    help = "path to GeoJSON, or newline delimited GeoJSON, features files, or with several --type, one file by type"
+    inp.add_argument("--geojson", type=str, nargs="+", help=help)
 
     out = parser.add_argument_group("Outputs")
-    out.add_argument("out", type=str, help="output directory path [required]")
+    out.add_argument("out", type=str, help="output directory path, or .pack, .mbtiles, .gpkg store file path [required]")
     out.add_argument("--append", action="store_true", help="Append to existing tile if any, useful to multiclass labels")
     out.add_argument("--ts", type=str, default="512,512", help="output tile size [default: 512,512]")
 
+    perf = parser.add_argument_group("Performances")
+    perf.add_argument("--workers", type=int, help="number of processes workers [default: CPU]")
+    perf.add_argument("--chunk_size", type=int, default=256, help="number of tiles by worker task [default: 256]")
+
     ui = parser.add_argument_group("Web UI")
     ui.add_argument("--web_ui_base_url", type=str, help="alternate Web UI base URL")
     ui.add_argument("--web_ui_template", type=str, help="alternate Web UI template path")
@@ -42,46 +58,83 @@ def add_parser(subparser, formatter_class):
     parser.set_defaults(func=main)
 
 
+def rasterize_chunk(args, palette, burn_values, task):
+    """Burn a chunk of tiles labels, each type features in its own bit, writing them on disk, or returning them
+    to be written in a store. Return each tile features counts, by type, and labels left to write."""
+
+    ts = list(map(int, args.ts.split(",")))
+    counts, labels = [], []
+
+    for tile, features in task:
+        out = np.zeros(shape=ts, dtype=np.uint8)
+        num = []
+
+        for type_features, burn_value in zip(features, burn_values):
+            burnt = geojson_tile_burn(tile, type_features, 4326, ts, burn_value) if type_features else None
+            num.append(len(type_features) if burnt is not None else 0)
+            if burnt is not None:
+                out |= np.uint8(burnt)
+
+        if store_type(args.out):  # a single file store, so written by the caller only
+            labels.append((tile, out))
+        else:
+            tile_label_to_file(args.out, tile, palette, out, append=args.append)
+        counts.append((tile, num))
+
+    return counts, labels
+
+
 def main(args):
 
+    types = args.type.split(",")
+    sqls = [args.sql] if isinstance(args.sql, str) else args.sql
+
     assert not (args.sql and args.geojson), "You can only use at once --pg OR --geojson."
     assert not (args.pg and not args.sql), "With PostgreSQL --pg, --sql must also be provided"
+    assert not (args.sql and len(sqls) != len(types)), "With PostgreSQL --pg, one --sql by --type is expected"
+    assert not (args.geojson and len(types) > 1 and len(args.geojson) != len(types)), "One --geojson by --type expected"
+    assert len(set(types)) == len(types), "Duplicated --type"
     assert len(args.ts.split(",")) == 2, "--ts expect width,height value (e.g 512,512)"
+    if not args.workers:
+        args.workers = os.cpu_count()
 
     config = load_config(args.config)
     check_classes(config)
 
     palette = make_palette([classe["color"] for classe in config["classes"]], complementary=True)
-    index = [config["classes"].index(classe) for classe in config["classes"] if classe["title"] == args.type]
-    assert index, "Requested type is not contains in your config file classes."
-    burn_value = int(math.pow(2, index[0] - 1))  # 8bits One Hot Encoding
-    assert 0 <= burn_value <= 128
+    burn_values = []
+    for title in types:
+        index = [config["classes"].index(classe) for classe in config["classes"] if classe["title"] == title]
+        assert index, "Requested type {} is not contains in your config file classes.".format(title)
+        burn_values.append(int(math.pow(2, index[0] - 1)))  # 8bits One Hot Encoding
+        assert 0 <= burn_values[-1] <= 128
 
     args.out = os.path.expanduser(args.out)
-    os.makedirs(args.out, exist_ok=True)
+    if not store_type(args.out):
+        os.makedirs(args.out, exist_ok=True)
     log = Logs(os.path.join(args.out, "log"), out=sys.stderr)
 
-    if args.geojson:
+    tiles = cover_from_file(args.cover)
+    assert tiles is not None and len(tiles), "Empty, or not XYZ, cover"
 
-        tiles = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))]
-        assert tiles, "Empty cover"
+    if args.geojson:
 
-        zoom = tiles[0].z
-        assert not [tile for tile in tiles if tile.z != zoom], "Unsupported zoom mixed cover. Use PostGIS instead"
+        zoom = int(tiles[0, 2])
+        assert (tiles[:, 2] == zoom).all(), "Unsupported zoom mixed cover. Use PostGIS instead"
 
-        feature_map = collections.defaultdict(list)
+        indexes = []
+        geojson_files = [args.geojson] if len(types) == 1 else [[geojson_file] for geojson_file in args.geojson]
+        spill_dir = os.path.dirname(store_sidecar(os.path.join(args.out, "log"))) or "."  # rather than a small /tmp
 
         log.log("RoboSat.pink - rasterize - Compute spatial index")
-        for geojson_file in args.geojson:
+        for type_geojson_files in geojson_files:
 
-            with open(os.path.expanduser(geojson_file)) as geojson:
-                feature_collection = json.load(geojson)
-                srid = geojson_srid(feature_collection)
+            index = GeoJSONTileIndex(zoom, spill_dir)
+            for geojson_file in type_geojson_files:
+                for srid, feature in tqdm(geojson_features(geojson_file), ascii=True, unit="feature"):  # streamed
+                    index.add(srid, feature)
 
-                feature_map = collections.defaultdict(list)
-
-                for i, feature in enumerate(tqdm(feature_collection["features"], ascii=True, unit="feature")):
-                    feature_map = geojson_parse_feature(zoom, srid, feature_map, feature)
+            indexes.append(index)
 
         features = args.geojson
 
@@ -90,68 +143,118 @@ def main(args):
         conn = psycopg2.connect(args.pg)
         db = conn.cursor()
 
-        assert "limit" not in args.sql.lower(), "LIMIT is not supported"
-        assert "TILE_GEOM" in args.sql, "TILE_GEOM filter not found in your SQL"
-        sql = re.sub(r"ST_Intersects( )*\((.*)?TILE_GEOM(.*)?\)", "1=1", args.sql, re.I)
-        assert sql and sql != args.sql
-
-        db.execute("""SELECT ST_Srid("1") AS srid FROM ({} LIMIT 1) AS t("1")""".format(sql))
-        srid = db.fetchone()[0]
-        assert srid and int(srid) > 0, "Unable to retrieve geometry SRID."
-
-        features = args.sql
-
-    log.log("RoboSat.pink - rasterize - rasterizing {} from {} on cover {}".format(args.type, features, args.cover))
-    with open(os.path.join(os.path.expanduser(args.out), "instances_" + args.type.lower() + ".cover"), mode="w") as cover:
-
-        for tile in tqdm(list(tiles_from_csv(os.path.expanduser(args.cover))), ascii=True, unit="tile"):
+        srids = []
+        for type_sql in sqls:
+            assert "limit" not in type_sql.lower(), "LIMIT is not supported"
+            assert "TILE_GEOM" in type_sql, "TILE_GEOM filter not found in your SQL"
+            sql = re.sub(r"ST_Intersects( )*\((.*)?TILE_GEOM(.*)?\)", "1=1", type_sql, re.I)
+            assert sql and sql != type_sql
 
-            geojson = None
+            db.execute("""SELECT ST_Srid("1") AS srid FROM ({} LIMIT 1) AS t("1")""".format(sql))
+            srid = db.fetchone()[0]
+            assert srid and int(srid) > 0, "Unable to retrieve geometry SRID."
+            conn.commit()
+            srids.append(srid)
 
-            if args.pg:
+        features = sqls
 
-                w, s, e, n = tile_bbox(tile)
-                tile_geom = "ST_Transform(ST_MakeEnvelope({},{},{},{}, 4326), {})".format(w, s, e, n, srid)
+    def pg_feature_map(sql, srid, area, zoom):
+        """Query PostGIS features once for a whole area tile, and map them to their zoom tiles, or return None."""
 
-                query = """
-                WITH
-                  sql  AS ({}),
-                  geom AS (SELECT "1" AS geom FROM sql AS t("1")),
-                  json AS (SELECT '{{"type": "Feature", "geometry": '
-                         || ST_AsGeoJSON((ST_Dump(ST_Transform(ST_Force2D(geom.geom), 4326))).geom, 6)
-                         || '}}' AS features
-                        FROM geom)
-                SELECT '{{"type": "FeatureCollection", "features": [' || Array_To_String(array_agg(features), ',') || ']}}'
-                FROM json
-                """.format(
-                    args.sql.replace("TILE_GEOM", tile_geom)
-                )
+        w, s, e, n = tile_bbox(area)
+        tile_geom = "ST_Transform(ST_MakeEnvelope({},{},{},{}, 4326), {})".format(w, s, e, n, srid)
 
-                db.execute(query)
-                row = db.fetchone()
-                try:
-                    geojson = json.loads(row[0])["features"] if row and row[0] else None
-                except Exception:
-                    log.log("Warning: Invalid geometries, skipping {}".format(tile))
-                    conn = psycopg2.connect(args.pg)
-                    db = conn.cursor()
-
-            if args.geojson:
-                geojson = feature_map[tile] if tile in feature_map else None
-
-            if geojson:
-                num = len(geojson)
-                out = geojson_tile_burn(tile, geojson, 4326, list(map(int, args.ts.split(","))), burn_value)
-
-            if not geojson or out is None:
-                num = 0
-                out = np.zeros(shape=list(map(int, args.ts.split(","))), dtype=np.uint8)
-
-            tile_label_to_file(args.out, tile, palette, out, append=args.append)
-            cover.write("{},{},{}  {}{}".format(tile.x, tile.y, tile.z, num, os.linesep))
+        feature_map = collections.defaultdict(list)
+        try:
+            for geometry in postgis_geometries(conn, sql.replace("TILE_GEOM", tile_geom)):
+                feature_map = geojson_parse_feature(zoom, 4326, feature_map, {"type": "Feature", "geometry": geometry})
+            conn.commit()
+        except psycopg2.Error:
+            conn.rollback()
+            return None
+
+        return feature_map
+
+    def tiles_features(chunk, chunk_maps, zoom):
+        """Yield each chunk tile, with its features by type, if any."""
+
+        for tile in cover_tiles(chunk):
+            tile_features = []
+            for i, chunk_map in enumerate(chunk_maps):
+                if chunk_map is None:  # area query failed, so fallback on tile ones, to skip only faulty tiles
+                    tile_map = pg_feature_map(sqls[i], srids[i], tile, zoom)
+                    if tile_map is None:
+                        log.log("Warning: Invalid {} geometries, skipping {}".format(types[i], tile))
+                    tile_features.append(tile_map.get(tile) if tile_map else None)
+                else:
+                    tile_features.append(chunk_map.get(tile))
+            yield tile, tile_features
+
+    def tasks():
+        """Yield tasks, as lists of (tile, features), spatially sharded, so each one gets only its own features."""
+
+        for area, chunk in cover_chunks(tiles, PG_CHUNK):
+            zoom = int(chunk[0, 2])
+            if args.pg:  # one query by area and type, not by tile
+                chunk_maps = [pg_feature_map(sql, srid, area, zoom) for sql, srid in zip(sqls, srids)]
+            else:
+                chunk_maps = [index.features(chunk) for index in indexes]  # loaded from disk, only chunk by chunk
+
+            task = []
+            for tile, tile_features in tiles_features(chunk, chunk_maps, zoom):
+                task.append((tile, tile_features))
+                if len(task) >= args.chunk_size:
+                    yield task
+                    task = []
+            if task:
+                yield task
+
+    log.log("RoboSat.pink - rasterize - rasterizing {} from {} on cover {}".format(types, features, args.cover))
+    log.log("RoboSat.pink - rasterize - with {} processes workers".format(args.workers))
+    with contextlib.ExitStack() as stack:
+        covers = []
+        for title in types:
+            cover_path = store_sidecar(os.path.join(args.out, "instances_" + title.lower() + ".cover"))
+            covers.append(stack.enter_context(open(cover_path, mode="w")))
+        progress = tqdm(total=len(tiles), ascii=True, unit="tile")
+        tiles_counts = {}  # written once done, in input cover order, rather than in spatially sharded tasks order
+
+        def done(result):
+            counts, labels = result
+            for tile, out in labels:
+                tile_label_to_file(args.out, tile, palette, out, append=args.append)
+            for tile, num in counts:
+                tiles_counts[tile] = num
+            progress.update(len(counts))
+
+        worker = partial(rasterize_chunk, args, palette, burn_values)
+        if args.workers == 1:
+            for task in tasks():
+                done(worker(task))
+        else:
+            with futures.ProcessPoolExecutor(args.workers) as executor:
+                pending = collections.deque()  # results handled in tasks order, so a deterministic cover output
+                for task in tasks():
+                    pending.append(executor.submit(worker, task))
+                    if len(pending) > 2 * args.workers:  # bounded, so memory stays flat, whatever the cover size
+                        done(pending.popleft().result())
+                while pending:
+                    done(pending.popleft().result())
+
+        for tile in cover_tiles(tiles):
+            num = tiles_counts.pop(tile, None)
+            for cover, type_num in zip(covers, num or []):
+                cover.write("{},{},{}  {}{}".format(tile.x, tile.y, tile.z, type_num, os.linesep))
+
+        progress.close()
+
+    store_close(args.out)
+    if args.geojson:
+        for index in indexes:
+            index.close()
 
     if not args.no_web_ui:
         template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
         base_url = args.web_ui_base_url if args.web_ui_base_url else "."
-        tiles = [tile for tile in tiles_from_csv(args.cover)]
+        tiles = list(cover_tiles(tiles))
         web_ui(args.out, base_url, tiles, tiles, "png", template)
@@ -5,7 +5,7 @@ import shutil
 import mercantile
 from tqdm import tqdm
 
-from robosat_pink.tiles import tiles_from_csv, tile_from_xyz
+from robosat_pink.tiles import tiles_from_csv, tile_from_xyz, cover_from_file, cover_unique, cover_tiles
 from robosat_pink.core import web_ui
 
 
@@ -15,7 +15,7 @@ def add_parser(subparser, formatter_class):
     )
     inp = parser.add_argument_group("Inputs")
     inp.add_argument("--dir", type=str, required=True, help="to XYZ tiles input dir path [required]")
-    inp.add_argument("--cover", type=str, required=True, help="path to csv cover file to filter dir by [required]")
+    inp.add_argument("--cover", type=str, required=True, help="path to csv, or .npy, cover file to filter dir by [required]")
 
     mode = parser.add_argument_group("Alternate modes, as default is to create relative symlinks.")
     mode.add_argument("--copy", action="store_true", help="copy tiles from input to output")
@@ -39,9 +39,15 @@ def main(args):
     print("RoboSat.pink - subset {} with cover {}, on CPU".format(args.dir, args.cover), file=sys.stderr, flush=True)
 
     ext = set()
-    tiles = set(tiles_from_csv(os.path.expanduser(args.cover)))
+    cover = cover_from_file(args.cover)
+    if cover is not None:
+        cover = cover_unique(cover)
+        tiles, total = cover_tiles(cover), len(cover)
+    else:
+        tiles = set(tiles_from_csv(os.path.expanduser(args.cover)))
+        total = len(tiles)
 
-    for tile in tqdm(tiles, ascii=True, unit="tiles"):
+    for tile in tqdm(tiles, total=total, ascii=True, unit="tiles"):
 
         if isinstance(tile, mercantile.Tile):
             src_tile = tile_from_xyz(args.dir, tile.x, tile.y, tile.z)
@@ -73,8 +79,9 @@ def main(args):
             os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
             assert os.path.islink(dst)
 
-    if tiles and not args.no_web_ui and not args.delete:
+    if total and not args.no_web_ui and not args.delete:
         assert len(ext) == 1, "ERROR: Mixed extensions, can't generate Web UI"
         template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
         base_url = args.web_ui_base_url if args.web_ui_base_url else "."
+        tiles = list(cover_tiles(cover)) if cover is not None else tiles
         web_ui(args.out, base_url, tiles, tiles, list(ext)[0], template)
@@ -1,28 +1,27 @@
 import os
 import sys
+import math
 from tqdm import tqdm
 import concurrent.futures as futures
+from functools import partial
 
 import numpy as np
 
-import shutil
 import mercantile
 
-from rasterio import open as rasterio_open
+from rasterio import Env, open as rasterio_open
 from rasterio.vrt import WarpedVRT
-from rasterio.enums import Resampling
-from rasterio.warp import transform_bounds, calculate_default_transform
-from rasterio.transform import from_bounds
+from rasterio.enums import Resampling, MaskFlags
+from rasterio.warp import transform, transform_bounds
+from rasterio.windows import Window
+from rasterio.transform import Affine, from_bounds
 
 from robosat_pink.core import load_config, check_classes, make_palette, web_ui
-from robosat_pink.tiles import (
-    tiles_from_csv,
-    tile_image_to_file,
-    tile_label_to_file,
-    tile_from_xyz,
-    tile_image_from_file,
-    tile_label_from_file,
-)
+from robosat_pink.tiles import cover_from_file, cover_contains, tile_image_to_file, tile_label_to_file
+from robosat_pink.tiles import tile_from_xyz, tile_image_from_file, tile_label_from_file, tile_data_to_file
+from robosat_pink.tiles import tile_image_to_bytes, tile_label_to_bytes
+from robosat_pink.tiles import tile_fingerprint, TilesManifest
+from robosat_pink.stores.core import store_type, store_close
 
 
 def add_parser(subparser, formatter_class):
@@ -30,23 +29,29 @@ def add_parser(subparser, formatter_class):
 
     inp = parser.add_argument_group("Inputs")
     inp.add_argument("rasters", type=str, nargs="+", help="path to raster files to tile [required]")
-    inp.add_argument("--cover", type=str, help="path to csv tiles cover file, to filter tiles to tile [optional]")
+    inp.add_argument("--cover", type=str, help="path to csv, or .npy, tiles cover file, to filter tiles to tile [optional]")
 
     out = parser.add_argument_group("Output")
-    out.add_argument("--zoom", type=int, required=True, help="zoom level of tiles [required]")
+    out.add_argument("--zoom", type=str, required=True, help="zoom level of tiles, or zoom levels range [e.g 18 or 17-19]")
     out.add_argument("--ts", type=str, default="512,512", help="tile size in pixels [default: 512,512]")
     help = "nodata pixel value, used by default to remove coverage border's tile [default: 0]"
     out.add_argument("--nodata", type=int, default=0, choices=range(0, 256), metavar="[0-255]", help=help)
     help = "Skip tile if nodata pixel ratio > threshold. [default: 100]"
     out.add_argument("--nodata_threshold", type=int, default=100, choices=range(0, 101), metavar="[0-100]", help=help)
-    out.add_argument("out", type=str, help="output directory path [required]")
+    help = "nodata pre-screening mask size in pixels, 0 to disable [default: 1024]"
+    out.add_argument("--nodata_prescreen", type=int, default=1024, help=help)
+    out.add_argument("out", type=str, help="output directory path, or .pack, .mbtiles, .gpkg store file path [required]")
 
     lab = parser.add_argument_group("Labels")
     lab.add_argument("--label", action="store_true", help="if set, generate label tiles")
     lab.add_argument("--config", type=str, help="path to config file [required in label mode]")
 
     perf = parser.add_argument_group("Performances")
-    perf.add_argument("--workers", type=int, help="number of workers [default: raster files]")
+    perf.add_argument("--workers", type=int, help="number of workers [default: CPU]")
+    perf.add_argument("--processes", action="store_true", help="if set, use a processes pool rather than threads workers")
+    perf.add_argument("--chunk_size", type=int, default=256, help="number of tiles by worker task [default: 256]")
+    help = "GDAL block cache size in MB, by process [default: 256]"
+    perf.add_argument("--gdal_cachemax", type=int, default=256, help=help)
 
     ui = parser.add_argument_group("Web UI")
     ui.add_argument("--web_ui_base_url", type=str, help="alternate Web UI base URL")
@@ -70,164 +75,375 @@ def is_nodata(image, nodata, threshold):
     return np.sum(image[:, :, :] == nodata) >= W * H * (threshold / 100)
 
 
-def main(args):
+def tiles_nodata_prescreen(raster, tiles, nodata, size):
+    """Filter out tiles without any valid pixel, using a low resolution raster mask, or else overview."""
 
-    if not args.workers:
-        args.workers = min(os.cpu_count(), len(args.rasters))
+    if not tiles:
+        return tiles
 
-    if args.label:
-        config = load_config(args.config)
-        check_classes(config)
-        colors = [classe["color"] for classe in config["classes"]]
-        palette = make_palette(*colors)
+    masked = [flags for flags in raster.mask_flag_enums if flags != [MaskFlags.all_valid]]
+    if masked:  # nodata, alpha band or internal mask
+        ratio = max(1, max(raster.width, raster.height) / size)
+        height, width = max(1, round(raster.height / ratio)), max(1, round(raster.width / ratio))
+        mask = raster.dataset_mask(out_shape=(height, width)) > 0
+    else:
+        factors = raster.overviews(1)
+        if not factors:
+            return tiles  # otherwise, every raster block would be decoded once more, just to screen tiles
 
-    assert len(args.ts.split(",")) == 2, "--ts expect width,height value (e.g 512,512)"
-    width, height = list(map(int, args.ts.split(",")))
+        factor = max([factor for factor in factors if max(raster.width, raster.height) / factor >= size] or [min(factors)])
+        height, width = math.ceil(raster.height / factor), math.ceil(raster.width / factor)  # an overview exact shape
+        mask = np.any(raster.read(out_shape=(raster.count, height, width)) != nodata, axis=0)
 
-    cover = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))] if args.cover else None
+    integral = np.pad(mask.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))  # summed area table
 
-    splits_path = os.path.join(os.path.expanduser(args.out), ".splits")
-    tiles_map = {}
+    corners = [mercantile.xy_bounds(tile) for tile in tiles]
+    xs = [x for w, s, e, n in corners for x in (w, e, e, w)]
+    ys = [y for w, s, e, n in corners for y in (s, s, n, n)]
+    xs, ys = transform("EPSG:3857", raster.crs, xs, ys)
 
-    print("RoboSat.pink - tile on CPU, with {} workers".format(args.workers), file=sys.stderr, flush=True)
+    cols, rows = ~(raster.transform * Affine.scale(raster.width / width, raster.height / height)) * (
+        np.array(xs),
+        np.array(ys),
+    )
+    cols, rows = cols.reshape(-1, 4), rows.reshape(-1, 4)
 
-    bands = -1
-    for path in args.rasters:
-        raster = rasterio_open(path)
-        w, s, e, n = transform_bounds(raster.crs, "EPSG:4326", *raster.bounds)
+    c0 = np.clip(np.floor(cols.min(axis=1)).astype(int) - 1, 0, width)  # one pixel dilated, to stay conservative
+    c1 = np.clip(np.ceil(cols.max(axis=1)).astype(int) + 1, 0, width)
+    r0 = np.clip(np.floor(rows.min(axis=1)).astype(int) - 1, 0, height)
+    r1 = np.clip(np.ceil(rows.max(axis=1)).astype(int) + 1, 0, height)
 
-        if bands != -1:
-            assert bands == len(raster.indexes), "Coverage must be bands consistent"
-        bands = len(raster.indexes)
+    valid = integral[r1, c1] - integral[r0, c1] - integral[r1, c0] + integral[r0, c0]
 
-        tiles = [mercantile.Tile(x=x, y=y, z=z) for x, y, z in mercantile.tiles(w, s, e, n, args.zoom)]
-        tiles = list(set(tiles) & set(cover)) if cover else tiles
+    return [tile for tile, count in zip(tiles, valid) if count]
 
-        for tile in tiles:
-            tile_key = (str(tile.x), str(tile.y), str(tile.z))
-            if tile_key not in tiles_map.keys():
-                tiles_map[tile_key] = []
-            tiles_map[tile_key].append(path)
+
+def tile_vrt(raster, tiles, width, height):
+    """Open a single EPSG:3857 WarpedVRT on a raster, pixel aligned on the tiles grid and covering all given tiles."""
+
+    zoom = tiles[0].z
+    assert not [tile for tile in tiles if tile.z != zoom], "Unsupported zoom mixed tiles"
+
+    xmin, xmax = min(tile.x for tile in tiles), max(tile.x for tile in tiles)
+    ymin, ymax = min(tile.y for tile in tiles), max(tile.y for tile in tiles)
+
+    w, _, _, n = mercantile.xy_bounds(mercantile.Tile(x=xmin, y=ymin, z=zoom))
+    _, s, e, _ = mercantile.xy_bounds(mercantile.Tile(x=xmax, y=ymax, z=zoom))
+    vrt_width, vrt_height = (xmax - xmin + 1) * width, (ymax - ymin + 1) * height
+
+    warp_vrt = WarpedVRT(
+        raster,
+        crs="epsg:3857",
+        resampling=Resampling.bilinear,
+        add_alpha=False,
+        transform=from_bounds(w, s, e, n, vrt_width, vrt_height),
+        width=vrt_width,
+        height=vrt_height,
+    )
+
+    return warp_vrt, (xmin, ymin)
+
+
+def tile_image_from_vrt(warp_vrt, origin, tile, width, height):
+    """Read a tile window from a tiles grid aligned WarpedVRT, and return it as a H,W,C numpy array."""
+
+    window = Window((tile.x - origin[0]) * width, (tile.y - origin[1]) * height, width, height)
+    return np.moveaxis(warp_vrt.read(window=window), 0, 2)  # C,H,W -> H,W,C
+
+
+def tile_image_half(image, nodata, label=False):
+    """Downsample a tile image by 2 (i.e as an overview), nodata pixels excluded."""
+
+    if label:
+        return image[::2, ::2, :]  # nearest, to keep classes values
+
+    height, width = image.shape[0] // 2, image.shape[1] // 2
+    valid = (image != nodata).reshape(height, 2, width, 2, -1).sum(axis=(1, 3))
+    total = np.where(image != nodata, image, 0).reshape(height, 2, width, 2, -1).sum(axis=(1, 3), dtype=np.float64)
+
+    return np.where(valid, np.round(total / np.maximum(valid, 1)), nodata).astype(image.dtype)
+
+
+def tile_image_from_halves(tile, halves, width, height, nodata):
+    """Build a tile image from its children images, already downsampled by 2. Missing children are nodata."""
+
+    first = next(iter(halves.values()))
+    image = np.full((height, width, first.shape[2]), nodata, dtype=first.dtype)
+
+    for child, half in halves.items():
+        dx, dy = child.x - tile.x * 2, child.y - tile.y * 2
+        image[dy * (height // 2) : (dy + 1) * (height // 2), dx * (width // 2) : (dx + 1) * (width // 2), :] = half
+
+    return image
+
+
+def tile_image_from_children(tile, children, width, height, nodata, label=False):
+    """Build a tile image by downsampling its children images (i.e as an overview). Missing children are nodata."""
+
+    halves = {child: tile_image_half(image, nodata, label) for child, image in children.items()}
+    return tile_image_from_halves(tile, halves, width, height, nodata)
+
+
+def tile_write(args, palette, tile, image, encoded=None):
+    """Write a tile image, or label, unless a nodata one, or if an encoded list is provided, append it encoded,
+    as (tile, ext, data), to be written by the caller. Return None if skipped, else the write status."""
+
+    if not args.label and is_nodata(image, args.nodata, args.nodata_threshold):
+        return None
+
+    if encoded is not None:
+        ext, data = ("png", tile_label_to_bytes(palette, image)) if args.label else tile_image_to_bytes(image)
+        encoded.append((tile, ext, data))
+        return True
 
     if args.label:
-        ext = "png"
-        bands = 1
-    if not args.label:
-        if bands == 1:
-            ext = "png"
-        if bands == 3:
-            ext = "webp"
-        if bands > 3:
-            ext = "tiff"
+        return tile_label_to_file(args.out, tile, palette, image)
+
+    return tile_image_to_file(args.out, tile, image)
+
 
-    tiles = []
-    progress = tqdm(total=len(tiles_map), ascii=True, unit="tile")
-    # Begin to tile plain tiles
-    with futures.ThreadPoolExecutor(args.workers) as executor:
+def tile_chunk(args, width, height, palette, zooms, halves, task):
+    """Tile a chunk of tiles pyramids from their source rasters, mosaicking them in memory. Return the tiles done,
+    the tiles written, and if halves, pyramids top tiles images downsampled by 2, to build shallower zooms upon.
+    In a process writing to a single file store, tiles are returned encoded, as (tile, ext, data), to the caller."""
 
-        def worker(path):
+    paths, tiles = task  # deepest zoom tiles, with their own source rasters
+    sources = dict(tiles)
+    tiled = []
+    encoded = [] if args.processes and store_type(args.out) else None
 
+    pyramid = set(sources.keys())
+    for tile in sources.keys():
+        pyramid.update(mercantile.parent(tile, zoom=z) for z in zooms[:-1])
+
+    with Env(GDAL_CACHEMAX=args.gdal_cachemax * 1024 * 1024):
+
+        vrts = {}
+        for path in paths:
             raster = rasterio_open(path)
-            w, s, e, n = transform_bounds(raster.crs, "EPSG:4326", *raster.bounds)
-            transform, _, _ = calculate_default_transform(raster.crs, "EPSG:3857", raster.width, raster.height, w, s, e, n)
-            tiles = [mercantile.Tile(x=x, y=y, z=z) for x, y, z in mercantile.tiles(w, s, e, n, args.zoom)]
-            tiled = []
+            vrts[path] = (raster, *tile_vrt(raster, [tile for tile in sources if path in sources[tile]], width, height))
 
-            for tile in tiles:
+        def tile_image(tile):
 
-                if cover and tile not in cover:
-                    continue
+            if tile.z == zooms[-1]:
+                image = None
+                for path in sources[tile]:
+                    raster, warp_vrt, origin = vrts[path]
+                    split = tile_image_from_vrt(warp_vrt, origin, tile, width, height)
 
-                w, s, e, n = mercantile.xy_bounds(tile)
-
-                warp_vrt = WarpedVRT(
-                    raster,
-                    crs="epsg:3857",
-                    resampling=Resampling.bilinear,
-                    add_alpha=False,
-                    transform=from_bounds(w, s, e, n, width, height),
-                    width=width,
-                    height=height,
-                )
-                data = warp_vrt.read(out_shape=(len(raster.indexes), width, height), window=warp_vrt.window(w, s, e, n))
-                image = np.moveaxis(data, 0, 2)  # C,H,W -> H,W,C
-
-                tile_key = (str(tile.x), str(tile.y), str(tile.z))
-                if not args.label and len(tiles_map[tile_key]) == 1 and is_nodata(image, args.nodata, args.nodata_threshold):
-                    progress.update()
-                    continue
+                    if image is None:
+                        image = split
+                    else:
+                        assert image.shape == split.shape, "Coverage must be bands consistent"
+                        image[image == args.nodata] = split[image == args.nodata]
+            else:
+                children = {child: tile_image(child) for child in mercantile.children(tile) if child in pyramid}
+                image = tile_image_from_children(tile, children, width, height, args.nodata, args.label)
+
+            ret = tile_write(args, palette, tile, image, encoded)
+            if ret is not None:
+                assert ret, "Unable to write tile {} from rasters {}.".format(str(tile), paths)
+                tiled.append(tile)
+
+            return image
+
+        tops = {}
+        for tile in sorted([tile for tile in pyramid if tile.z == zooms[0]], key=lambda tile: (tile.y, tile.x)):
+            image = tile_image(tile)  # depth first, to only keep in memory the current branch images
+            if halves:
+                tops[tile] = tile_image_half(image, args.nodata, args.label)
+
+        for raster, warp_vrt, _ in vrts.values():
+            warp_vrt.close()
+            raster.close()
+
+    return len(tiles), tiled, tops, encoded or []
 
-                if len(tiles_map[tile_key]) > 1:
-                    out = os.path.join(splits_path, str(tiles_map[tile_key].index(path)))
-                else:
-                    out = args.out
 
-                x, y, z = map(int, tile)
+def tile_from_output(args, tile):
+    """Read back a tile image, or label, already written in output, or return None."""
 
-                if not args.label:
-                    ret = tile_image_to_file(out, mercantile.Tile(x=x, y=y, z=z), image)
-                if args.label:
-                    ret = tile_label_to_file(out, mercantile.Tile(x=x, y=y, z=z), palette, image)
+    path = tile_from_xyz(args.out, tile.x, tile.y, tile.z)
+    if not path:
+        return None
 
-                assert ret, "Unable to write tile {} from raster {}.".format(str(tile), raster)
+    if args.label:
+        label = tile_label_from_file(path[1])
+        return np.uint8(label)[:, :, np.newaxis] if label is not None else None
 
-                if len(tiles_map[tile_key]) == 1:
-                    progress.update()
-                    tiled.append(mercantile.Tile(x=x, y=y, z=z))
+    return tile_image_from_file(path[1])
 
-            return tiled
 
-        for tiled in executor.map(worker, args.rasters):
-            if tiled is not None:
-                tiles.extend(tiled)
+def tile_pyramid(args, width, height, palette, halves, zoom):
+    """Build, and write, tiles from halves tiles parents, up to zoom, halves being images downsampled by 2.
+    Siblings tiles, left unchanged since a previous run, are read back from output. Return the tiles written."""
 
-    # Aggregate remaining tiles splits
-    with futures.ThreadPoolExecutor(args.workers) as executor:
+    tiled = []
+    while halves and next(iter(halves)).z > zoom:
 
-        def worker(tile_key):
+        parents = {}
+        for tile in halves:
+            parents.setdefault(mercantile.parent(tile), {})
 
-            if len(tiles_map[tile_key]) == 1:
-                return
+        for parent, children in parents.items():
+            for child in mercantile.children(parent):
+                if child in halves:
+                    children[child] = halves[child]
+                    continue
 
-            image = np.zeros((width, height, bands), np.uint8)
+                image = tile_from_output(args, child)
+                if image is not None:
+                    children[child] = tile_image_half(image, args.nodata, args.label)
 
-            x, y, z = map(int, tile_key)
-            for i in range(len(tiles_map[tile_key])):
-                root = os.path.join(splits_path, str(i))
-                _, path = tile_from_xyz(root, x, y, z)
+        halves = {}
+        for parent, children in sorted(parents.items(), key=lambda item: (item[0].y, item[0].x)):
+            image = tile_image_from_halves(parent, children, width, height, args.nodata)
+            ret = tile_write(args, palette, parent, image)
+            if ret is not None:
+                assert ret, "Unable to write tile {}.".format(str(parent))
+                tiled.append(parent)
 
-                if not args.label:
-                    split = tile_image_from_file(path)
-                if args.label:
-                    split = tile_label_from_file(path)
-                    split = split.reshape((width, height, 1))  # H,W -> H,W,C
+            if parent.z > zoom:
+                halves[parent] = tile_image_half(image, args.nodata, args.label)
 
-                assert image.shape == split.shape
-                image[np.where(image == 0)] += split[np.where(image == 0)]
+    return tiled
 
-            if not args.label and is_nodata(image, args.nodata, args.nodata_threshold):
-                progress.update()
-                return
 
-            tile = mercantile.Tile(x=x, y=y, z=z)
+def main(args):
 
-            if not args.label:
-                ret = tile_image_to_file(args.out, tile, image)
+    if not args.workers:
+        args.workers = os.cpu_count()
 
-            if args.label:
-                ret = tile_label_to_file(args.out, tile, palette, image)
+    palette = None
+    if args.label:
+        config = load_config(args.config)
+        check_classes(config)
+        colors = [classe["color"] for classe in config["classes"]]
+        palette = make_palette(*colors)
+
+    assert len(args.ts.split(",")) == 2, "--ts expect width,height value (e.g 512,512)"
+    width, height = list(map(int, args.ts.split(",")))
 
-            assert ret, "Unable to write tile {} from raster {}.".format(str(tile_key))
+    zooms = list(map(int, str(args.zoom).split("-")))
+    assert len(zooms) in (1, 2) and zooms[0] <= zooms[-1], "--zoom expect a zoom level or a range (e.g 18 or 17-19)"
+    zooms = list(range(zooms[0], zooms[-1] + 1))
 
-            progress.update()
-            return tile
+    cover = cover_from_file(args.cover) if args.cover else None
+    assert cover is not None or not args.cover, "--cover expect a XYZ cover"
 
-        for tiled in executor.map(worker, tiles_map.keys()):
-            if tiled is not None:
-                tiles.append(tiled)
+    tiles_map = {}
+
+    mode = "processes" if args.processes else "workers"
+    print("RoboSat.pink - tile on CPU, with {} {}".format(args.workers, mode), file=sys.stderr, flush=True)
+
+    bands = -1
+    prescreened = 0
+    for path in args.rasters:
+        raster = rasterio_open(path)
+        w, s, e, n = transform_bounds(raster.crs, "EPSG:4326", *raster.bounds)
+
+        if bands != -1:
+            assert bands == len(raster.indexes), "Coverage must be bands consistent"
+        bands = len(raster.indexes)
+
+        tiles = [mercantile.Tile(x=x, y=y, z=z) for x, y, z in mercantile.tiles(w, s, e, n, zooms[-1])]
+        if cover is not None:
+            tiles = [tile for tile, covered in zip(tiles, cover_contains(cover, tiles)) if covered]
+
+        if not args.label and args.nodata_prescreen:
+            screened = tiles_nodata_prescreen(raster, tiles, args.nodata, args.nodata_prescreen)
+            prescreened += len(tiles) - len(screened)
+            tiles = screened
+
+        for tile in tiles:
+            if tile not in tiles_map.keys():
+                tiles_map[tile] = []
+            tiles_map[tile].append(path)
+
+    if args.label:
+        ext = "png"
+        bands = 1
+    if not args.label:
+        if bands == 1:
+            ext = "png"
+        if bands == 3:
+            ext = "webp"
+        if bands > 3:
+            ext = "tiff"
 
-        if splits_path and os.path.isdir(splits_path):
-            shutil.rmtree(splits_path)  # Delete suffixes dir if any
+    if prescreened:
+        print("Notice: nodata pre-screening saved {} tiles reads.".format(prescreened), file=sys.stderr, flush=True)
+
+    depth = 0
+    while 4 ** (depth + 1) <= args.chunk_size:  # so a pyramid holds at most chunk_size deepest zoom tiles
+        depth += 1
+    cap = max(zooms[0], zooms[-1] - depth)  # shallower zooms are built at last, upon pyramids top tiles
+
+    tops = {}
+    for tile in tiles_map.keys():  # deepest zoom tiles, grouped by their cap zoom ancestor
+        tops.setdefault(mercantile.parent(tile, zoom=cap) if cap < zooms[-1] else tile, []).append(tile)
+
+    manifest = TilesManifest(os.path.join(os.path.expanduser(args.out), "manifest"))
+    settings = (args.ts, args.label, args.nodata, args.nodata_threshold, zooms[0])
+    fingerprints = {paths: tile_fingerprint(*paths, *settings) for paths in set(map(tuple, tiles_map.values()))}
+
+    already_tiled, already_tops = [], []
+    for top in list(tops.keys()):  # resume: skip pyramids already tiled, from unchanged rasters and settings
+        if all(manifest.done(tile, fingerprints[tuple(tiles_map[tile])]) for tile in tops[top]):
+            already_tiled.extend(tops.pop(top))
+            already_tops.append(top)
+
+    if already_tiled:
+        print(
+            "Notice: {} tiles were already tiled previously, and so skipped now.".format(len(already_tiled)), file=sys.stderr
+        )
+
+    groups = {}
+    for top, tiles in tops.items():  # so a border tile, or pyramid, is mosaicked in a single task
+        paths = tuple(path for path in args.rasters if [tile for tile in tiles if path in tiles_map[tile]])
+        groups.setdefault(paths, []).append(top)
+
+    tasks = []
+    for paths, group in groups.items():
+        chunk = []
+        for top in sorted(group, key=lambda tile: (tile.y, tile.x)):  # rows order, as source blocks
+            chunk.extend((tile, tuple(tiles_map[tile])) for tile in tops[top])
+
+            if len(chunk) >= args.chunk_size:
+                tasks.append((paths, chunk))
+                chunk = []
+
+        if chunk:
+            tasks.append((paths, chunk))
+
+    tiles, halves = [], {}
+    progress = tqdm(total=len(tiles_map) - len(already_tiled), ascii=True, unit="tile")
+    pool = futures.ProcessPoolExecutor if args.processes else futures.ThreadPoolExecutor
+    with pool(args.workers) as executor:
+
+        worker = partial(tile_chunk, args, width, height, palette, zooms[zooms.index(cap) :], cap > zooms[0])
+        for task, (done, tiled, top_halves, encoded) in zip(tasks, executor.map(worker, tasks)):
+            for tile, ext, data in encoded:  # a single file store, so written here only
+                tile_data_to_file(args.out, tile, ext, data)
+            for tile, sources in task[1]:
+                manifest.add(tile, fingerprints[sources])
+            manifest.flush()
+
+            progress.update(done)
+            tiles.extend(tiled)
+            halves.update(top_halves)
+
+    for top in already_tops if cap > zooms[0] else []:  # interrupted before shallower zooms were built upon it
+        if not tile_from_xyz(args.out, *mercantile.parent(top, zoom=zooms[0])):
+            image = tile_from_output(args, top)
+            if image is not None:
+                halves[top] = tile_image_half(image, args.nodata, args.label)
+
+    tiles.extend(tile_pyramid(args, width, height, palette, halves, zooms[0]))
+
+    manifest.close()
+    store_close(args.out)
+    tiles.extend(already_tiled)
 
     if tiles and not args.no_web_ui:
         template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
@@ -0,0 +1,89 @@
+import os
+import time
+import tempfile
+import unittest
+
+import numpy as np
+
+from robosat_pink.cache import TilesCache
+from robosat_pink.tiles import tile_image_from_file
+
+
+def loader(path, value=1):
+    with open(path) as fp:
+        return np.full((256, 256), int(fp.read()) * value, dtype=np.uint8)
+
+
+class TestTilesCache(unittest.TestCase):
+    def test_lru(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, str(i)) for i in range(3)]
+            for i, path in enumerate(paths):
+                with open(path, "w") as fp:
+                    fp.write(str(i))
+
+            cache = TilesCache(2 * 256 * 256)
+            self.assertEqual(cache.get(paths[0], loader)[0, 0], 0)
+            self.assertEqual(cache.get(paths[0], loader)[0, 0], 0)
+            self.assertEqual(cache.get(paths[0], loader, 2)[0, 0], 0)  # other loader args, other key
+            self.assertEqual(cache.get(paths[1], loader)[0, 0], 1)
+            self.assertEqual(cache.get(paths[2], loader)[0, 0], 2)  # evicts paths[0] entries
+            self.assertEqual(cache.stats()["bytes"], 2 * 256 * 256)
+
+            cache.get(paths[0], loader)
+            self.assertEqual((cache.hits, cache.misses), (1, 5))
+            self.assertFalse(cache.get(paths[0], loader).flags.writeable)
+
+            with open(paths[0], "w") as fp:  # updated tile, so decoded again
+                fp.write("3")
+            os.utime(paths[0], ns=(time.time_ns() + 10**9,) * 2)
+            self.assertEqual(cache.get(paths[0], loader)[0, 0], 3)
+
+            self.assertIsNone(cache.get(os.path.join(tmp, "missing.webp"), tile_image_from_file))
+
+    def test_shm(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tile")
+            with open(path, "w") as fp:
+                fp.write("7")
+
+            shm = os.path.join(tmp, "shm")
+            TilesCache(0, shm, 1 << 20).get(path, loader)  # as from another worker, with no local cache at all
+
+            cache = TilesCache(0, shm, 1 << 20)
+            self.assertEqual(cache.get(path, loader)[0, 0], 7)
+            self.assertEqual((cache.shm_hits, cache.misses), (1, 0))
+
+            cache.close()  # not created by this cache
+            self.assertTrue(os.path.isdir(shm))
+
+    def test_shm_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, str(i)) for i in range(4)]
+            for i, path in enumerate(paths):
+                with open(path, "w") as fp:
+                    fp.write(str(i))
+
+            shm = os.path.join(tmp, "shm")
+            cache = TilesCache(0, shm, 3 * 256 * 256 + 3 * 128)  # 3 .npy entries, with their headers
+            names = set()
+            for i, path in enumerate(paths[:3]):
+                cache.get(path, loader)
+                for name in set(os.listdir(shm)) - names:  # as used, long ago, in this order
+                    os.utime(os.path.join(shm, name), ns=((i + 1) * 10**9, (i + 1) * 10**9))
+                names = set(os.listdir(shm))
+
+            cache.get(paths[0], loader)  # recently used again
+            cache.get(paths[3], loader)  # over budget, evicts paths[1] entry
+
+            files = os.listdir(shm)
+            self.assertEqual(len(files), 3)
+            self.assertLessEqual(sum(os.path.getsize(os.path.join(shm, name)) for name in files), cache.shm_max_bytes)
+            self.assertEqual((cache.shm_hits, cache.misses), (1, 4))
+            self.assertEqual(cache.get(paths[0], loader)[0, 0], 0)
+            self.assertEqual(cache.get(paths[2], loader)[0, 0], 2)
+            self.assertEqual(cache.get(paths[1], loader)[0, 0], 1)
+            self.assertEqual((cache.shm_hits, cache.misses), (3, 5))
+
+            cache.close()
+            self.assertFalse(os.path.exists(shm))
@@ -0,0 +1,26 @@
+import unittest
+import collections
+
+import shapely.geometry
+
+from robosat_pink.postgis import postgis_geojson_from_wkb
+from robosat_pink.geojson import geojson_parse_feature
+
+
+class TestGeoJSONFromWKB(unittest.TestCase):
+    def test_polygons(self):
+        square = [[4.8, 45.7], [4.81, 45.7], [4.81, 45.71], [4.8, 45.71], [4.8, 45.7]]
+        multi = shapely.geometry.MultiPolygon([shapely.geometry.Polygon(square)])
+
+        geometry = postgis_geojson_from_wkb(memoryview(multi.wkb))  # as psycopg2 returns bytea
+        self.assertEqual(geometry, {"type": "MultiPolygon", "coordinates": [[square]]})
+
+        feature_map = geojson_parse_feature(
+            18, 4326, collections.defaultdict(list), {"type": "Feature", "geometry": geometry}
+        )
+        self.assertGreater(len(feature_map), 1)
+
+        collection = shapely.geometry.GeometryCollection([shapely.geometry.Point(4.8, 45.7), multi])
+        geometry = postgis_geojson_from_wkb(collection.wkb)
+        self.assertEqual([g["type"] for g in geometry["geometries"]], ["Point", "MultiPolygon"])
+        self.assertEqual(geometry["geometries"][0]["coordinates"], [4.8, 45.7])
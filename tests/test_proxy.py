@@ -0,0 +1,147 @@
+import gzip
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import cv2
+import numpy as np
+
+from aiohttp.test_utils import TestServer, TestClient
+
+from robosat_pink.geoc.proxy import TileProxy
+from robosat_pink.geoc.aioproxy import make_app, PROXY
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        z, x, y = map(int, self.path.strip("/").split("/"))
+
+        with self.server.lock:
+            self.server.requests.append(self.path)
+        time.sleep(0.2)  # slow upstream, so concurrent requests overlap
+
+        if x < 0:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        data = cv2.imencode(".jpg", np.full((256, 256, 3), (z, y % 256, x % 256), dtype=np.uint8))[1].tobytes()
+        self.send_response(200)
+        if y == 7:  # compressed transfer, auto-decompressed by HTTP clients
+            data = gzip.compress(data)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTileProxy(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), UpstreamHandler)
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.urls = {"tdt": "http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}".format(self.server.server_address[1])}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_coalescing(self):
+        proxy = TileProxy(self.urls)
+        tiles = []
+        threads = [threading.Thread(target=lambda: tiles.append(proxy.get("tdt", 18, 1, 2))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.server.requests), 1)  # a single upstream fetch
+        self.assertEqual(len(set(tiles)), 1)
+        self.assertEqual(tiles[0][1], "image/jpeg")
+
+        self.assertEqual(proxy.get("tdt", 18, 1, 2), tiles[0])
+        stats = proxy.stats()
+        self.assertEqual((stats["misses"], stats["coalesced"], stats["hits"]), (1, 7, 1))
+        self.assertAlmostEqual(stats["hit_rate"], 8 / 9)
+
+    def test_tiers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            proxy = TileProxy(self.urls, tmp, max_bytes=1)  # nothing fits in memory
+            tile = proxy.get("tdt", 18, 3, 4)
+            self.assertIsNotNone(tile)
+            self.assertIsNone(proxy.get("tdt", 18, -1, 4))  # upstream error, not cached
+
+            proxy = TileProxy(self.urls, tmp)  # as a new run
+            self.assertEqual(proxy.get("tdt", 18, 3, 4), tile)
+            self.assertEqual(proxy.get("tdt", 18, 3, 4), tile)
+
+            self.assertEqual(len(self.server.requests), 2)
+            stats = proxy.stats()
+            self.assertEqual((stats["disk_hits"], stats["hits"], stats["misses"]), (1, 1, 0))
+
+    def test_async(self):
+        async def run(tmp):
+            async with TestClient(TestServer(make_app(self.urls, tmp))) as client:
+
+                async def get(x):
+                    response = await client.get("/v1/wmts/18/{}/2?map=tdt".format(x))
+                    return response.status, response.content_type, await response.read()
+
+                tick = time.monotonic()
+                tiles = await asyncio.gather(*[get(x % 50) for x in range(200)])
+                elapsed = time.monotonic() - tick
+
+                stats = await (await client.get("/v1/wmts/stats")).json()
+                unknown = await client.get("/v1/wmts/18/1/2?map=bing")
+                return tiles, elapsed, stats, unknown.status
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tiles, elapsed, stats, unknown = asyncio.run(run(tmp))
+
+        self.assertLess(elapsed, 50 * 0.2 / 4)  # concurrent upstream requests, each one 0.2s long
+        self.assertEqual(len(self.server.requests), 50)  # each tile fetched once
+        self.assertEqual({status for status, _, _ in tiles}, {200})
+        self.assertEqual({content_type for _, content_type, _ in tiles}, {"image/jpeg"})
+        self.assertEqual(tiles[3][2], tiles[53][2])
+        self.assertEqual(cv2.imdecode(np.frombuffer(tiles[3][2], np.uint8), cv2.IMREAD_COLOR)[0, 0].tolist(), [18, 2, 3])
+        self.assertEqual(stats["misses"], 50)
+        self.assertEqual(stats["hits"] + stats["coalesced"], 150)
+        self.assertEqual(unknown, 400)
+
+    def test_async_disk_wait(self):
+        async def run():
+            app = make_app(self.urls)
+            app[PROXY]._disk_get = lambda key: time.sleep(0.3)  # slow disk tier, with no tile in
+            async with TestClient(TestServer(app)) as client:
+
+                async def get(delay):
+                    await asyncio.sleep(delay)
+                    return (await client.get("/v1/wmts/18/1/2?map=tdt")).status
+
+                return await asyncio.gather(get(0), get(0.35))  # second one done on disk after the first one fetched
+
+        self.assertEqual(asyncio.run(run()), [200, 200])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_async_gzip(self):
+        async def run(tmp):
+            async with TestClient(TestServer(make_app(self.urls, tmp))) as client:
+                response = await client.get("/v1/wmts/18/1/7?map=tdt")
+                return response.status, await response.read()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            status, data = asyncio.run(run(tmp))
+
+        self.assertEqual(status, 200)
+        pixel = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)[0, 0]
+        self.assertLessEqual(np.abs(pixel.astype(int) - [18, 7, 1]).max(), 2)  # jpeg lossy
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import mercantile
+
+from robosat_pink.stores.core import store_split, store_sidecar, store_find, store_open, store_close
+from robosat_pink.stores.pack import Pack
+from robosat_pink.tiles import tiles_from_dir, tile_from_xyz, tile_image_from_file, tile_image_to_file
+from robosat_pink.tiles import tile_label_from_file, tile_label_to_file
+from robosat_pink.core import make_palette
+
+
+class TestStoresCore(unittest.TestCase):
+    def test_paths(self):
+        self.assertEqual(store_split("/data/images.pack/18/1/2.webp"), ("/data/images.pack", "18/1/2.webp"))
+        self.assertIsNone(store_split("/data/images/18/1/2.webp"))
+        self.assertEqual(store_sidecar("/data/images.pack/log"), "/data/images.pack.log")
+        self.assertEqual(store_sidecar("/data/images/log"), "/data/images/log")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            open(os.path.join(tmp, "images.pack"), "wb").close()
+            self.assertEqual(store_find(os.path.join(tmp, "images")), os.path.join(tmp, "images.pack"))
+            self.assertEqual(store_find(os.path.join(tmp, "labels")), os.path.join(tmp, "labels"))
+
+
+class TestPack(unittest.TestCase):
+    def test_pack(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tiles.pack")
+            tiles = [mercantile.Tile(x, y, 18) for x in range(4) for y in range(4)]
+
+            pack = Pack(path, "a")
+            for tile in tiles:
+                pack.put(tile, "webp", bytes(str(tile), "ascii"))
+            pack.put(tiles[0], "png", b"superseded")
+            self.assertEqual(pack.get(tiles[0]), b"superseded")
+            pack.close()
+
+            pack = Pack(path, "r")
+            self.assertEqual(pack.get(tiles[0]), b"superseded")
+            self.assertEqual(pack.get(tiles[5]), bytes(str(tiles[5]), "ascii"))
+            self.assertIsNone(pack.get(mercantile.Tile(0, 0, 1)))
+            self.assertNotIn(mercantile.Tile(0, 0, 1), pack)
+
+            stored, exts, extensions = pack.tiles()
+            self.assertEqual(sorted(mercantile.Tile(*tile) for tile in stored.tolist()), sorted(tiles))
+            self.assertEqual([extensions[ext] for ext in exts[:1]], ["png"])
+            pack.close()
+
+    def test_pack_recover(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tiles.pack")
+            tile = mercantile.Tile(1, 2, 18)
+
+            pack = Pack(path, "a")
+            pack.put(tile, "png", b"data")
+            pack.fp.close()  # crash: no index written
+
+            pack = Pack(path, "r")
+            self.assertEqual(pack.get(tile), b"data")
+            self.assertEqual(pack.tiles()[0].tolist(), [[1, 2, 18]])
+            pack.close()
+
+            pack = Pack(path, "a")
+            self.assertEqual(pack.get(tile), b"data")
+            pack.close()
+
+    def test_pack_tiles(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, "images.pack")
+            tile = mercantile.Tile(1, 2, 18)
+            image = np.random.randint(0, 255, (256, 256, 3), dtype=np.uint8)
+            label = np.zeros((256, 256), dtype=np.uint8)
+            label[64:128, 64:128] = 1
+
+            self.assertTrue(tile_image_to_file(root, tile, image))
+            self.assertTrue(tile_label_to_file(root, mercantile.Tile(1, 3, 18), make_palette(["#ffffff", "#ff0000"]), label))
+            store_close(root)
+            self.assertFalse(os.path.isdir(root))
+
+            self.assertEqual(sorted(tiles_from_dir(root)), [tile, mercantile.Tile(1, 3, 18)])
+            self.assertIsNone(tile_from_xyz(root, 0, 0, 18))
+
+            _, path = tile_from_xyz(root, 1, 2, 18)
+            self.assertEqual(path, os.path.join(root, "18", "1", "2.webp"))
+            self.assertEqual(tile_image_from_file(path).shape, (256, 256, 3))  # lossy webp
+
+            _, path = tile_from_xyz(root, 1, 3, 18)
+            self.assertTrue(np.array_equal(tile_label_from_file(path), label))
+
+            self.assertIsNone(tile_image_from_file(os.path.join(root, "18", "0", "0.webp")))
+            store_close(root)
+            self.assertIs(store_open(root), store_open(root))
+            store_close(root)
+
+
+class TestSQLiteStores(unittest.TestCase):
+    def test_sqlite_stores(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("images.mbtiles", "images.gpkg"):
+                root = os.path.join(tmp, name)
+                tiles = [mercantile.Tile(x, y, 18) for x in range(2) for y in range(3)]
+                image = np.random.randint(0, 255, (256, 256, 3), dtype=np.uint8)
+
+                for tile in tiles:
+                    self.assertTrue(tile_image_to_file(root, tile, image))
+                    self.assertEqual(store_open(root, "a").ext(tile), "webp")  # buffered tiles are readable
+                self.assertEqual(len(store_open(root, "a").batch), len(tiles))  # reads did not flush the batch
+                self.assertIsNotNone(store_open(root, "a").get(tiles[0]))
+                store_close(root)
+
+                self.assertEqual(sorted(tiles_from_dir(root)), sorted(tiles))
+                _, path = tile_from_xyz(root, 1, 2, 18)
+                self.assertEqual(path, os.path.join(root, "18", "1", "2.webp"))
+                self.assertEqual(tile_image_from_file(path).shape, (256, 256, 3))
+                self.assertIsNone(tile_from_xyz(root, 5, 5, 18))
+                store_close(root)
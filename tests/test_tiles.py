@@ -1,8 +1,47 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
 import unittest
+import unittest.mock
+import warnings
 
+import cv2
+import numpy as np
 import mercantile
+import rasterio
+from PIL import Image
 
-from robosat_pink.tiles import tiles_from_dir, tiles_from_csv
+from robosat_pink.tiles import tiles_from_dir, tiles_from_csv, tile_fingerprint, tile_image_from_file, TilesManifest
+from robosat_pink.tiles import tiles_index_path, tile_label_to_file
+from robosat_pink.tiles import cover_from_file, cover_to_file, cover_unique, cover_intersect, cover_difference
+from robosat_pink.tiles import cover_contains, cover_split, cover_to_zoom, cover_bounds, cover_chunks, cover_union
+from robosat_pink.tiles import tile_data_format, tile_data_transcode, tile_data_blank, tile_image_from_bytes
+
+
+def make_bands(path, bands=8, size=512):
+    """Write a synthetic multibands GeoTIFF tile."""
+
+    data = np.random.randint(0, 65535, (bands, size, size), dtype=np.uint16)
+    with rasterio.open(path, "w", driver="GTiff", width=size, height=size, count=bands, dtype="uint16") as raster:
+        raster.write(data)
+
+    return np.moveaxis(data, 0, 2)
+
+
+def tile_image_per_band(path, bands=None):
+    """Reference (and former) reading path: one read call per band."""
+
+    raster = rasterio.open(path)
+    image = None
+    for i in raster.indexes if bands is None else bands:
+        data_band = raster.read(i)
+        data_band = data_band.reshape(data_band.shape[0], data_band.shape[1], 1)  # H,W -> H,W,C
+        image = np.concatenate((image, data_band), axis=2) if image is not None else data_band
+
+    return image
 
 
 class TestSlippyMapTiles(unittest.TestCase):
@@ -17,6 +56,27 @@ class TestSlippyMapTiles(unittest.TestCase):
         self.assertEqual(type(tile), mercantile.Tile)
         self.assertEqual(path, "tests/fixtures/images/18/69105/105093.jpg")
 
+    def test_slippy_map_directory_index(self):
+        with tempfile.TemporaryDirectory() as tmp, unittest.mock.patch.dict(os.environ, {"RSP_CACHE_DIR": tmp + "/cache"}):
+            root = os.path.join(tmp, "images")
+            shutil.copytree("tests/fixtures/images", root)
+            files = sorted(os.listdir(root))
+
+            self.assertEqual(len(list(tiles_from_dir(root))), 3)
+            self.assertTrue(os.path.isfile(tiles_index_path(root)))
+            self.assertTrue(tiles_index_path(root).startswith(os.path.join(tmp, "cache")))
+            self.assertNotEqual(tiles_index_path(root), tiles_index_path("tests/fixtures/images"))
+            self.assertEqual(sorted(os.listdir(root)), files)  # input dataset left untouched
+            self.assertEqual(len(list(tiles_from_dir(root))), 3)  # from cached index
+
+            os.makedirs(os.path.join(root, "18", "69106"))
+            shutil.copyfile(os.path.join(root, "18", "69105", "105093.jpg"), os.path.join(root, "18", "69106", "105093.jpg"))
+            os.remove(os.path.join(root, "18", "69108", "105092.jpg"))
+
+            tiles = sorted(tiles_from_dir(root, xyz_path=True))
+            self.assertEqual(len(tiles), 3)
+            self.assertEqual(tiles[1], (mercantile.Tile(69106, 105093, 18), os.path.join(root, "18/69106/105093.jpg")))
+
 
 class TestReadTiles(unittest.TestCase):
     def test_read_tiles(self):
@@ -26,3 +86,196 @@ class TestReadTiles(unittest.TestCase):
 
         self.assertEqual(len(tiles), 3)
         self.assertEqual(tiles[1], mercantile.Tile(69623, 104945, 18))
+
+
+class TestCover(unittest.TestCase):
+    def test_cover_files(self):
+        cover = cover_from_file("tests/fixtures/tiles.csv")
+        self.assertEqual(cover.dtype, np.uint32)
+        expected = list(tiles_from_csv("tests/fixtures/tiles.csv"))
+        self.assertEqual([mercantile.Tile(*tile) for tile in cover.tolist()], expected)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("cover.csv", "cover.npy"):
+                path = os.path.join(tmp, name)
+                cover_to_file(path, cover)
+                self.assertTrue(np.array_equal(cover_from_file(path), cover))
+                self.assertEqual(list(tiles_from_csv(path)), expected)
+
+            path = os.path.join(tmp, "paths.csv")
+            with open(path, "w") as fp:
+                fp.write("18/69623/104945\n18/69624/104945\n")
+            self.assertIsNone(cover_from_file(path))
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")  # no deprecated parsing behaviour relied on
+                for text in ("69623,104945,18\n69624,x,18\n", "69623,104945,18,69624\n", "69623 104945 18\n"):
+                    with open(path, "w") as fp:
+                        fp.write(text)
+                    self.assertIsNone(cover_from_file(path))
+
+                with open(path, "w") as fp:
+                    fp.write("69623,104945,18\r\n69624,104945,18\r\n")
+                self.assertEqual(cover_from_file(path).tolist(), [[69623, 104945, 18], [69624, 104945, 18]])
+
+    def test_cover_operations(self):
+        cover = np.array([[1, 2, 18], [1, 2, 18], [3, 4, 18], [1, 2, 17]], dtype=np.uint32)
+        other = np.array([[3, 4, 18], [5, 6, 18]], dtype=np.uint32)
+
+        self.assertEqual(cover_unique(cover).tolist(), [[1, 2, 17], [1, 2, 18], [3, 4, 18]])
+        self.assertEqual(cover_intersect(cover, other).tolist(), [[3, 4, 18]])
+        self.assertEqual(cover_difference(cover, other).tolist(), [[1, 2, 17], [1, 2, 18]])
+        self.assertEqual(cover_contains(other, cover).tolist(), [False, False, True, False])
+
+        cover = np.random.randint(0, 1 << 18, (1000, 3)).astype(np.uint32)
+        splits = cover_split(cover, [50, 15, 35])
+        self.assertEqual([len(split) for split in splits], [500, 150, 350])
+        self.assertTrue(np.array_equal(cover_unique(np.concatenate(splits)), cover_unique(cover)))
+
+    def test_cover_to_zoom(self):
+        tile, other = mercantile.Tile(34000, 23000, 16), mercantile.Tile(136001, 92001, 18)
+
+        children = cover_to_zoom([tile, other], 18)  # other is one of tile children, so deduplicated
+        expected = sorted(mercantile.children(tile, zoom=18))
+        self.assertEqual([mercantile.Tile(*child) for child in children.tolist()], expected)
+        self.assertEqual(cover_to_zoom(children, 16).tolist(), [list(tile)])
+        self.assertEqual(cover_to_zoom([], 18).shape, (0, 3))
+
+        self.assertTrue(np.allclose(cover_bounds(children), mercantile.bounds(tile)))
+
+    def test_cover_union(self):
+        covers = [[mercantile.Tile(x, y, 18) for x in range(i, i + 10) for y in range(10)] for i in range(0, 50, 5)]
+        covers.append(np.zeros((0, 3), dtype=np.uint32))
+
+        union = cover_union(iter(covers), buffer=64)  # compacted several times
+        expected = sorted({tile for cover in covers for tile in cover}, key=lambda tile: (tile.z, tile.x, tile.y))
+        self.assertEqual(union.tolist(), [list(tile) for tile in expected])
+
+    def test_cover_chunks(self):
+        cover = [(x, y, 18) for x in range(130990, 131010, 3) for y in range(89990, 90010, 4)] + [(1, 2, 3)]
+        chunks = list(cover_chunks(cover, 6))
+
+        self.assertEqual(sum(len(chunk) for _, chunk in chunks), len(cover))
+        self.assertEqual([parent for parent, _ in chunks], [parent for parent, _ in cover_chunks(cover[::-1], 6)])
+        for parent, chunk in chunks:
+            for tile in chunk.tolist():
+                self.assertEqual(mercantile.parent(mercantile.Tile(*tile), zoom=parent.z), parent)
+        self.assertIn((mercantile.Tile(0, 0, 0), [[1, 2, 3]]), [(parent, chunk.tolist()) for parent, chunk in chunks])
+
+
+class TestTileImageFromFile(unittest.TestCase):
+    def test_multibands(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tile.tif")
+            data = make_bands(path)
+
+            image = tile_image_from_file(path)
+            self.assertEqual(image.dtype, np.uint16)
+            self.assertTrue(image.flags["C_CONTIGUOUS"])
+            self.assertTrue(np.array_equal(image, data))
+            self.assertTrue(np.array_equal(tile_image_from_file(path, [3, 1]), tile_image_per_band(path, [3, 1])))
+
+    def test_rgb(self):
+        path = "tests/fixtures/images/18/69105/105093.jpg"
+        image = tile_image_from_file(path)
+        self.assertEqual(image.shape, (512, 512, 3))
+        self.assertLessEqual(np.abs(image.astype(int) - np.array(Image.open(path).convert("RGB"))).max(), 8)
+        self.assertTrue(np.array_equal(tile_image_from_file(path, [2]), image[:, :, 1:2]))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for ext in ("png", "webp"):
+                Image.fromarray(image).save(os.path.join(tmp, "tile." + ext), lossless=True)
+                self.assertTrue(np.array_equal(tile_image_from_file(os.path.join(tmp, "tile." + ext)), image))
+
+            rgba = np.dstack((image, np.arange(512 * 512, dtype=np.uint8).reshape(512, 512)))
+            Image.fromarray(rgba).save(os.path.join(tmp, "rgba.png"))
+            self.assertTrue(np.array_equal(tile_image_from_file(os.path.join(tmp, "rgba.png")), image))
+            self.assertTrue(np.array_equal(tile_image_from_file(os.path.join(tmp, "rgba.png"), [1, 2, 3, 4]), rgba))
+
+            Image.fromarray(image[:, :, 0]).save(os.path.join(tmp, "gray.png"))
+            self.assertTrue(np.array_equal(tile_image_from_file(os.path.join(tmp, "gray.png")), image[:, :, [0, 0, 0]]))
+            self.assertTrue(np.array_equal(tile_image_from_file(os.path.join(tmp, "gray.png"), [1]), image[:, :, 0:1]))
+
+            palette = [0, 0, 0, 255, 255, 255]
+            tile_label_to_file(tmp, mercantile.Tile(1, 2, 3), palette, np.eye(512, dtype=np.uint8))
+            label = tile_image_from_file(os.path.join(tmp, "3", "1", "2.png"))
+            self.assertEqual(label.shape[2], 3)
+            self.assertEqual(label[0, 0].tolist(), [255, 255, 255])
+
+            self.assertIsNone(tile_image_from_file(os.path.join(tmp, "missing.webp")))
+            self.assertIsNone(tile_image_from_file(os.path.join(tmp, "missing.tif")))
+
+    def test_data_format(self):
+        path = "tests/fixtures/images/18/69105/105093.jpg"
+        with open(path, "rb") as fp:
+            data = fp.read()
+        self.assertEqual(tile_data_format(data), "jpg")
+        self.assertIsNone(tile_data_format(b"<html>Not Found</html>"))
+
+        for ext in ("png", "webp", "tiff"):
+            transcoded = tile_data_transcode(data, ext)
+            self.assertEqual(tile_data_format(transcoded), ext)
+            self.assertEqual(tile_image_from_bytes(transcoded).shape, (512, 512, 3))
+
+    def test_data_blank(self):
+        path = "tests/fixtures/images/18/69105/105093.jpg"
+        with open(path, "rb") as fp:
+            data = fp.read()
+        self.assertFalse(tile_data_blank(data))
+        self.assertTrue(tile_data_blank(data, {hashlib.sha1(data).hexdigest()}))
+
+        blank = cv2.imencode(".jpg", np.full((512, 512, 3), 120, dtype=np.uint8))[1].tobytes()
+        self.assertTrue(tile_data_blank(blank))
+        self.assertFalse(tile_data_blank(blank, threshold=0))
+
+
+class TestTilesManifest(unittest.TestCase):
+    def test_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "manifest")
+            tile = mercantile.Tile(69623, 104945, 18)
+
+            manifest = TilesManifest(path)
+            manifest.add(tile, tile_fingerprint("a"))
+            manifest.close()
+
+            with open(path, "a") as fp:
+                fp.write("69623,104946")  # truncated line, as from an interrupted run
+
+            manifest = TilesManifest(path)
+            self.assertTrue(manifest.done(tile, tile_fingerprint("a")))
+            self.assertFalse(manifest.done(tile, tile_fingerprint("b")))
+            self.assertFalse(manifest.done(mercantile.Tile(69623, 104946, 18), tile_fingerprint("a")))
+            manifest.close()
+
+    def test_manifest_store(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = os.path.join(tmp, "out.pack")
+            tile = mercantile.Tile(69623, 104945, 18)
+
+            open(store, "wb").close()
+            manifest = TilesManifest(os.path.join(store, "manifest"))
+            manifest.add(tile, tile_fingerprint("a"))
+            manifest.close()
+            self.assertTrue(TilesManifest(os.path.join(store, "manifest")).done(tile, tile_fingerprint("a")))
+
+            os.remove(store)
+            self.assertFalse(TilesManifest(os.path.join(store, "manifest")).done(tile, tile_fingerprint("a")))
+
+
+def benchmark(bands=8, size=512, runs=200):
+    """Compare tiles/sec reading a multibands tile, band per band, and with a single call."""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tile.tif")
+        make_bands(path, bands, size)
+
+        for name, read in (("per band", tile_image_per_band), ("single call", tile_image_from_file)):
+            tick = time.monotonic()
+            for _ in range(runs):
+                read(path)
+            print("{} bands {}px, {}: {:.1f} tiles/s".format(bands, size, name, runs / (time.monotonic() - tick)))
+
+
+if __name__ == "__main__":
+    benchmark(*map(int, sys.argv[1:]))
@@ -0,0 +1,256 @@
+import os
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+import unittest
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import cv2
+import numpy as np
+import mercantile
+
+from robosat_pink.tiles import tiles_from_dir, tiles_from_csv, tile_from_xyz, tile_image_from_file
+from robosat_pink.stores.pack import Pack
+from robosat_pink.tools.download import add_parser, main
+
+
+def tile_data(x, y, z):
+    image = np.full((256, 256, 3), (z, y % 256, x % 256), dtype=np.uint8)  # BGR
+    image[192:] = 255  # so not a blank tile
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+PLACEHOLDER = tile_data(0, 0, 0)
+BLANK = cv2.imencode(".png", np.full((256, 256, 3), 200, dtype=np.uint8))[1].tobytes()
+
+
+class TileServer(ThreadingHTTPServer):
+    """Local stand-in tile server: each tile first answers 503 once, then a PNG, colored from its x, y."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), TileHandler)
+        self.requests = []
+        self.connections = set()
+        self.blanks = False
+        self.mixed = False
+        self.lock = threading.Lock()
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        z, x, y = map(int, self.path.strip("/").split("/"))
+
+        with self.server.lock:
+            first = self.path not in [path for path, _ in self.server.requests]
+            self.server.requests.append((self.path, time.monotonic()))
+            self.server.connections.add(self.client_address)
+
+        if first:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        data = tile_data(x, y, z)
+        if self.server.mixed and x % 2:
+            data = cv2.imencode(".jpg", cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR))[1].tobytes()
+        if self.server.blanks and x == 0:
+            data = BLANK if y else PLACEHOLDER
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class WMSHandler(BaseHTTPRequestHandler):
+    """Local stand-in WMS server: each pixel colored from the z18 tile it lies in, y=90004 tiles being blank ones."""
+
+    def do_GET(self):
+        query = {key.upper(): value[0] for key, value in parse_qs(urlparse(self.path).query).items()}
+        w, s, e, n = map(float, query["BBOX"].split(","))
+        width, height = int(query["WIDTH"]), int(query["HEIGHT"])
+
+        with self.server.lock:
+            self.server.requests.append((self.path, time.monotonic()))
+
+        side, extent = 1 << 18, 2 * 20037508.342789244
+        xs = ((w + (np.arange(width) + 0.5) * (e - w) / width + extent / 2) / extent * side).astype(int)
+        ys = (extent / 2 - (n - (np.arange(height) + 0.5) * (n - s) / height)) / extent * side
+        image = np.zeros((height, width, 3), dtype=np.uint8)  # BGR
+        image[:, :, 0], image[:, :, 1], image[:, :, 2] = 18, (ys.astype(int) % 256)[:, None], (xs % 256)[None, :]
+        image[(np.modf(ys)[0] > 0.75) & (ys.astype(int) != 90004)] = 255  # so not blank tiles
+
+        data = cv2.imencode(".png", image)[1].tobytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def parse_args(*argv):
+    parser = argparse.ArgumentParser()
+    add_parser(parser.add_subparsers(), formatter_class=argparse.HelpFormatter)
+    return parser.parse_args(["download", *argv])
+
+
+class TestDownload(unittest.TestCase):
+    def test_download(self):
+        server = TileServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}".format(server.server_address[1])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tiles = [mercantile.Tile(x, y, 18) for x in range(4) for y in range(3)]
+            cover = os.path.join(tmp, "cover.csv")
+            with open(cover, "w") as fp:
+                fp.writelines("{},{},{}\n".format(*tile) for tile in tiles)
+
+            out = os.path.join(tmp, "out")
+            main(parse_args(url, cover, out, "--rate", "50", "--workers", "4", "--no_web_ui"))
+
+            self.assertEqual(sorted(tiles_from_dir(out)), sorted(tiles))
+            path = tile_from_xyz(out, 3, 2, 18)[1]
+            self.assertEqual(os.path.splitext(path)[1], ".png")  # server bytes, stored as is
+            with open(path, "rb") as fp:
+                self.assertEqual(fp.read(), tile_data(3, 2, 18))
+
+            self.assertEqual(len(server.requests), 2 * len(tiles))  # each one retried once
+            self.assertLessEqual(len(server.connections), 4)  # pooled keep-alive connections
+
+            ticks = sorted(tick for _, tick in server.requests)
+            self.assertGreaterEqual(ticks[-1] - ticks[0], (len(ticks) - 1) / 50 * 0.9)  # global rate limit
+
+            main(parse_args(url, cover, out, "--rate", "50", "--no_web_ui"))  # resume: nothing left to download
+            self.assertEqual(len(server.requests), 2 * len(tiles))
+
+            main(parse_args(url, cover, out, "--rate", "50", "--format", "webp", "--no_web_ui"))
+            self.assertEqual(len(server.requests), 3 * len(tiles))  # format changed, so all downloaded again
+            self.assertEqual(sorted(tiles_from_dir(out)), sorted(tiles))
+            path = tile_from_xyz(out, 3, 2, 18)[1]
+            self.assertEqual(os.path.splitext(path)[1], ".webp")
+            self.assertEqual(tile_image_from_file(path)[0, 0].tolist(), [3, 2, 18])
+
+        server.shutdown()
+        server.server_close()
+
+    def test_download_blank(self):
+        server = TileServer()
+        server.blanks = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}".format(server.server_address[1])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tiles = [mercantile.Tile(x, y, 18) for x in range(2) for y in range(3)]
+            cover = os.path.join(tmp, "cover.csv")
+            with open(cover, "w") as fp:
+                fp.writelines("{},{},{}\n".format(*tile) for tile in tiles)
+
+            placeholders = os.path.join(tmp, "placeholders")
+            with open(placeholders, "w") as fp:
+                fp.write("{}  placeholder.png\n".format(hashlib.sha1(PLACEHOLDER).hexdigest()))
+
+            out, threshold = os.path.join(tmp, "out"), ("--blank_threshold", "1")
+            main(parse_args(url, cover, out, "--rate", "50", "--placeholders", placeholders, *threshold, "--no_web_ui"))
+
+            blanks = [tile for tile in tiles if tile.x == 0]  # y=0 placeholder, others solid colour ones
+            self.assertEqual(sorted(tiles_from_dir(out)), sorted(set(tiles) - set(blanks)))
+            self.assertEqual(sorted(tiles_from_csv(os.path.join(out, "skip"))), sorted(blanks))
+
+            requests = len(server.requests)
+            main(parse_args(url, cover, out, "--rate", "50", "--placeholders", placeholders, *threshold, "--no_web_ui"))
+            self.assertEqual(len(server.requests), requests)  # resume: blank tiles are not downloaded again
+
+            main(parse_args(url, cover, out, "--rate", "50", "--blank_threshold", "0", "--no_web_ui"))
+            self.assertEqual(sorted(tiles_from_dir(out)), sorted(tiles))
+            self.assertFalse(os.path.exists(os.path.join(out, "skip")))
+
+        server.shutdown()
+        server.server_close()
+
+    def test_download_metatile(self):
+        server = TileServer()
+        server.RequestHandlerClass = WMSHandler
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/wms?WIDTH=64&HEIGHT=64&BBOX={{xmin}},{{ymin}},{{xmax}},{{ymax}}"
+        url = url.format(server.server_address[1])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tiles = [mercantile.Tile(x, y, 18) for x in range(131001, 131005) for y in range(90002, 90005)]
+            cover = os.path.join(tmp, "cover.csv")
+            with open(cover, "w") as fp:
+                fp.writelines("{},{},{}\n".format(*tile) for tile in tiles)
+
+            single, meta = os.path.join(tmp, "single"), os.path.join(tmp, "meta")
+            argv = ["--type", "WMS", "--rate", "50", "--blank_threshold", "1", "--no_web_ui"]
+            main(parse_args(url, cover, single, *argv))
+            self.assertEqual(len(server.requests), len(tiles))
+
+            main(parse_args(url, cover, meta, *argv, "--metatile", "3"))
+            self.assertEqual(len(server.requests), len(tiles) + 4)  # 4x3 tiles, across 2x2 metatiles of 3x3
+            self.assertIn("WIDTH=192", server.requests[-1][0])
+
+            blanks = [tile for tile in tiles if tile.y == 90004]
+            self.assertEqual(sorted(tiles_from_dir(meta)), sorted(set(tiles) - set(blanks)))
+            self.assertEqual(sorted(tiles_from_csv(os.path.join(meta, "skip"))), sorted(blanks))
+            self.assertEqual(sorted(tiles_from_csv(os.path.join(single, "skip"))), sorted(blanks))
+
+            for tile in set(tiles) - set(blanks):
+                image = tile_image_from_file(tile_from_xyz(meta, tile.x, tile.y, tile.z)[1])
+                self.assertEqual(image.shape, (64, 64, 3))
+                self.assertTrue(np.array_equal(image, tile_image_from_file(tile_from_xyz(single, *tile)[1])))
+                self.assertEqual(image[32, 32].tolist(), [tile.x % 256, tile.y % 256, 18])
+
+            os.remove(tile_from_xyz(meta, *tiles[0])[1])
+            main(parse_args(url, cover, meta, *argv, "--metatile", "3"))
+            self.assertEqual(len(server.requests), len(tiles) + 4)  # resume, from manifest
+
+        server.shutdown()
+        server.server_close()
+
+    def test_download_store_resume(self):
+        server = TileServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}".format(server.server_address[1])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tiles = [mercantile.Tile(x, y, 18) for x in range(2) for y in range(2)]
+            cover = os.path.join(tmp, "cover.csv")
+            with open(cover, "w") as fp:
+                fp.writelines("{},{},{}\n".format(*tile) for tile in tiles)
+
+            out = os.path.join(tmp, "out.pack")
+            pack = Pack(out, "a")
+            pack.put(tiles[0], "png", tile_data(*tiles[0]))
+            pack.fp.close()  # interrupted run: neither index, nor manifest, written
+
+            main(parse_args(url, cover, out, "--rate", "50", "--no_web_ui"))
+            self.assertEqual(sorted(tiles_from_dir(out)), sorted(tiles))
+            self.assertEqual(len(server.requests), 2 * (len(tiles) - 1))  # already stored tile, not downloaded again
+
+            os.remove(out)  # manifest sidecar left alone, so a stale one
+            main(parse_args(url, cover, out, "--rate", "50", "--no_web_ui"))
+            self.assertEqual(sorted(tiles_from_dir(out)), sorted(tiles))
+
+            server.mixed = True  # both png and jpg tiles, in a single format store
+            for name in ("out.mbtiles", "out.gpkg"):
+                out = os.path.join(tmp, name)
+                main(parse_args(url, cover, out, "--rate", "50", "--workers", "1", "--no_web_ui"))
+                self.assertEqual(sorted(tiles_from_dir(out)), sorted(tiles))
+                self.assertEqual(len({os.path.splitext(path)[1] for _, path in tiles_from_dir(out, xyz_path=True)}), 1)
+
+        server.shutdown()
+        server.server_close()
@@ -1,4 +1,7 @@
+import os
 import json
+import argparse
+import tempfile
 import unittest
 
 import numpy as np
@@ -6,7 +9,14 @@ import mercantile
 
 from PIL import Image
 
-from robosat_pink.geojson import geojson_tile_burn, geojson_reproject
+from rasterio.crs import CRS
+from rasterio.warp import transform
+
+from robosat_pink.geojson import geojson_tile_burn, geojson_reproject, geojson_reprojected, geojson_transformer
+from robosat_pink.geojson import geojson_features, GeoJSONTileIndex
+from robosat_pink.tiles import tiles_from_dir, tiles_from_csv, tile_from_xyz, tile_label_from_file
+from robosat_pink.stores.core import store_sidecar
+from robosat_pink.tools.rasterize import add_parser, main
 
 
 def get_parking():
@@ -58,3 +68,155 @@ class TestFeatureToMercator(unittest.TestCase):
 
         self.assertEqual(mercator["type"], "Polygon")
         self.assertEqual(int(mercator["coordinates"][0][0][0]), -9219757)
+
+    def test_transformer(self):
+        xs, ys = np.random.uniform(-179, 179, 1000), np.random.uniform(-85, 85, 1000)
+        self.assertIs(geojson_transformer(4326, 3857), geojson_transformer(4326, 3857))  # cached
+
+        for srid in (3857, 2154):
+            expected = transform(CRS.from_epsg(4326), CRS.from_epsg(srid), xs, ys)
+            self.assertTrue(np.allclose(geojson_transformer(4326, srid)(xs, ys), expected, rtol=0, atol=1e-6))
+
+        back = geojson_transformer(3857, 4326)(*geojson_transformer(4326, 3857)(xs, ys))
+        self.assertTrue(np.allclose(back, (xs, ys), rtol=0, atol=1e-9))
+
+    def test_reprojected_once(self):
+        parking = get_parking()["features"][0]
+        geometries = geojson_reprojected(parking, 4326, 3857)
+        self.assertEqual(geometries, list(geojson_reproject(parking, 4326, 3857)))
+        self.assertIs(geojson_reprojected(parking, 4326, 3857), geometries)  # memoized
+        self.assertEqual(parking, get_parking()["features"][0])  # caller feature left untouched
+        json.dumps(parking)
+
+
+class TestGeoJSONStream(unittest.TestCase):
+    def test_features(self):
+        features = get_parking()["features"]
+        with tempfile.TemporaryDirectory() as tmp:
+            collection = os.path.join(tmp, "features.geojson")
+            with open(collection, "w") as fp:
+                crs = {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::3857"}}
+                json.dump({"type": "FeatureCollection", "crs": crs, "features": features, "totalFeatures": 2}, fp, indent=2)
+
+            lines = os.path.join(tmp, "features.ndjson")
+            with open(lines, "w") as fp:
+                fp.write("".join(json.dumps(feature) + "\n" for feature in features))
+
+            for chunk in (1, 7, 1 << 20):  # features, and even numbers, split across buffers
+                self.assertEqual(list(geojson_features(collection, chunk)), [(3857, feature) for feature in features])
+                self.assertEqual(list(geojson_features(lines, chunk)), [(4326, feature) for feature in features])
+
+    def test_tile_index(self):
+        index = GeoJSONTileIndex(18)
+        for feature in get_parking()["features"]:
+            index.add(4326, feature)
+
+        feature_map = index.features([[70762, 104119, 18], [70763, 104119, 18], [69623, 104946, 18]])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(len(feature_map), 2)
+
+        tile = mercantile.Tile(70762, 104119, 18)
+        burn = geojson_tile_burn(tile, get_parking()["features"], 4326, [256, 256])
+        self.assertTrue(np.array_equal(geojson_tile_burn(tile, feature_map[tile], 4326, [256, 256]), burn))
+        self.assertIs(feature_map[tile][0], feature_map[mercantile.Tile(70763, 104119, 18)][0])  # loaded once
+        index.close()
+
+
+def parse_args(*argv):
+    parser = argparse.ArgumentParser()
+    add_parser(parser.add_subparsers(), formatter_class=argparse.HelpFormatter)
+    return parser.parse_args(["rasterize", *argv])
+
+
+def make_config(path):
+    with open(path, "w") as fp:
+        fp.write('[[channels]]\n  name = "images"\n  bands = [1, 2, 3]\n\n')
+        fp.write('[[classes]]\n  title = "Parking"\n  color = "#ff0000"\n\n')
+        fp.write('[[classes]]\n  title = "Building"\n  color = "#0000ff"\n')
+    return path
+
+
+class TestRasterize(unittest.TestCase):
+    def test_rasterize_geojson(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config, out = make_config(os.path.join(tmp, "config.toml")), os.path.join(tmp, "labels")
+            cover, geojson = "tests/fixtures/parking/tiles.csv", "tests/fixtures/parking/features.geojson"
+            main(
+                parse_args(
+                    out, "--cover", cover, "--config", config, "--type", "Parking", "--geojson", geojson, "--no_web_ui"
+                )
+            )
+
+            self.assertEqual(len(list(tiles_from_dir(out))), 4)
+            self.assertTrue(tile_label_from_file(tile_from_xyz(out, 70762, 104119, 18)[1]).any())
+            self.assertFalse(tile_label_from_file(tile_from_xyz(out, 69623, 104946, 18)[1]).any())
+
+            with open(os.path.join(out, "instances_parking.cover")) as fp:
+                lines = [line.split() for line in fp]
+            counts = dict(lines)
+            self.assertEqual([tile for tile, _ in lines], [",".join(map(str, tile)) for tile in tiles_from_csv(cover)])
+            self.assertEqual(counts["69623,104946,18"], "0")
+            self.assertGreater(int(counts["70762,104119,18"]), 0)
+
+    def test_rasterize_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = make_config(os.path.join(tmp, "config.toml"))
+            cover, geojson = "tests/fixtures/parking/tiles.csv", "tests/fixtures/parking/features.geojson"
+
+            outputs = {}
+            for name, workers in (("serial", "1"), ("parallel", "2"), ("parallel.pack", "2")):
+                out = os.path.join(tmp, name)
+                argv = ["--cover", cover, "--config", config, "--type", "Parking", "--geojson", geojson, "--no_web_ui"]
+                main(parse_args(out, *argv, "--workers", workers, "--chunk_size", "1"))
+
+                with open(store_sidecar(os.path.join(out, "instances_parking.cover"))) as fp:
+                    lines = fp.readlines()
+                labels = {tile: tile_label_from_file(path) for tile, path in tiles_from_dir(out, xyz_path=True)}
+                outputs[name] = lines, labels
+
+            for name in ("parallel", "parallel.pack"):
+                self.assertEqual(outputs[name][0], outputs["serial"][0])  # same counts, in same order
+                self.assertEqual(outputs[name][1].keys(), outputs["serial"][1].keys())
+                for tile, label in outputs["serial"][1].items():
+                    self.assertTrue(np.array_equal(outputs[name][1][tile], label))
+
+    def test_rasterize_multiclass(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = make_config(os.path.join(tmp, "config.toml"))
+            cover, parking = "tests/fixtures/parking/tiles.csv", "tests/fixtures/parking/features.geojson"
+
+            building = os.path.join(tmp, "building.geojson")
+            w, s, e, n = mercantile.bounds(69623, 104946, 18)
+            polygon = [[[w, s], [(w + e) / 2, s], [(w + e) / 2, n], [w, n], [w, s]]]
+            with open(building, "w") as fp:
+                json.dump(
+                    {
+                        "type": "FeatureCollection",
+                        "features": [
+                            {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": polygon}}
+                        ],
+                    },
+                    fp,
+                )
+
+            argv = ["--cover", cover, "--config", config, "--no_web_ui"]
+            single = os.path.join(tmp, "single")
+            main(parse_args(single, *argv, "--type", "Parking,Building", "--geojson", parking, building))
+
+            passes = os.path.join(tmp, "passes")
+            main(parse_args(passes, *argv, "--type", "Parking", "--geojson", parking))
+            main(parse_args(passes, *argv, "--type", "Building", "--geojson", building, "--append"))
+
+            for tile, path in tiles_from_dir(passes, xyz_path=True):
+                label = tile_label_from_file(tile_from_xyz(single, tile.x, tile.y, tile.z)[1])
+                self.assertTrue(np.array_equal(label, tile_label_from_file(path)))
+
+            label = tile_label_from_file(tile_from_xyz(single, 69623, 104946, 18)[1])
+            self.assertEqual(np.unique(label).tolist(), [0, 2])  # Building bit, on half tile
+            self.assertEqual(np.unique(tile_label_from_file(tile_from_xyz(single, 70762, 104119, 18)[1])).tolist(), [0, 1])
+
+            for title in ("parking", "building"):
+                with open(os.path.join(single, "instances_{}.cover".format(title))) as fp:
+                    single_lines = fp.readlines()
+                with open(os.path.join(passes, "instances_{}.cover".format(title))) as fp:
+                    self.assertEqual(single_lines, fp.readlines())
@@ -0,0 +1,251 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import unittest
+
+import numpy as np
+import mercantile
+
+import rasterio
+from rasterio.vrt import WarpedVRT
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+
+from robosat_pink.tiles import tiles_from_dir, tile_from_xyz, tile_image_from_file
+from robosat_pink.tools.tile import add_parser, main, tile_vrt, tile_image_from_vrt, tiles_nodata_prescreen
+
+
+def make_raster(path, size=1024, bounds=(4.80, 45.70, 4.81, 45.71), rotated=False, nodata=None, overviews=False):
+    """Write a synthetic 3 bands EPSG:4326 GeoTIFF, with a smooth gradient content, optionaly in a rotated footprint."""
+
+    gradient = np.linspace(1, 255, size, dtype=np.float32)
+    data = np.stack([np.add.outer(gradient, gradient) / 2, np.tile(gradient, (size, 1)), np.tile(gradient, (size, 1)).T])
+
+    if rotated:  # diamond footprint, surrounded by nodata pixels
+        distance = np.abs(np.arange(size) - size / 2)
+        data[:, np.add.outer(distance, distance) > size / 2] = 0
+
+    profile = {
+        "driver": "GTiff",
+        "width": size,
+        "height": size,
+        "count": 3,
+        "dtype": "uint8",
+        "crs": "EPSG:4326",
+        "transform": from_bounds(*bounds, size, size),
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "compress": "deflate",
+        "nodata": nodata,
+    }
+
+    with rasterio.open(path, "w", **profile) as raster:
+        raster.write(data.astype(np.uint8))
+        if overviews:
+            raster.build_overviews([2, 4, 8], Resampling.nearest)
+
+    return bounds
+
+
+def parse_args(*argv):
+    parser = argparse.ArgumentParser()
+    add_parser(parser.add_subparsers(), formatter_class=argparse.HelpFormatter)
+    return parser.parse_args(["tile", *argv])
+
+
+def tile_image_per_vrt(raster, tile, width, height):
+    """Reference (and former) tiling path: one WarpedVRT for each tile."""
+
+    w, s, e, n = mercantile.xy_bounds(tile)
+    warp_vrt = WarpedVRT(
+        raster,
+        crs="epsg:3857",
+        resampling=Resampling.bilinear,
+        add_alpha=False,
+        transform=from_bounds(w, s, e, n, width, height),
+        width=width,
+        height=height,
+    )
+    return np.moveaxis(warp_vrt.read(window=warp_vrt.window(w, s, e, n)), 0, 2)
+
+
+class TestTileVRT(unittest.TestCase):
+    def test_tile_image_from_vrt(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "raster.tif")
+            bounds = make_raster(path)
+
+            with rasterio.open(path) as raster:
+                tiles = sorted(mercantile.tiles(*bounds, 18), key=lambda tile: (tile.y, tile.x))
+                warp_vrt, origin = tile_vrt(raster, tiles, 256, 256)
+
+                for tile in tiles[:: max(1, len(tiles) // 5)]:
+                    image = tile_image_from_vrt(warp_vrt, origin, tile, 256, 256)
+                    expected = tile_image_per_vrt(raster, tile, 256, 256)
+
+                    self.assertEqual(image.shape, (256, 256, 3))
+                    self.assertLessEqual(np.abs(image.astype(int) - expected.astype(int)).max(), 1)
+
+
+class TestTile(unittest.TestCase):
+    def test_tile_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "raster.tif")
+            bounds = make_raster(path)
+            cover = set(mercantile.tiles(*bounds, 18))
+            tiled = []
+
+            for mode in ([], ["--processes"]):
+                out = os.path.join(tmp, "out" + "".join(mode))
+                main(parse_args(path, out, "--zoom", "18", "--ts", "256,256", "--chunk_size", "4", "--no_web_ui", *mode))
+                tiled.append(sorted(tiles_from_dir(out)))
+
+            self.assertTrue(tiled[0] and set(tiled[0]).issubset(cover))  # nodata border tiles are skipped
+            self.assertEqual(tiled[0], tiled[1])
+
+    def test_tile_mosaic(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            west, east = os.path.join(tmp, "west.tif"), os.path.join(tmp, "east.tif")
+            make_raster(west, 512, (4.800, 45.70, 4.806, 45.71))
+            make_raster(east, 512, (4.804, 45.70, 4.810, 45.71))
+
+            out = os.path.join(tmp, "out")
+            main(parse_args(west, east, out, "--zoom", "18", "--ts", "256,256", "--no_web_ui"))
+            tiles = set(tiles_from_dir(out))
+
+            self.assertFalse(os.path.exists(os.path.join(out, ".splits")))
+            self.assertIn(mercantile.tile(4.805, 45.705, 18), tiles)  # covered by both rasters
+
+    def test_tile_nodata_prescreen(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for nodata, overviews in ((None, False), (None, True), (0, False)):
+                path = os.path.join(tmp, "rotated{}{}.tif".format(nodata, overviews))
+                bounds = make_raster(path, 1024, rotated=True, nodata=nodata, overviews=overviews)
+                tiles = list(mercantile.tiles(*bounds, 18))
+
+                with rasterio.open(path) as raster:
+                    screened = tiles_nodata_prescreen(raster, tiles, 0, 64)
+                if nodata is None and not overviews:  # neither mask, nor overviews, to screen tiles on
+                    self.assertEqual(screened, tiles)
+                else:
+                    self.assertLess(len(screened), len(tiles))
+
+                tiled = []
+                for prescreen in ("64", "0"):
+                    out = os.path.join(tmp, "out{}{}_{}".format(nodata, overviews, prescreen))
+                    main(
+                        parse_args(
+                            path, out, "--zoom", "18", "--ts", "256,256", "--nodata_prescreen", prescreen, "--no_web_ui"
+                        )
+                    )
+                    tiled.append(sorted(tiles_from_dir(out)))
+
+                self.assertTrue(tiled[0])
+                self.assertEqual(tiled[0], tiled[1])
+
+    def test_tile_zoom_range(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "raster.tif")
+            make_raster(path, 1024)
+
+            pyramid, single = os.path.join(tmp, "pyramid"), os.path.join(tmp, "single")
+            main(parse_args(path, pyramid, "--zoom", "16-18", "--ts", "256,256", "--no_web_ui"))
+            main(parse_args(path, single, "--zoom", "16", "--ts", "256,256", "--no_web_ui"))
+
+            tiles = list(tiles_from_dir(pyramid))
+            self.assertEqual({tile.z for tile in tiles}, {16, 17, 18})
+
+            for tile in tiles_from_dir(single):  # downsampled from z18, rather than read at z16
+                expected = tile_image_from_file(tile_from_xyz(single, tile.x, tile.y, tile.z)[1]).astype(int)
+                image = tile_image_from_file(tile_from_xyz(pyramid, tile.x, tile.y, tile.z)[1]).astype(int)
+                self.assertLess(np.abs(image - expected).mean(), 4)
+
+    def test_tile_zoom_range_chunks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "raster.tif")
+            make_raster(path, 1024)
+
+            whole, capped = os.path.join(tmp, "whole"), os.path.join(tmp, "capped")
+            main(parse_args(path, whole, "--zoom", "16-18", "--ts", "256,256", "--no_web_ui"))
+            main(parse_args(path, capped, "--zoom", "16-18", "--ts", "256,256", "--chunk_size", "4", "--no_web_ui"))
+
+            tiles = sorted(tiles_from_dir(whole))
+            self.assertEqual({tile.z for tile in tiles}, {16, 17, 18})
+            self.assertEqual(sorted(tiles_from_dir(capped)), tiles)
+            for tile in tiles:  # pyramids capped to 4 deepest tiles, shallower zooms built at last, in the very same way
+                expected = tile_image_from_file(tile_from_xyz(whole, tile.x, tile.y, tile.z)[1])
+                self.assertTrue(np.array_equal(tile_image_from_file(tile_from_xyz(capped, *tile)[1]), expected))
+
+            for tile in tiles:  # as interrupted, before shallower zooms were built
+                if tile.z < 17:
+                    os.remove(tile_from_xyz(capped, *tile)[1])
+            main(parse_args(path, capped, "--zoom", "16-18", "--ts", "256,256", "--chunk_size", "4", "--no_web_ui"))
+            self.assertEqual(sorted(tiles_from_dir(capped)), tiles)
+
+    def test_tile_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "raster.tif")
+            make_raster(path, 512)
+
+            out = os.path.join(tmp, "out")
+            main(parse_args(path, out, "--zoom", "18", "--ts", "256,256", "--no_web_ui"))
+            tiles = sorted(tiles_from_dir(out))
+            mtime = os.stat(tile_from_xyz(out, tiles[0].x, tiles[0].y, tiles[0].z)[1]).st_mtime_ns
+
+            main(parse_args(path, out, "--zoom", "18", "--ts", "256,256", "--no_web_ui"))  # nothing left to tile
+            self.assertEqual(os.stat(tile_from_xyz(out, tiles[0].x, tiles[0].y, tiles[0].z)[1]).st_mtime_ns, mtime)
+
+            make_raster(path, 512)  # source raster changed
+            main(parse_args(path, out, "--zoom", "18", "--ts", "256,256", "--no_web_ui"))
+            self.assertNotEqual(os.stat(tile_from_xyz(out, tiles[0].x, tiles[0].y, tiles[0].z)[1]).st_mtime_ns, mtime)
+
+    def test_tile_store(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "raster.tif")
+            make_raster(path, 512)
+
+            out, store, processes = os.path.join(tmp, "out"), os.path.join(tmp, "out.pack"), os.path.join(tmp, "p.pack")
+            main(parse_args(path, out, "--zoom", "18", "--ts", "256,256", "--no_web_ui"))
+            main(parse_args(path, store, "--zoom", "18", "--ts", "256,256", "--no_web_ui"))
+            main(parse_args(path, processes, "--zoom", "18", "--ts", "256,256", "--processes", "--no_web_ui"))
+
+            self.assertTrue(os.path.isfile(store) and os.path.isfile(store + ".manifest"))
+            self.assertEqual(sorted(tiles_from_dir(out)), sorted(tiles_from_dir(store)))
+            self.assertEqual(sorted(tiles_from_dir(out)), sorted(tiles_from_dir(processes)))
+
+            for tile in tiles_from_dir(out):
+                expected = tile_image_from_file(tile_from_xyz(out, tile.x, tile.y, tile.z)[1])
+                for root in (store, processes):
+                    image = tile_image_from_file(tile_from_xyz(root, tile.x, tile.y, tile.z)[1])
+                    self.assertTrue(np.array_equal(image, expected))
+
+
+def benchmark(size=8192, width=512, height=512):
+    """Compare tiles/sec between one WarpedVRT per tile, and one WarpedVRT per raster."""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "raster.tif")
+        make_raster(path, size, (4.80, 45.70, 4.85, 45.75))
+
+        with rasterio.open(path) as raster:
+            tiles = sorted(mercantile.tiles(4.80, 45.70, 4.85, 45.75, 18), key=lambda tile: (tile.y, tile.x))
+
+            tick = time.monotonic()
+            for tile in tiles:
+                tile_image_per_vrt(raster, tile, width, height)
+            per_tile = len(tiles) / (time.monotonic() - tick)
+
+            tick = time.monotonic()
+            warp_vrt, origin = tile_vrt(raster, tiles, width, height)
+            for tile in tiles:
+                tile_image_from_vrt(warp_vrt, origin, tile, width, height)
+            per_raster = len(tiles) / (time.monotonic() - tick)
+
+    print("{} tiles: per tile VRT: {:.1f} tiles/s, per raster VRT: {:.1f} tiles/s".format(len(tiles), per_tile, per_raster))
+
+
+if __name__ == "__main__":
+    benchmark(*map(int, sys.argv[1:]))
@@ -1,33 +1,40 @@
-import requests
 from robosat_pink.geoc import config as CONFIG
-from flask import Flask, request, Response
+from robosat_pink.geoc.proxy import TileProxy
+from flask import Flask, request, Response, jsonify, abort
 app = Flask(__name__)
 
+proxy = TileProxy({"tdt": CONFIG.URL_TDT, "google": CONFIG.URL_GOOGLE},
+                  CONFIG.WMTS_CACHE_PATH, CONFIG.WMTS_CACHE_MB << 20)
+
 
 @app.route('/')
 def hello_world():
     return 'Hello flask!'
 
 
-@app.route('/v1/wmts/<z>/<x>/<y>', methods=['GET'])
+@app.route('/v1/wmts/<int:z>/<int:x>/<int:y>', methods=['GET'])
 def wmts(x, y, z):
-    map = request.args.get("map")
-    if not x or not y or not z:
-        return None
-    if map and (map != "tdt" or map != "google"):
+    map = request.args.get("map") or "tdt"
+    if map not in ("tdt", "google"):
         return "faild to set map type, neither tianditu nor google"
-    url = CONFIG.URL_TDT
-    url_google = CONFIG.URL_GOOGLE
-    if map == 'google':
-        url = url_google
-    print(url.format(x=x, y=y, z=z))
-    image = requests.get(url.format(x=x, y=y, z=z))
 
-    return Response(image, mimetype='image/jpeg')
+    tile = proxy.get(map, z, x, y)
+    if tile is None:
+        abort(502)
+
+    data, mimetype = tile
+    return Response(data, mimetype=mimetype)
+
+
+@app.route('/v1/wmts/stats', methods=['GET'])
+def stats():
+    return jsonify(proxy.stats())
 
 
 if __name__ == '__main__':
-    app.run(port=CONFIG.FLASK_PORT)
+    app.run(port=CONFIG.FLASK_PORT, threaded=True)
 
 # How to run this server backend?
 # >: python xyz_proxy.py &
+# or, for an asynchronous one, handling hundreds of concurrent requests, on the same routes:
+# >: python -m robosat_pink.geoc.aioproxy &